@@ -1,41 +1,128 @@
 """
 Instagram Auto Post Tool V3 - Мультиаккаунтная система с AI-планированием
 """
-from flask import Flask, render_template, request, jsonify, session, send_from_directory
-from flask_cors import CORS
 import os
+
+# Под сервером gevent (python app.py) делаем блокирующий сетевой I/O кооперативным (до любых других импортов!).
+# При импорте приложения другими серверами (uvicorn, Celery) модули не патчим
+DEBUG_MODE = os.getenv('FLASK_DEBUG') == '1'
+if __name__ == '__main__' and not DEBUG_MODE:
+    from gevent import monkey
+    monkey.patch_all()
+    # gRPC-клиент Gemini работает в своих потоках - переводим его на цикл gevent
+    import grpc.experimental.gevent as grpc_gevent
+    grpc_gevent.init_gevent()
+
+from flask import Flask, Response, render_template, request, jsonify, session, send_from_directory
+from flask_cors import CORS
+from asgiref.wsgi import WsgiToAsgi
+import asyncio
+import concurrent.futures
+import orjson
+import queue
 import secrets
+import threading
+from collections import defaultdict
+from datetime import timedelta
 from dotenv import load_dotenv
 from pathlib import Path
+import google.generativeai as genai
 
 # Загружаем переменные окружения
 load_dotenv()
 
 # Импортируем модули
 from config import *
-from modules.account_manager import account_manager
+from modules.account_manager import account_manager, to_public_dict
 from modules.post_manager import post_manager
 from modules.scheduler import post_scheduler
 from modules.ai_planner import AIPlanner
 from modules.content_generator import ContentGenerator
 from background_publisher import background_publisher
-from utils.logger import log_info, log_success, log_error, get_logs
+from utils.logger import log_info, log_success, log_error, get_logs, subscribe_logs, unsubscribe_logs
+from utils.rate_limiter import GEMINI_RPM, gemini_rate_limiter
+from utils.semantic_cache import SemanticCache
+from utils.gemini_models import InstructionModel
+from utils.gemini_errors import is_quota_exhausted, is_rate_limit_error, retry_wait_time
+from utils.http_client import http_session
 
 # Создаем Flask приложение
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', secrets.token_hex(32))
 CORS(app)
 
+# Шаблоны не меняются в продакшене - не проверяем их mtime на каждый рендер
+app.config['TEMPLATES_AUTO_RELOAD'] = DEBUG_MODE
+app.jinja_env.auto_reload = DEBUG_MODE
+
+# За nginx/Apache отдаем медиафайлы через X-Sendfile (без копирования через Python)
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE') == '1'
+
 # Инициализируем AI модули
 gemini_api_key = os.getenv('GEMINI_API_KEY')
 kling_api_key = os.getenv('KLING_API_KEY')
 
-ai_planner = AIPlanner(gemini_api_key) if gemini_api_key else None
-content_generator = ContentGenerator(gemini_api_key) if gemini_api_key else None
+if gemini_api_key:
+    genai.configure(api_key=gemini_api_key)
+
+def _embed_text(text: str) -> list:
+    """Эмбеддинг текста через Gemini (для семантического кэша)"""
+    result = genai.embed_content(model='models/text-embedding-004', content=text)
+    return result['embedding']
+
+# Кэш планов AI-планировщика (повторяющиеся инструкции не тратят квоту Gemini)
+plan_cache = SemanticCache(PLAN_CACHE_FILE, _embed_text, threshold=0.90) if gemini_api_key else None
 
 # Видео генератор
 from modules.video_generator import VideoGenerator
-video_generator = VideoGenerator(kling_api_key) if kling_api_key else None
+video_generator = VideoGenerator(kling_api_key, session=http_session) if kling_api_key else None
+
+ai_planner = AIPlanner(gemini_api_key, plan_cache=plan_cache) if gemini_api_key else None
+content_generator = ContentGenerator(gemini_api_key, session=http_session,
+                                     video_generator=video_generator) if gemini_api_key else None
+
+# Публикация через Celery-воркеры (если настроен брокер), иначе - фоновый поток в процессе
+USE_CELERY = bool(os.getenv('CELERY_BROKER_URL'))
+if USE_CELERY:
+    from tasks import celery, publish_post_task, generate_posts_batch_task
+
+# Семантический кэш видео-промптов (похожие темы не тратят квоту Gemini)
+video_prompt_cache = SemanticCache(VIDEO_PROMPT_CACHE_FILE, _embed_text) if gemini_api_key else None
+
+def orjson_response(payload, status: int = 200) -> Response:
+    """JSON-ответ, сериализованный через orjson (быстрее jsonify на больших данных)"""
+    return Response(orjson.dumps(payload), status=status, mimetype='application/json')
+
+# ==================== VIDEO PROMPT MODEL ====================
+
+VIDEO_PROMPT_MODEL_NAME = 'gemini-2.0-flash-exp'
+VIDEO_PROMPT_CACHE_TTL = timedelta(hours=1)
+
+VIDEO_PROMPT_INSTRUCTION = """Ты - эксперт по созданию промптов для генерации видео. На основе темы пользователя создай ДИНАМИЧЕСКИЙ промпт на английском языке для AI генератора видео.
+
+ВАЖНО:
+1. Сфокусируйся на ДВИЖЕНИИ и ДЕЙСТВИИ - опиши что происходит в кадре
+2. Укажи движение камеры (camera pans, zooms, tracking shot, etc.) если уместно
+3. Опиши динамическую сцену с действием, движением объектов, изменениями
+4. НЕ включай текст в видео (no text overlay, no words)
+5. Добавь детали: темп движения, освещение, настроение, стиль
+6. Промпт должен быть 30-80 слов
+
+ПРИМЕРЫ:
+- Тема: "Закат на море" → "Cinematic sunset over ocean, waves gently rolling, camera slowly panning left, golden hour lighting, seagulls flying across frame, peaceful atmosphere, warm colors, smooth motion"
+- Тема: "Городская жизнь" → "Busy city street time-lapse, people walking fast, cars moving, camera tracking forward, urban energy, evening lights turning on, dynamic movement, modern cityscape"
+
+Верни ТОЛЬКО промпт на английском, без объяснений и комментариев."""
+
+# Единственная изменяемая часть запроса
+VIDEO_PROMPT_TOPIC_FMT = "ТЕМА: {topic}"
+
+_video_prompt_model = InstructionModel(VIDEO_PROMPT_MODEL_NAME, VIDEO_PROMPT_INSTRUCTION, 'видео-промпт',
+                                       ttl=VIDEO_PROMPT_CACHE_TTL)
+
+def get_video_prompt_model():
+    """Модель для видео-промптов; статические инструкции хранятся в кэше контекста Gemini"""
+    return _video_prompt_model.get()
 
 # ==================== STARTUP ====================
 
@@ -45,17 +132,25 @@ def startup():
     log_info("🚀 Запуск Instagram Auto Post Tool V3")
     log_info("=" * 50)
     
-    # Автологин всех аккаунтов
+    # Автологин аккаунтов и проверка запланированных постов независимы - выполняем параллельно
     log_info("🔐 Автологин аккаунтов...")
-    account_manager.auto_login_all()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        login_future = executor.submit(account_manager.auto_login_all)
+        scheduled_future = executor.submit(post_manager.get_scheduled_posts)
+        concurrent.futures.wait([login_future, scheduled_future])
     
-    # Запускаем фоновый публикатор
-    log_info("📅 Запуск фонового публикатора...")
-    background_publisher.start()
+    # Поддерживаем сессии залогиненных аккаунтов
+    account_manager.start_keepalive()
+    
+    # Запускаем фоновый публикатор после автологина (с Celery расписание проверяет celery beat)
+    if USE_CELERY:
+        log_info("📅 Публикация выполняется воркерами Celery")
+    else:
+        log_info("📅 Запуск фонового публикатора...")
+        background_publisher.start()
     
     # Проверяем запланированные посты
-    from modules.post_manager import post_manager
-    scheduled_count = len(post_manager.get_scheduled_posts())
+    scheduled_count = len(scheduled_future.result())
     if scheduled_count > 0:
         log_info(f"📋 Найдено {scheduled_count} запланированных постов")
     else:
@@ -63,6 +158,30 @@ def startup():
     
     log_success("✅ Приложение успешно запущено и готово к работе!")
 
+# ASGI-обёртка для запуска под uvicorn-воркером (см. README)
+_wsgi_asgi_app = WsgiToAsgi(app)
+
+async def asgi_app(scope, receive, send):
+    """ASGI-приложение: HTTP - через обёртку WSGI, startup() - по событию lifespan в каждом воркере"""
+    if scope['type'] != 'lifespan':
+        await _wsgi_asgi_app(scope, receive, send)
+        return
+    
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                # Автологин блокирующий - не держим цикл событий воркера
+                await asyncio.to_thread(startup)
+            except Exception as e:
+                log_error(f"❌ Ошибка запуска приложения: {e}")
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
 # ==================== ACCOUNT MANAGEMENT ====================
 
 @app.route('/api/accounts', methods=['GET'])
@@ -71,13 +190,9 @@ def get_accounts():
     accounts = account_manager.get_all_accounts()
     
     # Убираем зашифрованные пароли из ответа
-    safe_accounts = []
-    for acc in accounts:
-        safe_acc = acc.copy()
-        safe_acc.pop('password', None)
-        safe_accounts.append(safe_acc)
+    safe_accounts = [to_public_dict(acc) for acc in accounts]
     
-    return jsonify({'success': True, 'accounts': safe_accounts})
+    return orjson_response({'success': True, 'accounts': safe_accounts})
 
 @app.route('/api/accounts', methods=['POST'])
 def create_account():
@@ -107,18 +222,15 @@ def create_account():
         )
         
         # Убираем пароль
-        account_safe = account.copy()
-        account_safe.pop('password', None)
-        
-        return jsonify({'success': True, 'account': account_safe})
+        return jsonify({'success': True, 'account': to_public_dict(account)})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
 @app.route('/api/accounts/<account_id>/login', methods=['POST'])
-def login_account(account_id):
+async def login_account(account_id):
     """Войти в аккаунт"""
     try:
-        success = account_manager.login_account(account_id)
+        success = await account_manager.login_account_async(account_id)
         
         if success:
             return jsonify({'success': True, 'message': 'Успешный вход'})
@@ -148,7 +260,7 @@ def delete_account(account_id):
 # ==================== AI PLANNER ====================
 
 @app.route('/api/ai/create-plan', methods=['POST'])
-def create_plan():
+async def create_plan():
     """Создать план публикаций через AI"""
     if not ai_planner:
         return jsonify({'success': False, 'error': 'Gemini API не настроен'}), 400
@@ -167,14 +279,30 @@ def create_plan():
             return jsonify({'success': False, 'error': 'Нет активных аккаунтов'}), 400
         
         # Создаем план
-        plan = ai_planner.create_plan(instruction, active_accounts)
+        plan = await asyncio.to_thread(ai_planner.create_plan, instruction, active_accounts)
         
         return jsonify({'success': True, 'plan': plan})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
+async def _schedule_for_account(account_plan: dict, posts_by_account: dict):
+    """Планирует время публикации постов одного аккаунта"""
+    account_id = account_plan['account_id']
+    posts_per_day = account_plan['posts_per_day']
+    
+    # Получаем посты этого аккаунта
+    account_post_ids = posts_by_account.get(account_id, [])
+    
+    # Планируем (работа с диском - в отдельном потоке)
+    await asyncio.to_thread(
+        post_scheduler.schedule_posts_for_account,
+        account_id,
+        account_post_ids,
+        posts_per_day
+    )
+
 @app.route('/api/ai/generate-posts', methods=['POST'])
-def generate_posts():
+async def generate_posts():
     """Генерировать посты по плану"""
     if not content_generator:
         return jsonify({'success': False, 'error': 'Gemini API не настроен'}), 400
@@ -185,24 +313,32 @@ def generate_posts():
     if not plan:
         return jsonify({'success': False, 'error': 'Требуется план'}), 400
     
+    if data.get('use_batch_api'):
+        # Ответ Batch API ждется до 24 часов - генерируем в воркере Celery, не занимая HTTP-воркер
+        if not USE_CELERY:
+            return jsonify({'success': False, 'error': 'Пакетная генерация доступна только с Celery (CELERY_BROKER_URL)'}), 400
+        
+        task = generate_posts_batch_task.delay(plan)
+        return jsonify({
+            'success': True,
+            'message': 'Пакетная генерация постов поставлена в очередь',
+            'job_id': task.id
+        }), 202
+    
     try:
         # Генерируем посты
-        posts = content_generator.generate_posts_from_plan(plan)
+        posts = await asyncio.to_thread(content_generator.generate_posts_from_plan, plan)
         
-        # Планируем время публикации для каждого аккаунта
-        for account_plan in plan['accounts']:
-            account_id = account_plan['account_id']
-            posts_per_day = account_plan['posts_per_day']
-            
-            # Получаем посты этого аккаунта
-            account_post_ids = [p['id'] for p in posts if p['account_id'] == account_id]
-            
-            # Планируем
-            post_scheduler.schedule_posts_for_account(
-                account_id,
-                account_post_ids,
-                posts_per_day
-            )
+        # Группируем посты по аккаунтам за один проход
+        posts_by_account = defaultdict(list)
+        for post in posts:
+            posts_by_account[post['account_id']].append(post['id'])
+        
+        # Планируем время публикации для всех аккаунтов параллельно
+        await asyncio.gather(*[
+            _schedule_for_account(account_plan, posts_by_account)
+            for account_plan in plan['accounts']
+        ])
         
         return jsonify({
             'success': True,
@@ -212,6 +348,21 @@ def generate_posts():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
+@app.route('/api/ai/generate-posts/<job_id>', methods=['GET'])
+def get_generate_posts_job(job_id):
+    """Статус пакетной генерации постов"""
+    if not USE_CELERY:
+        return jsonify({'success': False, 'error': 'Celery не настроен'}), 400
+    
+    result = celery.AsyncResult(job_id)
+    response = {'success': True, 'job_id': job_id, 'state': result.state}
+    if result.successful():
+        response['posts_count'] = result.result
+    elif result.failed():
+        response['error'] = str(result.result)
+    
+    return jsonify(response)
+
 # ==================== POST MANAGEMENT ====================
 
 @app.route('/api/posts', methods=['GET'])
@@ -226,7 +377,7 @@ def get_posts():
         else:
             posts = post_manager.get_all_posts(status)
         
-        return jsonify({'success': True, 'posts': posts})
+        return orjson_response({'success': True, 'posts': posts})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
@@ -292,6 +443,8 @@ def delete_post(post_id):
 def publish_now(post_id):
     """Опубликовать пост немедленно (работает для любого статуса: draft, scheduled)"""
     try:
+        # Брошенный захват публикации (воркер остановлен) переводится в ошибку - такой пост можно повторить
+        post_manager.expire_claims()
         post = post_manager.get_post(post_id)
         
         if not post:
@@ -300,9 +453,20 @@ def publish_now(post_id):
         # Проверяем что пост не опубликован уже
         if post['status'] == POST_STATUS['PUBLISHED']:
             return jsonify({'success': False, 'error': 'Пост уже опубликован'}), 400
+        if post['status'] == POST_STATUS['PUBLISHING']:
+            return jsonify({'success': False, 'error': 'Пост уже публикуется'}), 400
         
         log_info(f"📤 Ручная публикация поста {post_id} (статус: {post['status']})")
         
+        if USE_CELERY:
+            # Ставим в очередь воркерам, не блокируя запрос
+            task = publish_post_task.delay(post_id)
+            return jsonify({
+                'success': True,
+                'message': 'Пост поставлен в очередь на публикацию',
+                'task_id': task.id
+            }), 202
+        
         # Публикуем через фоновый публикатор
         background_publisher._publish_post(post)
         
@@ -312,7 +476,7 @@ def publish_now(post_id):
         return jsonify({'success': False, 'error': str(e)}), 400
 
 @app.route('/api/posts/<post_id>/regenerate-text', methods=['POST'])
-def regenerate_text(post_id):
+async def regenerate_text(post_id):
     """Перегенерировать текст поста"""
     if not content_generator:
         return jsonify({'success': False, 'error': 'Gemini API не настроен'}), 400
@@ -323,13 +487,13 @@ def regenerate_text(post_id):
     keywords = data.get('keywords', [])
     
     try:
-        new_text = content_generator.regenerate_text(post_id, theme, language, keywords)
+        new_text = await asyncio.to_thread(content_generator.regenerate_text, post_id, theme, language, keywords)
         return jsonify({'success': True, 'text': new_text})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
 @app.route('/api/posts/<post_id>/regenerate-image', methods=['POST'])
-def regenerate_image(post_id):
+async def regenerate_image(post_id):
     """Перегенерировать изображение поста"""
     if not content_generator:
         return jsonify({'success': False, 'error': 'Gemini API не настроен'}), 400
@@ -338,7 +502,7 @@ def regenerate_image(post_id):
     prompt = data.get('prompt', '')
     
     try:
-        new_image = content_generator.regenerate_image(post_id, prompt)
+        new_image = await asyncio.to_thread(content_generator.regenerate_image, post_id, prompt)
         return jsonify({'success': True, 'image': new_image})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
@@ -346,7 +510,7 @@ def regenerate_image(post_id):
 # ==================== VIDEO GENERATION ====================
 
 @app.route('/api/generate-video', methods=['POST'])
-def generate_video():
+async def generate_video():
     """Генерировать видео через Kling AI"""
     if not video_generator:
         return jsonify({'success': False, 'error': 'Kling AI API не настроен. Добавьте KLING_API_KEY в .env файл'}), 400
@@ -361,7 +525,8 @@ def generate_video():
         return jsonify({'success': False, 'error': 'Требуется промпт'}), 400
     
     try:
-        result = video_generator.generate_video(
+        result = await asyncio.to_thread(
+            video_generator.generate_video,
             prompt=prompt,
             duration=duration,
             aspect_ratio=aspect_ratio,
@@ -373,7 +538,7 @@ def generate_video():
         return jsonify({'success': False, 'error': str(e)}), 400
 
 @app.route('/api/generate-video-from-image', methods=['POST'])
-def generate_video_from_image():
+async def generate_video_from_image():
     """Генерировать видео из изображения через Kling AI"""
     if not video_generator:
         return jsonify({'success': False, 'error': 'Kling AI API не настроен'}), 400
@@ -393,7 +558,8 @@ def generate_video_from_image():
         if not image_path.exists():
             return jsonify({'success': False, 'error': 'Изображение не найдено'}), 404
         
-        result = video_generator.generate_video_from_image(
+        result = await asyncio.to_thread(
+            video_generator.generate_video_from_image,
             prompt=prompt,
             image_path=str(image_path),
             duration=duration,
@@ -404,8 +570,61 @@ def generate_video_from_image():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
+# Запросы к Gemini в процессе выполнения: тема -> Future с результатом (payload, status)
+_inflight_video_prompts = {}
+_inflight_video_prompts_lock = threading.Lock()
+
+async def _request_video_prompt(topic: str):
+    """Запрашивает видео-промпт у Gemini с повтором при ошибке квоты"""
+    # Статические инструкции уже в модели - отправляем только тему
+    prompt = VIDEO_PROMPT_TOPIC_FMT.format(topic=topic)
+    
+    # Вызов с повтором при ошибке квоты
+    max_retries = 2
+    for attempt in range(max_retries):
+        try:
+            # Используем rate limiter (блокирующий - выносим в поток)
+            await asyncio.to_thread(gemini_rate_limiter.wait_if_needed)
+            
+            log_info(f"🤖 Запрос к Gemini API для генерации видео-промпта (попытка {attempt + 1}/{max_retries})...")
+            
+            model = await asyncio.to_thread(get_video_prompt_model)
+            # Модель общая для всех запросов, а ее async-клиент привязан к циклу событий первого вызова -
+            # используем синхронный вызов в потоке
+            response = await asyncio.to_thread(model.generate_content, prompt)
+            
+            log_info(f"✅ Видео-промпт получен от Gemini API")
+            
+            video_prompt = response.text.strip()
+            await asyncio.to_thread(video_prompt_cache.put, topic, video_prompt)
+            
+            return {'success': True, 'prompt': video_prompt}, 200
+        except Exception as e:
+            error_str = str(e)
+            
+            if is_rate_limit_error(error_str):
+                # Дневной лимит исчерпан - повторять бессмысленно
+                if is_quota_exhausted(error_str):
+                    log_error("❌ Дневной лимит Gemini API исчерпан")
+                    return {'success': False, 'error': 'Дневной лимит запросов Gemini API исчерпан. Попробуйте после сброса квоты.'}, 429
+                
+                if attempt < max_retries - 1:
+                    # Время ожидания из ответа сервера (без умножения на номер попытки)
+                    wait_time = retry_wait_time(error_str, attempt)
+                    
+                    log_info(f"⏳ Достигнут лимит Gemini API. Ожидание {wait_time:.0f} секунд...")
+                    await asyncio.sleep(wait_time)
+                    continue
+                else:
+                    log_error(f"❌ Превышен лимит запросов Gemini API после {max_retries} попыток.")
+                    return {'success': False, 'error': 'Превышен лимит запросов Gemini API. Пожалуйста, подождите несколько минут (достигнут дневной лимит 50 запросов для бесплатного тарифа).'}, 429
+            
+            raise e
+    
+    return {'success': False, 'error': 'Не удалось сгенерировать промпт после нескольких попыток'}, 400
+
 @app.route('/api/generate-video-prompt', methods=['POST'])
-def generate_video_prompt():
+async def generate_video_prompt():
     """Генерировать промпт для видео через Gemini"""
     if not gemini_api_key:
         return jsonify({'success': False, 'error': 'Gemini API не настроен'}), 400
@@ -417,72 +636,39 @@ def generate_video_prompt():
         return jsonify({'success': False, 'error': 'Требуется тема'}), 400
     
     try:
-        import google.generativeai as genai
-        import time
-        import re
-        from utils.rate_limiter import gemini_rate_limiter
-        
-        genai.configure(api_key=gemini_api_key)
-        
-        prompt = f"""Ты - эксперт по созданию промптов для генерации видео. На основе следующей темы создай ДИНАМИЧЕСКИЙ промпт на английском языке для AI генератора видео.
-
-ТЕМА: {topic}
-
-ВАЖНО:
-1. Сфокусируйся на ДВИЖЕНИИ и ДЕЙСТВИИ - опиши что происходит в кадре
-2. Укажи движение камеры (camera pans, zooms, tracking shot, etc.) если уместно
-3. Опиши динамическую сцену с действием, движением объектов, изменениями
-4. НЕ включай текст в видео (no text overlay, no words)
-5. Добавь детали: темп движения, освещение, настроение, стиль
-6. Промпт должен быть 30-80 слов
-
-ПРИМЕРЫ:
-- Тема: "Закат на море" → "Cinematic sunset over ocean, waves gently rolling, camera slowly panning left, golden hour lighting, seagulls flying across frame, peaceful atmosphere, warm colors, smooth motion"
-- Тема: "Городская жизнь" → "Busy city street time-lapse, people walking fast, cars moving, camera tracking forward, urban energy, evening lights turning on, dynamic movement, modern cityscape"
-
-Верни ТОЛЬКО промпт на английском, без объяснений и комментариев."""
-        
-        # Вызов с повтором при ошибке квоты
-        max_retries = 2
-        for attempt in range(max_retries):
-            try:
-                # Используем rate limiter
-                gemini_rate_limiter.wait_if_needed()
-                
-                log_info(f"🤖 Запрос к Gemini API для генерации видео-промпта (попытка {attempt + 1}/{max_retries})...")
-                
-                model = genai.GenerativeModel('gemini-2.0-flash-exp')
-                response = model.generate_content(prompt)
-                
-                log_info(f"✅ Видео-промпт получен от Gemini API")
-                
-                return jsonify({
-                    'success': True,
-                    'prompt': response.text.strip()
-                })
-            except Exception as e:
-                error_str = str(e)
-                
-                if "429" in error_str or "quota" in error_str.lower() or "rate" in error_str.lower():
-                    # Извлекаем время ожидания
-                    match = re.search(r'retry in (\d+(?:\.\d+)?)', error_str, re.IGNORECASE)
-                    retry_seconds = int(float(match.group(1))) + 1 if match else 30
-                    
-                    if attempt < max_retries - 1:
-                        # Exponential backoff
-                        backoff_multiplier = 2 ** attempt
-                        wait_time = retry_seconds * backoff_multiplier + 5
-                        
-                        log_info(f"⏳ Достигнут лимит Gemini API. Ожидание {wait_time} секунд...")
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        log_error(f"❌ Превышен лимит запросов Gemini API после {max_retries} попыток.")
-                        return jsonify({'success': False, 'error': 'Превышен лимит запросов Gemini API. Пожалуйста, подождите несколько минут (достигнут дневной лимит 50 запросов для бесплатного тарифа).'}), 429
-                
-                raise e
-        
-        return jsonify({'success': False, 'error': 'Не удалось сгенерировать промпт после нескольких попыток'}), 400
+        # Проверяем семантический кэш до обращения к Gemini
+        cached_prompt = await asyncio.to_thread(video_prompt_cache.get, topic)
+        if cached_prompt:
+            return jsonify({'success': True, 'prompt': cached_prompt})
+        
+        # Если такой же запрос уже выполняется - ждем его результат вместо повторного вызова
+        with _inflight_video_prompts_lock:
+            future = _inflight_video_prompts.get(topic)
+            is_owner = future is None
+            if is_owner:
+                future = concurrent.futures.Future()
+                _inflight_video_prompts[topic] = future
+        
+        if not is_owner:
+            log_info(f"🔗 Запрос видео-промпта по теме '{topic[:50]}' уже выполняется, ожидаем результат")
+            payload, status = await asyncio.wrap_future(future)
+            return jsonify(payload), status
+        
+        try:
+            payload, status = await _request_video_prompt(topic)
+            future.set_result((payload, status))
+        except BaseException as e:
+            # В том числе CancelledError (клиент отключился) - иначе ожидающие запросы зависнут.
+            # Ожидающим отдаем обычную ошибку: их собственные запросы не отменены
+            if not isinstance(e, Exception):
+                e = Exception("Запрос видео-промпта прерван")
+            future.set_exception(e)
+            raise
+        finally:
+            with _inflight_video_prompts_lock:
+                _inflight_video_prompts.pop(topic, None)
+        
+        return jsonify(payload), status
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
@@ -491,26 +677,43 @@ def generate_video_prompt():
 @app.route('/api/photos/<filename>')
 def get_photo(filename):
     """Получить фото"""
-    return send_from_directory(PHOTOS_DIR, filename)
+    return send_from_directory(PHOTOS_DIR, filename, max_age=MEDIA_CACHE_MAX_AGE, conditional=True)
 
 @app.route('/api/videos/<filename>')
 def get_video(filename):
     """Получить видео"""
-    return send_from_directory(VIDEOS_DIR, filename)
+    return send_from_directory(VIDEOS_DIR, filename, max_age=MEDIA_CACHE_MAX_AGE, conditional=True)
+
+# Кэш листинга медиа-директорий: директория -> (mtime, список файлов)
+_listing_cache = {}
+
+def _list_media_files(directory: Path, extension: str) -> list:
+    """Список медиафайлов с метаданными (кэшируется до изменения директории)"""
+    mtime = directory.stat().st_mtime
+    cached = _listing_cache.get(directory)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    
+    # Один проход scandir: stat берется из DirEntry без отдельного запроса на файл
+    with os.scandir(directory) as entries:
+        files = [
+            {
+                'filename': entry.name,
+                'timestamp': entry.name[:-len(extension)],
+                'size': entry.stat().st_size
+            }
+            for entry in entries
+            if entry.name.endswith(extension) and entry.is_file()
+        ]
+    
+    _listing_cache[directory] = (mtime, files)
+    return files
 
 @app.route('/api/media/photos', methods=['GET'])
 def list_photos():
     """Получить список всех фото с метаданными"""
     try:
-        files = []
-        for file in PHOTOS_DIR.glob('*.jpg'):
-            timestamp = file.stem
-            files.append({
-                'filename': file.name,
-                'timestamp': timestamp,
-                'size': file.stat().st_size
-            })
-        
+        files = _list_media_files(PHOTOS_DIR, '.jpg')
         return jsonify({'success': True, 'files': files})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
@@ -519,15 +722,7 @@ def list_photos():
 def list_videos():
     """Получить список всех видео с метаданными"""
     try:
-        files = []
-        for file in VIDEOS_DIR.glob('*.mp4'):
-            timestamp = file.stem
-            files.append({
-                'filename': file.name,
-                'timestamp': timestamp,
-                'size': file.stat().st_size
-            })
-        
+        files = _list_media_files(VIDEOS_DIR, '.mp4')
         return jsonify({'success': True, 'files': files})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
@@ -536,13 +731,12 @@ def list_videos():
 def get_photo_metadata(filename):
     """Получить метаданные фото"""
     try:
-        import json
         metadata_file = PHOTOS_DIR / f"{Path(filename).stem}.json"
         
         if metadata_file.exists():
-            with open(metadata_file, 'r', encoding='utf-8') as f:
-                metadata = json.load(f)
-            return jsonify(metadata)
+            with open(metadata_file, 'rb') as f:
+                metadata = orjson.loads(f.read())
+            return orjson_response(metadata)
         else:
             return jsonify({'prompt': 'Метаданные не найдены'})
     except Exception as e:
@@ -552,13 +746,12 @@ def get_photo_metadata(filename):
 def get_video_metadata(filename):
     """Получить метаданные видео"""
     try:
-        import json
         metadata_file = VIDEOS_DIR / f"{Path(filename).stem}.json"
         
         if metadata_file.exists():
-            with open(metadata_file, 'r', encoding='utf-8') as f:
-                metadata = json.load(f)
-            return jsonify(metadata)
+            with open(metadata_file, 'rb') as f:
+                metadata = orjson.loads(f.read())
+            return orjson_response(metadata)
         else:
             return jsonify({'prompt': 'Метаданные не найдены'})
     except Exception as e:
@@ -573,42 +766,63 @@ def get_app_logs():
     
     try:
         logs = get_logs(limit)
-        return jsonify({'success': True, 'logs': logs})
+        return orjson_response({'success': True, 'logs': logs})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
+@app.route('/api/logs/stream', methods=['GET'])
+def stream_app_logs():
+    """Поток новых записей лога (Server-Sent Events)"""
+    def generate():
+        subscriber = subscribe_logs()
+        try:
+            while True:
+                try:
+                    line = subscriber.get(timeout=15)
+                except queue.Empty:
+                    # Keep-alive, чтобы прокси не закрывали соединение
+                    yield ": keep-alive\n\n"
+                    continue
+                
+                yield f"data: {orjson.dumps(line).decode()}\n\n"
+        finally:
+            unsubscribe_logs(subscriber)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
 @app.route('/api/publisher/status', methods=['GET'])
 def get_publisher_status():
     """Получить статус фонового публикатора"""
     try:
-        is_running = background_publisher.running
+        is_running = USE_CELERY or background_publisher.running
         scheduled_posts = post_manager.get_scheduled_posts()
         
         return jsonify({
             'success': True,
             'publisher_running': is_running,
             'scheduled_posts_count': len(scheduled_posts),
-            'scheduled_posts': scheduled_posts
+            'scheduled_posts': scheduled_posts,
+            'account_queues': background_publisher.get_queue_depths()
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
+# Неизменяемый справочный блок статистики Gemini - сериализуется один раз
+GEMINI_INFO_JSON = orjson.dumps({
+    'free_tier_limit': '50 запросов в день',
+    'rate_limit': f'{GEMINI_RPM} запросов в минуту',
+    'recommendation': 'Не генерируйте более 20-25 постов за раз'
+})
+
 @app.route('/api/gemini/stats', methods=['GET'])
 def get_gemini_stats():
     """Получить статистику использования Gemini API"""
     try:
-        from utils.rate_limiter import gemini_rate_limiter
         stats = gemini_rate_limiter.get_stats()
         
-        return jsonify({
-            'success': True,
-            'stats': stats,
-            'info': {
-                'free_tier_limit': '50 запросов в день',
-                'rate_limit': '2.5 секунды между запросами',
-                'recommendation': 'Не генерируйте более 20-25 постов за раз'
-            }
-        })
+        # Дописываем заранее сериализованный блок info в конец объекта
+        body = orjson.dumps({'success': True, 'stats': stats})[:-1] + b',"info":' + GEMINI_INFO_JSON + b'}'
+        return Response(body, mimetype='application/json')
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
@@ -656,4 +870,11 @@ if __name__ == '__main__':
     startup()
     
     # Запускаем сервер
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    if DEBUG_MODE:
+        # Локальная разработка: dev-сервер Werkzeug.
+        # Без reloader - иначе startup() выполняется дважды (в двух процессах)
+        app.run(debug=True, use_reloader=False, threaded=True, host='0.0.0.0', port=5000)
+    else:
+        from gevent.pywsgi import WSGIServer
+        log_info("🌐 Сервер gevent слушает 0.0.0.0:5000")
+        WSGIServer(('0.0.0.0', 5000), app).serve_forever()
@@ -1,18 +1,30 @@
 """
 Фоновый публикатор - автоматическая публикация постов по расписанию
 """
+import os
+import queue
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from pathlib import Path
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
 
 from modules.post_manager import post_manager
 from modules.account_manager import account_manager
 from modules.scheduler import post_scheduler
 from utils.logger import log_info, log_success, log_error, log_post_published, log_post_error
-from utils.datetime_helper import parse_iso_datetime
-from config import POST_STATUS
+from utils.datetime_helper import parse_iso_datetime_cached
+from utils.media_index import media_index
+from config import POST_STATUS_DRAFT, MAX_POSTS_PER_DAY, MIN_POST_INTERVAL
+
+# Максимальный сон цикла публикатора (подхватывает изменения из других процессов)
+MAX_IDLE_WAIT = 60
+# Интервал повтора для постов, время которых уже пришло, но публикация отложена
+RETRY_WAIT = 30
+# Как часто (секунды) писать сводку о готовых постах
+SUMMARY_LOG_INTERVAL = 60
+# Максимум аккаунтов, публикуемых одновременно
+MAX_PUBLISH_WORKERS = 8
 
 class BackgroundPublisher:
     """Фоновый публикатор постов"""
@@ -20,6 +32,15 @@ class BackgroundPublisher:
     def __init__(self):
         self.running = False
         self.thread = None
+        # Будит цикл публикатора раньше срока (новые запланированные посты, остановка)
+        self._wake = threading.Event()
+        # Очереди публикации по аккаунтам: лимиты Instagram действуют на аккаунт
+        self.account_queues = {}  # account_id -> queue.SimpleQueue
+        # Пул публикации аккаунтов - один на все проверки (создается при первой публикации, потоки переиспользуются)
+        self.executor = None
+        # Уже залогированные состояния постов (post_id, событие) - повторные циклы не спамят лог
+        self._logged_events = set()
+        self._last_summary_log = 0.0
     
     def start(self):
         """Запускает фоновый публикатор"""
@@ -28,6 +49,7 @@ class BackgroundPublisher:
             return
         
         self.running = True
+        post_manager.add_schedule_listener(self.notify)
         self.thread = threading.Thread(target=self._run, daemon=True)
         self.thread.start()
         log_success("Фоновый публикатор запущен")
@@ -35,14 +57,18 @@ class BackgroundPublisher:
     def stop(self):
         """Останавливает фоновый публикатор"""
         self.running = False
+        self._wake.set()
         if self.thread:
             self.thread.join(timeout=5)
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
         log_info("Фоновый публикатор остановлен")
     
     def _run(self):
         """Основной цикл публикатора"""
         log_info("🚀 Фоновый публикатор начал работу")
-        log_info("⏰ Проверка запланированных постов каждые 30 секунд")
+        log_info("⏰ Проверка запланированных постов по мере наступления времени публикации")
         
         while self.running:
             try:
@@ -50,24 +76,54 @@ class BackgroundPublisher:
             except Exception as e:
                 log_error(f"❌ Ошибка в фоновом публикаторе: {e}")
             
-            # Проверяем каждые 30 секунд для более точной публикации
-            time.sleep(30)
+            # Спим до ближайшего поста (или до сигнала о новом запланированном посте)
+            self._wake.wait(self._seconds_until_next_check())
+            self._wake.clear()
+    
+    def notify(self):
+        """Будит публикатор для внеочередной проверки"""
+        self._wake.set()
+    
+    def _log_once(self, post_id: str, event: str, message: str):
+        """Логирует событие поста только при первом наступлении"""
+        key = (post_id, event)
+        if key not in self._logged_events:
+            self._logged_events.add(key)
+            log_info(message)
+    
+    def _seconds_until_next_check(self) -> float:
+        """Время до следующей проверки: до открытия окна публикации ближайшего поста"""
+        next_time = post_manager.get_next_scheduled_time()
+        
+        if next_time is None:
+            return MAX_IDLE_WAIT
+        
+        # Пост публикуется начиная с 2 минут до запланированного времени
+        seconds = (next_time - datetime.now()).total_seconds() - 120
+        if seconds <= 0:
+            # Есть просроченные/отложенные посты - повторяем через обычный интервал
+            return RETRY_WAIT
+        return min(MAX_IDLE_WAIT, max(1, seconds))
     
     def _check_and_publish(self):
         """Проверяет и публикует посты, время которых пришло"""
         now = datetime.now()
         
-        # Получаем все запланированные посты
-        scheduled_posts = post_manager.get_scheduled_posts()
+        # Получаем только посты, время публикации которых наступило (O(log N) по куче)
+        scheduled_posts = post_manager.get_due_posts()
         
         if not scheduled_posts:
-            return  # Нет запланированных постов
+            self._logged_events.clear()
+            return  # Нет постов к публикации
+        
+        # Сводка - не чаще раза в минуту, а не на каждом цикле
+        if time.time() - self._last_summary_log > SUMMARY_LOG_INTERVAL:
+            self._last_summary_log = time.time()
+            log_info(f"🔍 Готово к публикации постов: {len(scheduled_posts)}")
         
         posts_to_publish = []
         posts_to_move_to_drafts = []
         
-        log_info(f"🔍 Проверка {len(scheduled_posts)} запланированных постов...")
-        
         for post in scheduled_posts:
             try:
                 post_id = post.get('id')
@@ -76,12 +132,10 @@ class BackgroundPublisher:
                     continue
                 
                 # Парсим время с поддержкой JavaScript формата (.000Z)
-                scheduled_time = parse_iso_datetime(post['scheduled_time'])
+                scheduled_time = parse_iso_datetime_cached(post['scheduled_time'])
                 time_diff = (now - scheduled_time).total_seconds()
                 minutes_diff = time_diff / 60
                 
-                log_info(f"📅 Пост {post_id}: запланирован на {scheduled_time.strftime('%H:%M:%S')}, разница: {minutes_diff:.1f} мин")
-                
                 # Если пост сильно просрочен (больше 1 часа) - возвращаем в черновики ОДИН РАЗ
                 if time_diff > 3600:  # 1 час
                     # Проверяем, не был ли уже перемещен
@@ -91,15 +145,13 @@ class BackgroundPublisher:
                     continue
                 
                 # Если время пришло или немного прошло (публикуем!)
-                if -120 <= time_diff <= 600:  # от -2 минут до +10 минут
-                    log_info(f"✅ Пост {post_id} готов к публикации (разница: {minutes_diff:.1f} мин)")
+                # get_due_posts уже отсекает посты раньше чем за 2 минуты до времени
+                if time_diff <= 600:  # до +10 минут
+                    self._log_once(post_id, 'ready', f"✅ Пост {post_id} готов к публикации (разница: {minutes_diff:.1f} мин)")
                     posts_to_publish.append((post, scheduled_time))
-                elif time_diff < -120:
-                    # Слишком рано
-                    log_info(f"⏰ Пост {post_id} будет опубликован через {-minutes_diff:.0f} минут")
                 else:
                     # Прошло больше 10 минут, но меньше часа - тоже публикуем
-                    log_info(f"⚠️ Пост {post_id} опоздал на {minutes_diff:.0f} минут, но публикуем")
+                    self._log_once(post_id, 'late', f"⚠️ Пост {post_id} опоздал на {minutes_diff:.0f} минут, но публикуем")
                     posts_to_publish.append((post, scheduled_time))
                     
             except Exception as e:
@@ -115,11 +167,8 @@ class BackgroundPublisher:
                 if not post:
                     continue
                 
-                # Удаляем из scheduled
-                post_manager._delete_post_file(post_id, POST_STATUS['SCHEDULED'])
-                
-                # Создаем в drafts с новыми данными
-                post['status'] = POST_STATUS['DRAFT']
+                # Переводим в черновики с новыми данными
+                post['status'] = POST_STATUS_DRAFT
                 post['scheduled_time'] = None
                 post['error'] = 'Пропущена запланированная публикация (сервер был выключен)'
                 post_manager._save_post(post)
@@ -133,30 +182,69 @@ class BackgroundPublisher:
         
         # Публикуем посты
         if posts_to_publish:
-            log_info(f"📋 Публикуем {len(posts_to_publish)} постов...")
+            self._publish_batch(posts_to_publish, now)
+        
+        # Забываем посты, которые больше не ждут публикации
+        due_ids = {post.get('id') for post in scheduled_posts}
+        self._logged_events = {key for key in self._logged_events if key[0] in due_ids}
+    
+    def _publish_batch(self, posts_to_publish: List[Tuple[Dict, datetime]], now: datetime):
+        """Публикует посты: разные аккаунты параллельно, внутри аккаунта - по очереди"""
+        for post, scheduled_time in posts_to_publish:
+            account_queue = self.account_queues.setdefault(post['account_id'], queue.SimpleQueue())
+            account_queue.put((post, scheduled_time))
+        
+        account_ids = [account_id for account_id, account_queue in self.account_queues.items()
+                       if not account_queue.empty()]
+        if not account_ids:
+            return
+        
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=MAX_PUBLISH_WORKERS, thread_name_prefix='publisher')
+        list(self.executor.map(lambda account_id: self._drain_account_queue(account_id, now), account_ids))
+    
+    def _drain_account_queue(self, account_id: str, now: datetime):
+        """Публикует все посты из очереди одного аккаунта"""
+        account_queue = self.account_queues[account_id]
+        
+        while True:
+            try:
+                post, scheduled_time = account_queue.get_nowait()
+            except queue.Empty:
+                break
             
-            for post, scheduled_time in posts_to_publish:
-                try:
-                    post_id = post['id']
-                    time_str = scheduled_time.strftime('%H:%M:%S %d.%m.%Y')
-                    log_info(f"🚀 Публикация поста {post_id} (запланировано на {time_str})")
-                    
-                    self._publish_post(post)
-                    
-                    # Небольшая пауза между публикациями
-                    time.sleep(5)
-                    
-                except Exception as e:
-                    log_error(f"❌ Ошибка публикации поста {post.get('id')}: {e}")
-        else:
-            if len(scheduled_posts) > 0:
-                log_info(f"⏳ Нет постов готовых к публикации. Ожидаем...")
+            post_id = post['id']
+            
+            # Интервал между постами аккаунта еще не прошел - не ждем, повторим на следующем цикле
+            wait_seconds = self._seconds_until_allowed(account_id, now)
+            if wait_seconds > 0:
+                self._log_once(post_id, 'deferred', f"⏰ Пост {post_id} отложен на {wait_seconds / 60:.0f} мин (интервал между постами аккаунта)")
+                continue
+            
+            try:
+                time_str = scheduled_time.strftime('%H:%M:%S %d.%m.%Y')
+                self._log_once(post_id, 'publishing', f"🚀 Публикация поста {post_id} (запланировано на {time_str})")
+                
+                self._publish_post(post, now)
+            except Exception as e:
+                log_error(f"❌ Ошибка публикации поста {post_id}: {e}")
+    
+    def get_queue_depths(self) -> Dict[str, int]:
+        """Возвращает количество постов в очереди каждого аккаунта"""
+        return {account_id: account_queue.qsize()
+                for account_id, account_queue in self.account_queues.items()}
     
-    def _publish_post(self, post: Dict):
+    def _publish_post(self, post: Dict, now: Optional[datetime] = None):
         """Публикует пост"""
         post_id = post['id']
         account_id = post['account_id']
         
+        # Захват поста: тот же пост не опубликуют параллельно другой поток, воркер Celery или ручная публикация
+        previous_status = post_manager.claim_post(post_id)
+        if previous_status is None:
+            log_info(f"⏭️ Пост {post_id} уже публикуется или опубликован, пропускаем")
+            return
+        
         try:
             # Получаем аккаунт и клиент
             account = account_manager.get_account(account_id)
@@ -164,7 +252,6 @@ class BackgroundPublisher:
                 raise Exception(f"Аккаунт {account_id} не найден")
             
             username = account['username']
-            log_info(f"📱 Публикация от имени @{username}")
             
             client = account_manager.get_client(account_id)
             if not client:
@@ -179,8 +266,8 @@ class BackgroundPublisher:
                     raise Exception(f"Клиент для аккаунта @{username} не инициализирован")
             
             # Проверяем лимиты Instagram
-            log_info(f"✓ Проверка лимитов публикации...")
-            self._check_instagram_limits(account_id)
+            self._check_instagram_limits(account_id, now or datetime.now())
+            log_info(f"📱 Публикация от имени @{username}")
             
             # Публикуем
             caption = post.get('text', '')
@@ -192,29 +279,22 @@ class BackgroundPublisher:
             log_info(f"📁 Подготовка медиафайлов: {media_files}")
             
             # Формируем полные пути
-            from config import PHOTOS_DIR, VIDEOS_DIR
-            
             media_paths = []
             for filename in media_files:
-                # Пробуем найти в photos или videos
-                photo_path = PHOTOS_DIR / filename
-                video_path = VIDEOS_DIR / filename
-                
-                if photo_path.exists():
-                    media_paths.append(str(photo_path))
-                    log_info(f"✓ Найдено фото: {filename}")
-                elif video_path.exists():
-                    media_paths.append(str(video_path))
-                    log_info(f"✓ Найдено видео: {filename}")
-                else:
+                # Ищем в индексе photos/videos
+                media_path = media_index.get(filename)
+                if not media_path:
                     raise Exception(f"Медиафайл не найден: {filename}")
+                
+                media_paths.append(media_path)
+                log_info(f"✓ Найден медиафайл: {media_path}")
             
             # Публикуем в зависимости от типа
             log_info(f"🚀 Загрузка в Instagram...")
             
             # ВАЖНО: Проверяем реальный тип файла, а не только format
             if post.get('format') == 'video' and len(media_paths) == 1:
-                file_extension = Path(media_paths[0]).suffix.lower()
+                file_extension = os.path.splitext(media_paths[0])[1].lower()
                 
                 # Проверяем, действительно ли это видео файл
                 if file_extension in ['.mp4', '.mov', '.avi']:
@@ -248,9 +328,9 @@ class BackgroundPublisher:
             
             # Если ошибка "Слишком рано" - откладываем публикацию
             if "Слишком рано" in error_msg or "wait" in error_msg.lower():
-                log_info(f"⏰ Пост {post_id} отложен: {error_msg}")
-                log_info(f"🔄 Попытка публикации будет повторена через 30 секунд...")
-                # НЕ помечаем как error, оставляем в scheduled
+                self._log_once(post_id, 'deferred', f"⏰ Пост {post_id} отложен: {error_msg}. Публикация будет повторяться каждые {RETRY_WAIT} секунд")
+                # НЕ помечаем как error, возвращаем прежний статус
+                post_manager.release_post(post_id, previous_status)
                 return
             
             # Для других ошибок - помечаем как error
@@ -258,36 +338,28 @@ class BackgroundPublisher:
             log_post_error(post_id, error_msg)
             log_error(f"💥 Не удалось опубликовать пост {post_id}: {error_msg}")
     
-    def _check_instagram_limits(self, account_id: str):
-        """Проверяет лимиты Instagram"""
-        from config import DEFAULT_SETTINGS
-        
-        # Получаем посты за сегодня
-        today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    def _seconds_until_allowed(self, account_id: str, now: datetime) -> float:
+        """Сколько секунд осталось до окончания минимального интервала между постами аккаунта"""
+        _, last_time = post_manager.get_publish_stats(account_id)
+        if not last_time:
+            return 0
         
-        published_posts = post_manager.get_posts_by_account(
-            account_id,
-            POST_STATUS["PUBLISHED"]
-        )
-        
-        today_posts = [
-            p for p in published_posts
-            if p.get('published_at') and 
-            datetime.fromisoformat(p['published_at']) >= today_start
-        ]
+        elapsed = (now - last_time).total_seconds()
+        return MIN_POST_INTERVAL * 60 - elapsed
+    
+    def _check_instagram_limits(self, account_id: str, now: datetime):
+        """Проверяет лимиты Instagram до обращения к API (по счетчикам в памяти)"""
+        today_count, last_time = post_manager.get_publish_stats(account_id)
         
-        if len(today_posts) >= DEFAULT_SETTINGS['max_posts_per_day']:
-            raise Exception(f"Превышен лимит: максимум {DEFAULT_SETTINGS['max_posts_per_day']} постов в день")
+        if today_count >= MAX_POSTS_PER_DAY:
+            raise Exception(f"Превышен лимит: максимум {MAX_POSTS_PER_DAY} постов в день")
         
         # Проверяем интервал между постами
-        if today_posts:
-            last_post = max(today_posts, key=lambda x: x.get('published_at', ''))
-            last_time = datetime.fromisoformat(last_post['published_at'])
-            time_diff = (datetime.now() - last_time).total_seconds() / 60
+        if last_time:
+            time_diff = (now - last_time).total_seconds() / 60
             
-            min_interval = DEFAULT_SETTINGS['min_post_interval']
-            if time_diff < min_interval:
-                raise Exception(f"Слишком рано! Нужно подождать еще {min_interval - time_diff:.0f} минут")
+            if time_diff < MIN_POST_INTERVAL:
+                raise Exception(f"Слишком рано! Нужно подождать еще {MIN_POST_INTERVAL - time_diff:.0f} минут")
 
 # Глобальный экземпляр
 background_publisher = BackgroundPublisher()
@@ -1,6 +1,7 @@
 """
 Глобальные настройки приложения
 """
+import os
 from pathlib import Path
 
 # Базовые пути
@@ -13,14 +14,18 @@ PHOTOS_DIR = MEDIA_DIR / 'photos'
 VIDEOS_DIR = MEDIA_DIR / 'videos'
 LOGS_DIR = DATA_DIR / 'logs'
 
-# Подпапки для постов
+# Подпапки для постов (старый формат хранения - файлы переносятся в журнал постов при запуске)
 DRAFTS_DIR = POSTS_DIR / 'drafts'
 SCHEDULED_DIR = POSTS_DIR / 'scheduled'
 PUBLISHED_DIR = POSTS_DIR / 'published'
 
 # Файлы
 SCHEDULER_FILE = DATA_DIR / 'scheduler.json'
+POSTS_DB_FILE = DATA_DIR / 'posts.db'
+POSTS_STORE_FILE = POSTS_DIR / 'posts.jsonl'
 APP_LOG_FILE = LOGS_DIR / 'app.log'
+VIDEO_PROMPT_CACHE_FILE = DATA_DIR / 'video_prompt_cache.jsonl'
+PLAN_CACHE_FILE = DATA_DIR / 'plan_cache.jsonl'
 
 # Создаем все необходимые директории
 DIRECTORIES = [
@@ -29,8 +34,10 @@ DIRECTORIES = [
     DRAFTS_DIR, SCHEDULED_DIR, PUBLISHED_DIR
 ]
 
+# stat дешевле mkdir с EEXIST - создаем только отсутствующие папки
 for directory in DIRECTORIES:
-    directory.mkdir(parents=True, exist_ok=True)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
 
 # Настройки по умолчанию
 DEFAULT_SETTINGS = {
@@ -44,6 +51,13 @@ DEFAULT_SETTINGS = {
     "default_posts_per_day": 3,  # По умолчанию 3 поста в день (оптимизация для Gemini API)
 }
 
+# Лимиты публикации (константы для горячих путей публикатора)
+MIN_POST_INTERVAL = DEFAULT_SETTINGS["min_post_interval"]
+MAX_POSTS_PER_DAY = DEFAULT_SETTINGS["max_posts_per_day"]
+
+# Медиафайлы неизменяемы (имя = временная метка) - кэшируем в браузере на год
+MEDIA_CACHE_MAX_AGE = 31536000
+
 # Размеры изображений
 IMAGE_SIZES = {
     "square": {"width": 1080, "height": 1080},
@@ -72,10 +86,15 @@ ACCOUNT_STATUS = {
 POST_STATUS = {
     "DRAFT": "draft",
     "SCHEDULED": "scheduled",
+    "PUBLISHING": "publishing",
     "PUBLISHED": "published",
     "ERROR": "error"
 }
 
+POST_STATUS_DRAFT = POST_STATUS["DRAFT"]
+POST_STATUS_SCHEDULED = POST_STATUS["SCHEDULED"]
+POST_STATUS_PUBLISHED = POST_STATUS["PUBLISHED"]
+
 # Форматы постов
 POST_FORMATS = ["photo", "video"]
 
@@ -1,24 +1,49 @@
 """
 Менеджер аккаунтов Instagram
 """
-import json
+import asyncio
+import os
+import shutil
+import threading
+import time
 import uuid
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, List, Optional
+import orjson
 from instagrapi import Client
-import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from config import ACCOUNTS_DIR, ACCOUNT_STATUS
 from utils.encryption import encrypt_password, decrypt_password
 from utils.logger import log_info, log_success, log_error, log_account_login
 
+# Максимум одновременных логинов при автологине и общий таймаут ожидания (секунды)
+AUTO_LOGIN_MAX_WORKERS = 8
+AUTO_LOGIN_TIMEOUT = 120
+# Потоки для параллельного чтения конфигов аккаунтов при запуске
+ACCOUNT_LOAD_MAX_WORKERS = 8
+# Интервал keep-alive запросов для поддержания сессий (секунды)
+KEEPALIVE_INTERVAL = 600
+
+# Поля аккаунта, которые можно отдавать клиенту (без пароля)
+PUBLIC_ACCOUNT_FIELDS = (
+    'id', 'username', 'status', 'last_login', 'theme',
+    'language', 'posts_per_day', 'format', 'created_at'
+)
+
+def to_public_dict(account: Dict) -> Dict:
+    """Проекция аккаунта без чувствительных данных"""
+    return {key: account[key] for key in PUBLIC_ACCOUNT_FIELDS if key in account}
+
 class AccountManager:
     """Управление множественными Instagram аккаунтами"""
     
     def __init__(self):
         self.accounts = {}
         self.clients = {}  # account_id -> Client
+        self.password_cache = {}  # account_id -> расшифрованный пароль (только в памяти)
+        self.keepalive_thread = None
         self.load_all_accounts()
     
     def load_all_accounts(self):
@@ -26,16 +51,30 @@ class AccountManager:
         if not ACCOUNTS_DIR.exists():
             return
         
-        for account_dir in ACCOUNTS_DIR.iterdir():
-            if account_dir.is_dir():
-                config_file = account_dir / 'config.json'
-                if config_file.exists():
-                    try:
-                        with open(config_file, 'r', encoding='utf-8') as f:
-                            account_data = json.load(f)
-                            self.accounts[account_data['id']] = account_data
-                    except Exception as e:
-                        log_error(f"Ошибка загрузки аккаунта из {account_dir}: {e}")
+        # scandir берет тип записи из readdir - без отдельного stat на каждую папку
+        with os.scandir(ACCOUNTS_DIR) as entries:
+            account_dirs = [entry.path for entry in entries if entry.is_dir(follow_symlinks=False)]
+        
+        if not account_dirs:
+            return
+        
+        # Читаем конфиги параллельно - чтения небольших файлов с диска перекрываются
+        with ThreadPoolExecutor(max_workers=min(ACCOUNT_LOAD_MAX_WORKERS, len(account_dirs))) as executor:
+            for account_data in executor.map(self._read_account_config, account_dirs):
+                if account_data:
+                    self.accounts[account_data['id']] = account_data
+    
+    def _read_account_config(self, account_dir: str) -> Optional[Dict]:
+        """Читает конфигурацию аккаунта из его папки"""
+        config_file = Path(account_dir) / 'config.json'
+        if not config_file.exists():
+            return None
+        
+        try:
+            return orjson.loads(config_file.read_bytes())
+        except Exception as e:
+            log_error(f"Ошибка загрузки аккаунта из {account_dir}: {e}")
+            return None
     
     def create_account(self, username: str, password: str, 
                       theme: str = "", language: str = "русский",
@@ -61,9 +100,7 @@ class AccountManager:
         account_dir.mkdir(parents=True, exist_ok=True)
         
         # Сохраняем конфигурацию
-        config_file = account_dir / 'config.json'
-        with open(config_file, 'w', encoding='utf-8') as f:
-            json.dump(account_data, f, ensure_ascii=False, indent=2)
+        self._write_config(account_dir / 'config.json', account_data)
         
         # Создаем файл логов
         log_file = account_dir / 'logs.txt'
@@ -81,7 +118,7 @@ class AccountManager:
         
         account = self.accounts[account_id]
         username = account['username']
-        password = decrypt_password(account['password'])
+        password = self._get_password(account_id)
         
         # Обновляем статус
         self._update_account_status(account_id, ACCOUNT_STATUS["LOGGING_IN"])
@@ -156,13 +193,13 @@ class AccountManager:
         """Удаляет аккаунт"""
         if account_id in self.clients:
             del self.clients[account_id]
+        self.password_cache.pop(account_id, None)
         
         if account_id in self.accounts:
             username = self.accounts[account_id]['username']
             del self.accounts[account_id]
             
             # Удаляем директорию
-            import shutil
             account_dir = ACCOUNTS_DIR / account_id
             if account_dir.exists():
                 shutil.rmtree(account_dir)
@@ -184,29 +221,108 @@ class AccountManager:
     
     def get_client(self, account_id: str) -> Optional[Client]:
         """Получает Instagram клиент для аккаунта"""
-        return self.clients.get(account_id)
+        client = self.clients.get(account_id)
+        if client is None:
+            client = self._restore_client(account_id)
+        return client
+    
+    def _restore_client(self, account_id: str) -> Optional[Client]:
+        """Восстанавливает клиент из сохраненной сессии без полного входа"""
+        account = self.accounts.get(account_id)
+        if not account or account['status'] != ACCOUNT_STATUS["ACTIVE"]:
+            return None
+        
+        session_file = ACCOUNTS_DIR / account_id / 'session.json'
+        if not session_file.exists():
+            return None
+        
+        try:
+            client = Client()
+            client.delay_range = [1, 3]
+            client.load_settings(session_file)
+        except Exception as e:
+            log_error(f"Не удалось восстановить сессию @{account['username']}: {e}")
+            return None
+        
+        self.clients[account_id] = client
+        log_info(f"Клиент @{account['username']} восстановлен из сохраненной сессии")
+        return client
+    
+    def start_keepalive(self):
+        """Запускает фоновое поддержание сессий активных клиентов"""
+        if self.keepalive_thread:
+            return
+        
+        self.keepalive_thread = threading.Thread(target=self._keepalive_loop, daemon=True)
+        self.keepalive_thread.start()
+    
+    def _keepalive_loop(self):
+        """Периодически обращается к ленте, чтобы сессии не остывали"""
+        while True:
+            time.sleep(KEEPALIVE_INTERVAL)
+            
+            for account_id, client in list(self.clients.items()):
+                try:
+                    client.get_timeline_feed()
+                except Exception as e:
+                    # Клиент не пересоздаем - при публикации сработает обычный повторный вход
+                    username = self.accounts.get(account_id, {}).get('username', account_id)
+                    log_error(f"Keep-alive сессии @{username} не удался: {e}")
+    
+    async def login_account_async(self, account_id: str, executor: Optional[ThreadPoolExecutor] = None) -> bool:
+        """Асинхронный вход в аккаунт (у instagrapi нет async-клиента - вход выполняется в пуле потоков)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, self.login_account, account_id)
     
     def auto_login_all(self):
         """Автоматически входит во все аккаунты при запуске"""
         log_info("Начало автологина всех аккаунтов...")
         
-        threads = []
-        for account_id in self.accounts:
-            thread = threading.Thread(
-                target=self.login_account,
-                args=(account_id,)
-            )
-            threads.append(thread)
-            thread.start()
-        
-        # Ждем завершения всех потоков
-        for thread in threads:
-            thread.join()
+        account_ids = list(self.accounts)
+        if account_ids:
+            asyncio.run(self._auto_login_async(account_ids))
         
         active_count = len(self.get_active_accounts())
         total_count = len(self.accounts)
         log_success(f"Автологин завершен: {active_count}/{total_count} аккаунтов активны")
     
+    async def _auto_login_async(self, account_ids: List[str]):
+        """Входит во все аккаунты одновременно (не больше AUTO_LOGIN_MAX_WORKERS за раз)"""
+        # Свой пул, а не пул по умолчанию: asyncio.run не должен ждать зависшие логины
+        executor = ThreadPoolExecutor(max_workers=min(AUTO_LOGIN_MAX_WORKERS, len(account_ids)))
+        
+        try:
+            results = await asyncio.wait_for(
+                asyncio.gather(*(self.login_account_async(account_id, executor) for account_id in account_ids),
+                               return_exceptions=True),
+                timeout=AUTO_LOGIN_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            pending = [account_id for account_id in account_ids
+                       if self.accounts.get(account_id, {}).get('status') == ACCOUNT_STATUS["LOGGING_IN"]]
+            log_error(f"Автологин не завершился за {AUTO_LOGIN_TIMEOUT} секунд для {len(pending)} аккаунтов")
+            return
+        finally:
+            # Не ждем зависшие логины - они завершатся в фоне
+            executor.shutdown(wait=False)
+        
+        for account_id, result in zip(account_ids, results):
+            username = self.accounts.get(account_id, {}).get('username', account_id)
+            if isinstance(result, Exception):
+                log_error(f"Ошибка автологина @{username}: {result}")
+            elif not result:
+                log_info(f"Автологин @{username} не удался")
+    
+    def _get_password(self, account_id: str) -> str:
+        """Расшифрованный пароль аккаунта (расшифровываем один раз на процесс)"""
+        password = self.password_cache.get(account_id)
+        if password is None:
+            password = decrypt_password(self.accounts[account_id]['password'])
+            # Неудачную расшифровку не кешируем
+            if password:
+                self.password_cache[account_id] = password
+        return password
+    
     def _update_account_status(self, account_id: str, status: str):
         """Обновляет статус аккаунта"""
         if account_id in self.accounts:
@@ -219,10 +335,13 @@ class AccountManager:
             return
         
         account_dir = ACCOUNTS_DIR / account_id
-        config_file = account_dir / 'config.json'
-        
-        with open(config_file, 'w', encoding='utf-8') as f:
-            json.dump(self.accounts[account_id], f, ensure_ascii=False, indent=2)
+        self._write_config(account_dir / 'config.json', self.accounts[account_id])
+    
+    def _write_config(self, config_file: Path, account_data: Dict):
+        """Атомарно записывает конфигурацию (через временный файл и os.replace)"""
+        tmp_file = config_file.with_suffix('.tmp')
+        tmp_file.write_bytes(orjson.dumps(account_data, option=orjson.OPT_INDENT_2))
+        os.replace(tmp_file, config_file)
 
 # Глобальный экземпляр менеджера
 account_manager = AccountManager()
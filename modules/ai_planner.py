@@ -1,19 +1,70 @@
 """
 AI-планировщик контента через Gemini
 """
-import json
+import hashlib
 import time
 import re
-from typing import Dict, List
+import orjson
+from typing import Dict, List, Optional
 import google.generativeai as genai
 from utils.logger import log_info, log_error, log_success
 from utils.rate_limiter import gemini_rate_limiter
+from utils.semantic_cache import SemanticCache
+from utils.gemini_models import InstructionModel
+from utils.gemini_errors import (MAX_RATE_LIMIT_RETRIES, MAX_TRANSIENT_RETRIES, QuotaExhaustedError,
+                                 is_quota_exhausted, is_rate_limit_error, is_transient_error, parse_retry_delay,
+                                 retry_wait_time, transient_wait_time)
+
+PLANNER_MODEL_NAME = 'gemini-2.0-flash-exp'
+
+# Числа в инструкции (входят в ключ кэша планов)
+NUMBER_RE = re.compile(r'\d+')
+# JSON в markdown-блоке ```json ... ```
+JSON_FENCE_RE = re.compile(r'^\s*```(?:json)?\s*(.*?)\s*```\s*$', re.DOTALL)
+
+# Статическая часть промпта планировщика (хранится в кэше контекста Gemini)
+PLANNER_INSTRUCTION = """Ты — планировщик контента для Instagram. 
+Пользователь даёт тебе инструкции, а ты создаёшь структурированный план.
+
+Верни JSON в таком формате:
+{
+  "accounts": [
+    {
+      "account_id": "account_1",
+      "username": "@sportblog_kz",
+      "theme": "спорт",
+      "language": "русский",
+      "posts_per_day": 5,
+      "format": "photo",
+      "keywords": ["тренировки", "фитнес", "здоровье"]
+    }
+  ],
+  "total_posts": 15,
+  "duration_days": 1
+}
+
+Правила:
+- Используй только аккаунты из списка доступных
+- Если аккаунт не указан в инструкции, не включай его
+- posts_per_day не более 10 (лимит Instagram)
+- format: "photo" или "video"
+- language: язык контента (русский, казахский, английский и т.д.)
+- theme: основная тематика аккаунта
+- keywords: 5-10 ключевых слов для генерации контента
+- Если в инструкции не указано количество постов, используй 5 постов в день
+- Если не указан формат, используй "photo"
+
+Верни ТОЛЬКО JSON, без дополнительного текста."""
 
 class AIPlanner:
     """AI-планировщик для создания планов публикаций"""
     
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, plan_cache: Optional[SemanticCache] = None):
         self.api_key = api_key
+        # Кэш планов: похожая инструкция для того же набора аккаунтов не требует запроса к Gemini
+        self.plan_cache = plan_cache
+        self.model = InstructionModel(PLANNER_MODEL_NAME, PLANNER_INSTRUCTION, 'планировщик',
+                                      generation_config={'response_mime_type': 'application/json'})
         if api_key:
             genai.configure(api_key=api_key)
     
@@ -31,70 +82,46 @@ class AIPlanner:
         if not self.api_key:
             raise Exception("Gemini API не настроен")
         
+        cache_namespace = self._plan_cache_namespace(instruction, available_accounts)
+        if self.plan_cache:
+            cached_plan = self.plan_cache.get(instruction, cache_namespace)
+            if cached_plan:
+                validated_plan = self._validate_plan(orjson.loads(cached_plan), available_accounts)
+                log_success(f"План взят из кэша: {validated_plan['total_posts']} постов для {len(validated_plan['accounts'])} аккаунтов")
+                return validated_plan
+        
         # Формируем список доступных аккаунтов
         accounts_list = "\n".join([
             f"- {acc['username']} (ID: {acc['id']})"
             for acc in available_accounts
         ])
         
-        system_prompt = f"""Ты — планировщик контента для Instagram. 
-Пользователь даёт тебе инструкции, а ты создаёшь структурированный план.
-
-Доступные аккаунты (залогиненные):
+        # Меняется только эта часть запроса
+        prompt = f"""Доступные аккаунты (залогиненные):
 {accounts_list}
 
-Верни JSON в таком формате:
-{{
-  "accounts": [
-    {{
-      "account_id": "account_1",
-      "username": "@sportblog_kz",
-      "theme": "спорт",
-      "language": "русский",
-      "posts_per_day": 5,
-      "format": "photo",
-      "keywords": ["тренировки", "фитнес", "здоровье"]
-    }}
-  ],
-  "total_posts": 15,
-  "duration_days": 1
-}}
-
-Правила:
-- Если аккаунт не указан в инструкции, не включай его
-- posts_per_day не более 10 (лимит Instagram)
-- format: "photo" или "video"
-- language: язык контента (русский, казахский, английский и т.д.)
-- theme: основная тематика аккаунта
-- keywords: 5-10 ключевых слов для генерации контента
-- Если в инструкции не указано количество постов, используй 5 постов в день
-- Если не указан формат, используй "photo"
-
 ИНСТРУКЦИЯ ПОЛЬЗОВАТЕЛЯ:
-{instruction}
-
-Верни ТОЛЬКО JSON, без дополнительного текста."""
+{instruction}"""
 
         try:
             log_info("Отправка запроса в Gemini для создания плана...")
             
             # Вызываем Gemini с повтором при ошибке квоты
-            response_text = self._call_gemini_with_retry(system_prompt)
+            response_text = self._call_gemini_with_retry(prompt)
             
-            # Извлекаем JSON из ответа
-            response_text = response_text.strip()
+            # Ответ запрашивается в JSON-режиме; markdown-блок снимаем на всякий случай
+            fence_match = JSON_FENCE_RE.match(response_text)
+            if fence_match:
+                response_text = fence_match.group(1)
             
-            # Убираем markdown форматирование если есть
-            if response_text.startswith('```'):
-                response_text = response_text.split('```')[1]
-                if response_text.startswith('json'):
-                    response_text = response_text[4:]
-            
-            plan = json.loads(response_text)
+            plan = orjson.loads(response_text)
             
             # Валидация плана
             validated_plan = self._validate_plan(plan, available_accounts)
             
+            if self.plan_cache:
+                self.plan_cache.put(instruction, orjson.dumps(validated_plan).decode(), cache_namespace)
+            
             log_success(f"План создан: {validated_plan['total_posts']} постов для {len(validated_plan['accounts'])} аккаунтов")
             
             return validated_plan
@@ -103,16 +130,39 @@ class AIPlanner:
             log_error(f"Ошибка создания плана: {e}")
             raise
     
-    def _call_gemini_with_retry(self, prompt: str, max_retries: int = 1000) -> str:
-        """Вызывает Gemini с автоматическим повтором при ошибке квоты"""
-        model = genai.GenerativeModel('gemini-2.0-flash-exp')
+    def _plan_cache_namespace(self, instruction: str, available_accounts: List[Dict]) -> str:
+        """
+        Ключ группы кэша планов: набор аккаунтов + ключевые детали инструкции
+        
+        Числа и упомянутые аккаунты почти не меняют эмбеддинг,
+        но меняют план - поэтому они сравниваются точно
+        """
+        accounts_hash = hashlib.sha1(
+            ','.join(sorted(acc['id'] for acc in available_accounts)).encode()
+        ).hexdigest()[:16]
+        
+        instruction_lower = instruction.lower()
+        mentioned = sorted(acc['username'].lower().lstrip('@') for acc in available_accounts
+                           if acc['username'].lower().lstrip('@') in instruction_lower)
+        numbers = NUMBER_RE.findall(instruction)
         
-        for attempt in range(max_retries):
+        return f"{accounts_hash}|{','.join(mentioned)}|{','.join(numbers)}"
+    
+    def _call_gemini_with_retry(self, prompt: str, max_retries: int = MAX_RATE_LIMIT_RETRIES) -> str:
+        """
+        Вызывает Gemini с повтором: ошибки квоты и временные ошибки - по отдельным лимитам попыток,
+        остальные ошибки - без повтора
+        """
+        model = self.model.get()
+        rate_attempts = 0
+        transient_attempts = 0
+        
+        while True:
             try:
                 # ВАЖНО: Ждем согласно rate limiter перед каждым запросом
                 gemini_rate_limiter.wait_if_needed()
                 
-                log_info(f"🤖 Запрос к Gemini API для создания плана (попытка {attempt + 1}/{max_retries})...")
+                log_info(f"🤖 Запрос к Gemini API для создания плана...")
                 response = model.generate_content(prompt)
                 
                 log_info(f"✅ План получен от Gemini API")
@@ -122,38 +172,36 @@ class AIPlanner:
                 error_str = str(e)
                 
                 # Проверяем, является ли это ошибкой квоты (429)
-                if "429" in error_str or "quota" in error_str.lower() or "rate" in error_str.lower():
-                    # Извлекаем время ожидания из ошибки
-                    retry_seconds = self._extract_retry_delay(error_str)
+                if is_rate_limit_error(error_str):
+                    # Дневной лимит исчерпан - ждать сброса квоты (часы) бессмысленно
+                    if is_quota_exhausted(error_str):
+                        log_error("❌ Дневной лимит Gemini API исчерпан")
+                        raise QuotaExhaustedError("Дневной лимит запросов Gemini API исчерпан. Попробуйте после сброса квоты.",
+                                                 wait_seconds=parse_retry_delay(error_str))
                     
-                    if attempt < max_retries - 1:
-                        # Увеличиваем время ожидания с каждой попыткой (exponential backoff)
-                        backoff_multiplier = 2 ** attempt  # 1x, 2x
-                        wait_time = retry_seconds * backoff_multiplier + 5  # +5 секунд для безопасности
+                    rate_attempts += 1
+                    if rate_attempts < max_retries:
+                        # Время ожидания из ответа сервера (без умножения на номер попытки)
+                        wait_time = retry_wait_time(error_str, rate_attempts - 1)
                         
-                        log_info(f"⏳ Достигнут лимит Gemini API. Ожидание {wait_time} секунд перед повтором (попытка {attempt + 1}/{max_retries})...")
+                        log_info(f"⏳ Достигнут лимит Gemini API. Ожидание {wait_time:.0f} секунд перед повтором (попытка {rate_attempts}/{max_retries})...")
                         time.sleep(wait_time)
                         continue
                     else:
                         log_error(f"❌ Превышен лимит запросов Gemini API после {max_retries} попыток.")
                         raise Exception(f"Превышен лимит запросов Gemini API. Пожалуйста, подождите несколько минут (достигнут дневной лимит 50 запросов для бесплатного тарифа).")
                 
+                # Временная ошибка сервера/сети - быстрый повтор
+                if is_transient_error(error_str) and transient_attempts < MAX_TRANSIENT_RETRIES:
+                    transient_attempts += 1
+                    wait_time = transient_wait_time(transient_attempts)
+                    log_info(f"🔄 Временная ошибка Gemini API: {e}. Повтор через {wait_time:.0f} секунд ({transient_attempts}/{MAX_TRANSIENT_RETRIES})...")
+                    time.sleep(wait_time)
+                    continue
+                
                 # Другие ошибки
                 log_error(f"Ошибка генерации через Gemini: {e}")
                 raise
-        
-        raise Exception("Не удалось создать план после нескольких попыток")
-    
-    def _extract_retry_delay(self, error_message: str) -> int:
-        """Извлекает время ожидания из сообщения об ошибке"""
-        # Ищем паттерн "retry in X.Xs" или "retry in Xs"
-        match = re.search(r'retry in (\d+(?:\.\d+)?)', error_message, re.IGNORECASE)
-        if match:
-            seconds = float(match.group(1))
-            return int(seconds) + 1  # Округляем вверх
-        
-        # По умолчанию ждем 30 секунд
-        return 30
     
     def _validate_plan(self, plan: Dict, available_accounts: List[Dict]) -> Dict:
         """Валидирует план"""
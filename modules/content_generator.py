@@ -1,109 +1,274 @@
 """
 Генератор контента (текст и изображения)
 """
+import asyncio
+import os
+import threading
 import time
-import re
 import requests
 import urllib.parse
+import orjson
 from datetime import datetime
-from typing import Dict, List
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 import google.generativeai as genai
 
 from config import PHOTOS_DIR, VIDEOS_DIR, DEFAULT_SETTINGS, IMAGE_SIZES
+from utils.http_client import http_session
+from utils.media_index import media_index
 from utils.logger import log_info, log_error, log_success
-from utils.rate_limiter import gemini_rate_limiter
+from utils.rate_limiter import gemini_rate_limiter, pollinations_rate_limiter
+from utils.gemini_models import InstructionModel
+from utils.gemini_batch import run_batch
+from utils.prompt_templates import image_prompt_from_template, video_prompt_from_template
+from utils.semantic_cache import prompt_key
+from utils.gemini_errors import (MAX_BACKOFF_WAIT, MAX_RATE_LIMIT_RETRIES, MAX_TRANSIENT_RETRIES,
+                                 QuotaExhaustedError, is_quota_exhausted, is_rate_limit_error,
+                                 is_transient_error, parse_retry_delay, retry_wait_time, transient_wait_time)
 from modules.post_manager import post_manager
+from modules.video_generator import VideoGenerator
+
+CONTENT_MODEL_NAME = 'gemini-2.0-flash-exp'
+
+# Сколько постов генерируется одновременно (темп запросов к Gemini задает gemini_rate_limiter)
+GENERATION_CONCURRENCY = int(os.getenv('GEN_CONCURRENCY', 8))
+# Сколько медиафайлов (Pollinations, Kling) генерируется одновременно - отдельно от запросов к Gemini
+MEDIA_CONCURRENCY = int(os.getenv('MEDIA_CONCURRENCY', 4))
+# Недавние тексты по одинаковым (тема, язык, ключевые слова) - чтобы посты одного аккаунта не повторялись
+RECENT_TEXTS_MAX_KEYS = 128
+RECENT_TEXTS_PER_KEY = 3
+RECENT_TEXT_EXCERPT = 200
+# Углы подачи для постов плана с одинаковыми темой, языком и ключевыми словами: такие посты генерируются
+# одновременно и не видят тексты друг друга, поэтому угол назначается по номеру поста
+POST_ANGLES = [
+    "личная история или пример из жизни",
+    "практические советы списком",
+    "интересный факт или цифра",
+    "вопрос к аудитории",
+    "разбор частой ошибки или мифа",
+    "короткая вдохновляющая мысль",
+]
+# С какого количества постов имеет смысл Batch API (меньшие планы быстрее сгенерировать обычными запросами)
+BATCH_MIN_POSTS = 10
+# Промпт изображения без готового промпта от Gemini: 1 - отдельный запрос к Gemini, 0 - локальный шаблон
+USE_AI_IMAGE_PROMPT = os.getenv('USE_AI_IMAGE_PROMPT', '0') == '1'
+# То же для промпта видео
+USE_AI_VIDEO_PROMPT = os.getenv('USE_AI_VIDEO_PROMPT', '0') == '1'
+
+# Статические части промптов (хранятся в кэше контекста Gemini, в запросе - только данные поста)
+POST_TEXT_INSTRUCTION = """Ты создаешь Instagram посты по теме, языку и ключевым словам из запроса.
+
+Требования:
+- Длина: 100-150 слов
+- Эмодзи: 3-5 штук (используй умеренно)
+- Хештеги: 5-10 релевантных (добавь в конце через пустую строку)
+- Стиль: на указанном языке, вовлекающий и живой
+- Призыв к действию в конце (не клише!)
+- НЕ используй markdown разметку (**, ##, _, ~~)
+- Пиши естественно, как для реальной аудитории
+
+Верни только текст поста, без дополнительных комментариев."""
+
+IMAGE_PROMPT_INSTRUCTION = """На основе Instagram поста из запроса создай короткий промпт для генерации изображения.
+
+Промпт должен быть:
+- На английском языке
+- Описательным и визуальным
+- Без текста/слов на изображении (no text overlay, no words)
+- 15-30 слов
+- Фокус на визуальных элементах, которые отражают тему поста
+- Профессиональный стиль фотографии
+
+Верни только промпт, без объяснений."""
+
+VIDEO_PROMPT_INSTRUCTION = """На основе Instagram поста из запроса создай ДИНАМИЧЕСКИЙ промпт для генерации ВИДЕО на английском языке.
+
+Промпт должен быть:
+- На английском языке
+- Описывать ДВИЖЕНИЕ и ДЕЙСТВИЕ (camera pans, zooms, objects moving)
+- Без текста в видео (no text overlay, no words)
+- 30-60 слов
+- Фокус на визуальных элементах в движении
+- Кинематографический стиль
+
+Верни только промпт для видео, без объяснений."""
+
+# Текст поста и промпты медиа одним запросом (ответ - JSON)
+POST_BUNDLE_INSTRUCTION = """Ты создаешь Instagram пост по теме, языку и ключевым словам из запроса, а также промпты для его медиа.
+
+Верни JSON-объект с ключами:
+- "post_text": текст поста на указанном языке
+  - Длина: 100-150 слов
+  - Эмодзи: 3-5 штук (используй умеренно)
+  - Хештеги: 5-10 релевантных (добавь в конце через пустую строку)
+  - Стиль: вовлекающий и живой, призыв к действию в конце (не клише!)
+  - НЕ используй markdown разметку (**, ##, _, ~~)
+- "image_prompt": промпт для генерации изображения к посту
+  - На английском языке, 15-30 слов, описательный и визуальный
+  - Без текста/слов на изображении (no text overlay, no words)
+  - Профессиональный стиль фотографии
+- "video_prompt": промпт для генерации видео к посту (только если в запросе указан формат video, иначе пустая строка)
+  - На английском языке, 30-60 слов
+  - ДВИЖЕНИЕ и ДЕЙСТВИЕ (camera pans, zooms, objects moving), кинематографический стиль
+  - Без текста в видео (no text overlay, no words)
+
+Верни ТОЛЬКО JSON."""
+
+POST_BUNDLE_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'post_text': {'type': 'string'},
+        'image_prompt': {'type': 'string'},
+        'video_prompt': {'type': 'string'},
+    },
+    'required': ['post_text', 'image_prompt', 'video_prompt'],
+}
 
 class ContentGenerator:
     """Генератор текстового и визуального контента"""
     
-    def __init__(self, gemini_api_key: str):
+    def __init__(self, gemini_api_key: str, session: requests.Session = None,
+                 video_generator: Optional[VideoGenerator] = None):
         self.gemini_api_key = gemini_api_key
+        self.session = session or http_session
+        # Генератор видео (Kling); без него видео-посты получают фото
+        self.video_generator = video_generator
         if gemini_api_key:
             genai.configure(api_key=gemini_api_key)
-        self.batch_size = DEFAULT_SETTINGS['batch_size']
+        # Модель без инструкций создается один раз и переиспользуется всеми запросами
+        self.model = genai.GenerativeModel(CONTENT_MODEL_NAME)
+        # prompt_key(тема, язык, ключевые слова) -> последние тексты постов
+        self.recent_texts: OrderedDict = OrderedDict()
+        self.recent_texts_lock = threading.Lock()
+        self.post_text_model = InstructionModel(CONTENT_MODEL_NAME, POST_TEXT_INSTRUCTION, 'текст поста')
+        self.image_prompt_model = InstructionModel(CONTENT_MODEL_NAME, IMAGE_PROMPT_INSTRUCTION, 'промпт изображения')
+        self.video_prompt_model = InstructionModel(CONTENT_MODEL_NAME, VIDEO_PROMPT_INSTRUCTION, 'промпт видео')
+        self.post_bundle_model = InstructionModel(
+            CONTENT_MODEL_NAME, POST_BUNDLE_INSTRUCTION, 'пост целиком',
+            generation_config={'response_mime_type': 'application/json', 'response_schema': POST_BUNDLE_SCHEMA}
+        )
     
-    def generate_posts_from_plan(self, plan: Dict, progress_callback=None) -> List[Dict]:
+    def generate_posts_from_plan(self, plan: Dict, progress_callback=None, use_batch_api: bool = False) -> List[Dict]:
         """
         Генерирует все посты согласно плану
         
         Args:
             plan: План публикаций
             progress_callback: Функция для отслеживания прогресса
+            use_batch_api: Генерировать тексты одним пакетом через Batch API (для фоновых запусков, ответ - до 24 часов)
         
         Returns:
             Список созданных постов
         """
-        all_posts = []
-        total_posts = plan['total_posts']
-        current_post = 0
+        # Все посты плана - независимые задачи
+        jobs = [account_plan
+                for account_plan in plan['accounts']
+                for _ in range(account_plan['posts_per_day'])]
+        total_posts = len(jobs)
+        variants = self._job_variants(jobs)
         
         log_info(f"Начало генерации {total_posts} постов...")
         
-        for account_plan in plan['accounts']:
-            account_id = account_plan['account_id']
-            posts_count = account_plan['posts_per_day']
-            
-            log_info(f"Генерация {posts_count} постов для аккаунта {account_plan['username']}")
-            
-            # Генерируем посты пакетами
-            for i in range(0, posts_count, self.batch_size):
-                batch_count = min(self.batch_size, posts_count - i)
-                
-                for j in range(batch_count):
-                    try:
-                        post = self._generate_single_post(account_plan)
-                        all_posts.append(post)
-                        current_post += 1
-                        
-                        if progress_callback:
-                            progress_callback(current_post, total_posts, account_plan['username'])
-                        
-                        log_info(f"✅ Сгенерировано {current_post}/{total_posts} постов")
-                        
-                        # Пауза между генерациями постов (каждый пост = 2 запроса к Gemini)
-                        if current_post < total_posts:
-                            log_info(f"⏸️ Пауза 3 секунды перед следующим постом...")
-                            time.sleep(3)
-                        
-                    except Exception as e:
-                        log_error(f"❌ Ошибка генерации поста: {e}")
-                        current_post += 1
-                        # Увеличенная пауза при ошибке
-                        time.sleep(5)
-                
-                # Пауза между батчами
-                if i + batch_count < posts_count:
-                    log_info(f"⏸️ Пауза между батчами...")
-                    time.sleep(5)
+        bundles = None
+        if use_batch_api and total_posts >= BATCH_MIN_POSTS:
+            bundles = self._generate_bundles_batch(jobs, variants)
+        
+        results = asyncio.run(self._generate_posts_async(jobs, variants, progress_callback, bundles))
+        all_posts = [post for post in results if post]
         
         log_success(f"Генерация завершена: создано {len(all_posts)} постов")
         return all_posts
     
-    def _generate_single_post(self, account_plan: Dict) -> Dict:
-        """Генерирует один пост"""
-        post_format = account_plan.get('format', 'photo')
+    def _job_variants(self, jobs: List[Dict]) -> List[Tuple[int, int]]:
+        """Номер поста среди постов плана с тем же ключом (тема, язык, ключевые слова) и их количество"""
+        keys = [prompt_key(account_plan['theme'], account_plan['language'], account_plan['keywords'])
+                for account_plan in jobs]
+        totals = Counter(keys)
+        seen = Counter()
+        variants = []
+        for key in keys:
+            variants.append((seen[key], totals[key]))
+            seen[key] += 1
+        return variants
+    
+    async def _generate_posts_async(self, jobs: List[Dict], variants: List[Tuple[int, int]], progress_callback=None,
+                                    bundles: Optional[List[Optional[Dict]]] = None) -> List[Optional[Dict]]:
+        """
+        Генерирует посты параллельно
         
-        # 1. Генерируем текст поста
-        log_info(f"📝 Генерация текста для формата: {post_format}")
-        text = self._generate_post_text(
-            theme=account_plan['theme'],
-            language=account_plan['language'],
-            keywords=account_plan['keywords']
-        )
+        Текст (Gemini) и медиа (Pollinations/Kling) ограничиваются отдельно:
+        пока медиа одного поста скачивается, для следующих постов уже идут запросы к Gemini.
+        Готовые тексты из bundles (Batch API) используются без запроса к Gemini
+        """
+        total_posts = len(jobs)
+        text_semaphore = asyncio.Semaphore(GENERATION_CONCURRENCY)
+        media_semaphore = asyncio.Semaphore(MEDIA_CONCURRENCY)
+        progress_lock = asyncio.Lock()
+        progress = {'current': 0}
+        # Дневной лимит Gemini исчерпан - остальные посты не генерируем (все запросы упадут)
+        quota_exhausted = asyncio.Event()
+        
+        # Генерация блокирующая (Gemini, Pollinations, Kling) - выполняем в пуле потоков
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=GENERATION_CONCURRENCY + MEDIA_CONCURRENCY)
+        loop.set_default_executor(executor)
         
-        # 2. Генерируем медиа в зависимости от формата
+        async def generate(account_plan: Dict, variant: Tuple[int, int], bundle: Optional[Dict]) -> Optional[Dict]:
+            post_format = account_plan.get('format', 'photo')
+            try:
+                if not bundle:
+                    async with text_semaphore:
+                        if quota_exhausted.is_set():
+                            return None
+                        bundle = await asyncio.to_thread(self._generate_bundle, account_plan, post_format, variant)
+                async with media_semaphore:
+                    post = await asyncio.to_thread(self._create_post_with_media, account_plan, bundle)
+            except QuotaExhaustedError as e:
+                if not quota_exhausted.is_set():
+                    quota_exhausted.set()
+                    log_error(f"❌ {e} Генерация остальных постов остановлена")
+                post = None
+            except Exception as e:
+                log_error(f"❌ Ошибка генерации поста для {account_plan['username']}: {e}")
+                post = None
+            
+            async with progress_lock:
+                progress['current'] += 1
+                if post:
+                    log_info(f"✅ Сгенерировано {progress['current']}/{total_posts} постов")
+                if progress_callback:
+                    progress_callback(progress['current'], total_posts, account_plan['username'])
+            
+            return post
+        
+        bundles = bundles or [None] * total_posts
+        return await asyncio.gather(*(generate(account_plan, variant, bundle)
+                                      for account_plan, variant, bundle in zip(jobs, variants, bundles)))
+    
+    def _create_post_with_media(self, account_plan: Dict, bundle: Dict) -> Dict:
+        """Генерирует медиа по готовому тексту и промптам и создает пост"""
+        post_format = account_plan.get('format', 'photo')
+        text = bundle['post_text']
+        
+        # Генерируем медиа в зависимости от формата
         if post_format == 'video':
             # Генерация видео
             log_info(f"🎬 Генерация ВИДЕО для поста...")
-            media_path = self._generate_video_for_post(text, account_plan['theme'])
+            media_path = self._generate_video_for_post(
+                text, account_plan['theme'],
+                keywords=account_plan['keywords'],
+                video_prompt=bundle.get('video_prompt'),
+                image_prompt=bundle.get('image_prompt')
+            )
         else:
             # Генерация изображения (по умолчанию)
             log_info(f"📸 Генерация ФОТО для поста...")
-            image_prompt = self._generate_image_prompt(text)
+            image_prompt = bundle.get('image_prompt') or self._generate_image_prompt(text, account_plan['theme'],
+                                                                                  account_plan['keywords'])
             media_path = self._generate_image(image_prompt)
         
-        # 3. Создаем пост
+        # Создаем пост
         post = post_manager.create_post(
             account_id=account_plan['account_id'],
             text=text,
@@ -115,21 +280,88 @@ class ContentGenerator:
         
         return post
     
-    def _generate_video_for_post(self, post_text: str, theme: str) -> str:
-        """Генерирует видео для поста"""
-        # Проверяем наличие video_generator
-        from app import video_generator
+    def _generate_bundle(self, account_plan: Dict, post_format: str, variant: Tuple[int, int] = (0, 1)) -> Dict:
+        """
+        Генерирует текст поста, промпт изображения и промпт видео одним запросом к Gemini
+        
+        Если ответ не удалось разобрать - генерирует текст отдельным запросом,
+        промпты медиа тогда создаются по тексту позже
+        """
+        if not self.gemini_api_key:
+            raise Exception("Gemini API не настроен")
+        
+        log_info(f"📝 Генерация текста для формата: {post_format}")
+        response_text = self._call_gemini_with_retry(self._bundle_prompt(account_plan, post_format, variant),
+                                                     model=self.post_bundle_model)
+        
+        try:
+            return self._parse_bundle(account_plan, response_text)
+        except ValueError as e:
+            log_error(f"Не удалось разобрать ответ Gemini ({e}), генерируем текст отдельно")
+            return {'post_text': self._generate_post_text(account_plan['theme'], account_plan['language'],
+                                                          account_plan['keywords'], variant)}
+    
+    def _bundle_prompt(self, account_plan: Dict, post_format: str, variant: Tuple[int, int] = (0, 1)) -> str:
+        """Промпт запроса текста поста и промптов медиа"""
+        keywords_str = ", ".join(account_plan['keywords'])
+        prompt = f"""Тема: {account_plan['theme']}
+Язык: {account_plan['language']}
+Ключевые слова: {keywords_str}
+Формат: {post_format}"""
+        text_key = prompt_key(account_plan['theme'], account_plan['language'], account_plan['keywords'])
+        return prompt + self._variant_hint(variant) + self._diversity_hint(text_key)
+    
+    def _parse_bundle(self, account_plan: Dict, response_text: str) -> Dict:
+        """Разбирает JSON-ответ с текстом поста и промптами медиа (ValueError - ответ некорректен)"""
+        bundle = orjson.loads(response_text)
+        if not bundle.get('post_text'):
+            raise ValueError("нет post_text")
+        text_key = prompt_key(account_plan['theme'], account_plan['language'], account_plan['keywords'])
+        self._remember_text(text_key, bundle['post_text'])
+        return bundle
+    
+    def _generate_bundles_batch(self, jobs: List[Dict], variants: List[Tuple[int, int]]) -> List[Optional[Dict]]:
+        """
+        Генерирует тексты и промпты медиа для всех постов одним пакетом Batch API
         
+        Посты, для которых пакет не дал корректного ответа, получают None
+        и генерируются обычными запросами
+        """
+        if not self.gemini_api_key:
+            raise Exception("Gemini API не настроен")
+        
+        prompts = [self._bundle_prompt(account_plan, account_plan.get('format', 'photo'), variant)
+                   for account_plan, variant in zip(jobs, variants)]
+        try:
+            responses = run_batch(self.gemini_api_key, POST_BUNDLE_INSTRUCTION, prompts,
+                                  generation_config=self.post_bundle_model.generation_config)
+        except Exception as e:
+            log_error(f"❌ Ошибка Batch API ({e}), генерируем посты обычными запросами")
+            return [None] * len(jobs)
+        
+        bundles = []
+        for account_plan, response_text in zip(jobs, responses):
+            try:
+                bundles.append(self._parse_bundle(account_plan, response_text) if response_text else None)
+            except ValueError as e:
+                log_error(f"Не удалось разобрать ответ пакета Gemini ({e})")
+                bundles.append(None)
+        return bundles
+    
+    def _generate_video_for_post(self, post_text: str, theme: str, keywords: List[str] = None,
+                                 video_prompt: str = None, image_prompt: str = None) -> str:
+        """Генерирует видео для поста (промпты можно передать готовыми)"""
+        video_generator = self.video_generator
         if not video_generator:
             log_error("❌ Video generator не настроен (отсутствует KLING_API_KEY в .env).")
             log_info("📸 Генерируем фото вместо видео...")
             # Fallback на фото
-            image_prompt = self._generate_image_prompt(post_text)
+            image_prompt = image_prompt or self._generate_image_prompt(post_text, theme, keywords)
             return self._generate_image(image_prompt)
         
-        # Генерируем промпт для видео
-        log_info("🎬 Генерация промпта для видео через Gemini...")
-        video_prompt = self._generate_video_prompt(post_text, theme)
+        # Генерируем промпт для видео (если не получен вместе с текстом)
+        if not video_prompt:
+            video_prompt = self._generate_video_prompt(post_text, theme, keywords)
         
         log_info(f"🎬 Промпт для видео: {video_prompt[:100]}...")
         
@@ -162,78 +394,102 @@ class ContentGenerator:
             
             log_info("📸 Fallback: генерируем фото вместо видео...")
             # Fallback на фото
-            image_prompt = self._generate_image_prompt(post_text)
+            image_prompt = image_prompt or self._generate_image_prompt(post_text, theme, keywords)
             return self._generate_image(image_prompt)
     
-    def _generate_video_prompt(self, post_text: str, theme: str) -> str:
-        """Генерирует промпт для видео на основе текста поста"""
+    def _generate_video_prompt(self, post_text: str, theme: str, keywords: List[str] = None,
+                               use_ai: bool = USE_AI_VIDEO_PROMPT) -> str:
+        """Генерирует промпт для видео: по шаблону из темы или запросом к Gemini по тексту поста"""
+        if theme and (not use_ai or not self.gemini_api_key):
+            return video_prompt_from_template(theme, keywords or [])
         if not self.gemini_api_key:
             # Базовый промпт без AI
-            return f"Cinematic video about {theme}, smooth camera movement, professional lighting, dynamic action"
+            return "Cinematic video, smooth camera movement, professional lighting, dynamic action"
         
-        prompt = f"""На основе этого Instagram поста создай ДИНАМИЧЕСКИЙ промпт для генерации ВИДЕО на английском языке:
-
-Пост: {post_text}
-Тема: {theme}
-
-Промпт должен быть:
-- На английском языке
-- Описывать ДВИЖЕНИЕ и ДЕЙСТВИЕ (camera pans, zooms, objects moving)
-- Без текста в видео (no text overlay, no words)
-- 30-60 слов
-- Фокус на визуальных элементах в движении
-- Кинематографический стиль
-
-Верни только промпт для видео, без объяснений."""
+        log_info("🎬 Генерация промпта для видео через Gemini...")
+        prompt = f"""Пост: {post_text}
+Тема: {theme}"""
         
         try:
-            return self._call_gemini_with_retry(prompt)
+            return self._call_gemini_with_retry(prompt, model=self.video_prompt_model)
         except Exception as e:
             log_error(f"Ошибка генерации видео-промпта: {e}")
             # Возвращаем базовый промпт
             return f"Cinematic video about {theme}, smooth camera movement, professional lighting, dynamic action, 5 seconds"
     
-    def _generate_post_text(self, theme: str, language: str, keywords: List[str]) -> str:
+    def _generate_post_text(self, theme: str, language: str, keywords: List[str],
+                            variant: Tuple[int, int] = (0, 1)) -> str:
         """Генерирует текст поста через Gemini с обработкой квот"""
         if not self.gemini_api_key:
             raise Exception("Gemini API не настроен")
         
         keywords_str = ", ".join(keywords)
         
-        prompt = f"""Создай Instagram пост на тему: {theme}
+        prompt = f"""Тема: {theme}
 Язык: {language}
-Ключевые слова: {keywords_str}
-
-Требования:
-- Длина: 100-150 слов
-- Эмодзи: 3-5 штук (используй умеренно)
-- Хештеги: 5-10 релевантных (добавь в конце через пустую строку)
-- Стиль: {language} язык, вовлекающий и живой
-- Призыв к действию в конце (не клише!)
-- НЕ используй markdown разметку (**, ##, _, ~~)
-- Пиши естественно, как для реальной аудитории
+Ключевые слова: {keywords_str}"""
+        text_key = prompt_key(theme, language, keywords)
+        prompt += self._variant_hint(variant) + self._diversity_hint(text_key)
+        
+        text = self._call_gemini_with_retry(prompt, model=self.post_text_model)
+        self._remember_text(text_key, text)
+        return text
+    
+    def _variant_hint(self, variant: Tuple[int, int]) -> str:
+        """Дополнение промпта: угол подачи поста среди постов плана с той же темой"""
+        index, total = variant
+        if total <= 1:
+            return ""
+        
+        angle = POST_ANGLES[index % len(POST_ANGLES)]
+        return f"""
 
-Верни только текст поста, без дополнительных комментариев."""
+Это пост {index + 1} из {total} на эту тему в плане. Угол подачи: {angle}"""
+    
+    def _diversity_hint(self, text_key: str) -> str:
+        """Дополнение промпта: уже написанные по этому ключу посты, которые нельзя повторять"""
+        with self.recent_texts_lock:
+            texts = list(self.recent_texts.get(text_key, ()))
+        if not texts:
+            return ""
         
-        return self._call_gemini_with_retry(prompt)
+        excerpts = "\n".join(f"- {text[:RECENT_TEXT_EXCERPT]}" for text in texts)
+        return f"""
+
+Уже написанные посты на эту тему (начало). Напиши с другим углом, структурой и стилем, не повторяй их:
+{excerpts}"""
     
-    def _call_gemini_with_retry(self, prompt: str, max_retries: int = 1000, wait_on_limit: bool = True) -> str:
+    def _remember_text(self, text_key: str, text: str):
+        """Запоминает текст поста (ограниченный LRU по ключам)"""
+        with self.recent_texts_lock:
+            texts = self.recent_texts.pop(text_key, [])
+            texts.append(text)
+            self.recent_texts[text_key] = texts[-RECENT_TEXTS_PER_KEY:]
+            while len(self.recent_texts) > RECENT_TEXTS_MAX_KEYS:
+                self.recent_texts.popitem(last=False)
+    
+    def _call_gemini_with_retry(self, prompt: str, max_retries: int = MAX_RATE_LIMIT_RETRIES, wait_on_limit: bool = True,
+                                model: InstructionModel = None) -> str:
         """
-        Вызывает Gemini с автоматическим повтором при ошибке квоты
+        Вызывает Gemini с повтором: ошибки квоты и временные ошибки - по отдельным лимитам попыток,
+        остальные ошибки - без повтора
         
         Args:
             prompt: Промпт для Gemini
-            max_retries: Максимальное количество попыток
+            max_retries: Максимальное количество попыток при ошибке квоты
             wait_on_limit: Если True, ждет указанное в ошибке время (может быть долго)
+            model: Модель со статическими инструкциями (по умолчанию - без инструкций)
         """
-        model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        model = model.get() if model else self.model
+        rate_attempts = 0
+        transient_attempts = 0
         
-        for attempt in range(max_retries):
+        while True:
             try:
                 # ВАЖНО: Ждем согласно rate limiter перед каждым запросом
                 gemini_rate_limiter.wait_if_needed()
                 
-                log_info(f"🤖 Запрос к Gemini API (попытка {attempt + 1}/{max_retries})...")
+                log_info(f"🤖 Запрос к Gemini API...")
                 response = model.generate_content(prompt)
                 
                 log_info(f"✅ Ответ получен от Gemini API")
@@ -243,81 +499,67 @@ class ContentGenerator:
                 error_str = str(e)
                 
                 # Проверяем, является ли это ошибкой квоты (429)
-                if "429" in error_str or "quota" in error_str.lower() or "rate" in error_str.lower():
-                    # Извлекаем время ожидания из ошибки
-                    retry_seconds = self._extract_retry_delay(error_str)
+                if is_rate_limit_error(error_str):
+                    # Дневной лимит исчерпан - ждать сброса квоты (часы) бессмысленно
+                    if is_quota_exhausted(error_str):
+                        log_error("❌ Дневной лимит Gemini API исчерпан")
+                        raise QuotaExhaustedError("Дневной лимит запросов Gemini API исчерпан. Попробуйте после сброса квоты.",
+                                                 wait_seconds=parse_retry_delay(error_str))
                     
-                    if attempt < max_retries - 1:
-                        # Если wait_on_limit=True и время ожидания большое - ждем
-                        if wait_on_limit and retry_seconds > 60:
+                    rate_attempts += 1
+                    if rate_attempts < max_retries:
+                        # Время ожидания из ответа сервера (без умножения на номер попытки)
+                        wait_time = retry_wait_time(error_str, rate_attempts - 1)
+                        if not wait_on_limit:
+                            wait_time = min(wait_time, MAX_BACKOFF_WAIT)
+                        
+                        if wait_time > 60:
                             # Длительное ожидание
-                            wait_minutes = retry_seconds / 60
-                            log_info(f"⏳ Достигнут дневной лимит Gemini API.")
-                            log_info(f"⏰ Ожидание {wait_minutes:.1f} минут до сброса лимита...")
+                            log_info(f"⏳ Достигнут лимит Gemini API.")
+                            log_info(f"⏰ Ожидание {wait_time / 60:.1f} минут до сброса лимита...")
                             log_info(f"💡 Совет: Не закрывайте приложение, оно автоматически продолжит работу")
                             
                             # Разбиваем ожидание на части по 60 секунд для промежуточных логов
                             elapsed = 0
-                            while elapsed < retry_seconds:
-                                chunk = min(60, retry_seconds - elapsed)
+                            while elapsed < wait_time:
+                                chunk = min(60, wait_time - elapsed)
                                 time.sleep(chunk)
                                 elapsed += chunk
-                                remaining = (retry_seconds - elapsed) / 60
+                                remaining = (wait_time - elapsed) / 60
                                 if remaining > 1:
                                     log_info(f"⏰ Осталось ждать: {remaining:.1f} минут...")
                             
                             log_info(f"✅ Ожидание завершено, повторяем запрос...")
-                            continue
                         else:
-                            # Короткое ожидание с exponential backoff
-                            backoff_multiplier = 2 ** attempt  # 1x, 2x, 4x
-                            wait_time = min(retry_seconds * backoff_multiplier + 5, 120)  # Максимум 2 минуты
-                            
-                            log_info(f"⏳ Достигнут лимит Gemini API. Ожидание {wait_time} секунд перед повтором (попытка {attempt + 1}/{max_retries})...")
+                            log_info(f"⏳ Достигнут лимит Gemini API. Ожидание {wait_time:.0f} секунд перед повтором (попытка {rate_attempts}/{max_retries})...")
                             time.sleep(wait_time)
-                            continue
+                        continue
                     else:
                         log_error(f"❌ Превышен лимит запросов Gemini API после {max_retries} попыток.")
                         raise Exception(f"Превышен лимит запросов Gemini API. Достигнут дневной лимит 50 запросов для бесплатного тарифа. Подождите до завтра.")
                 
+                # Временная ошибка сервера/сети - быстрый повтор
+                if is_transient_error(error_str) and transient_attempts < MAX_TRANSIENT_RETRIES:
+                    transient_attempts += 1
+                    wait_time = transient_wait_time(transient_attempts)
+                    log_info(f"🔄 Временная ошибка Gemini API: {e}. Повтор через {wait_time:.0f} секунд ({transient_attempts}/{MAX_TRANSIENT_RETRIES})...")
+                    time.sleep(wait_time)
+                    continue
+                
                 # Другие ошибки
                 log_error(f"Ошибка генерации через Gemini: {e}")
                 raise
-        
-        raise Exception("Не удалось сгенерировать контент после нескольких попыток")
     
-    def _extract_retry_delay(self, error_message: str) -> int:
-        """Извлекает время ожидания из сообщения об ошибке"""
-        # Ищем паттерн "retry in X.Xs" или "retry in Xs"
-        match = re.search(r'retry in (\d+(?:\.\d+)?)', error_message, re.IGNORECASE)
-        if match:
-            seconds = float(match.group(1))
-            return int(seconds) + 1  # Округляем вверх
-        
-        # По умолчанию ждем 30 секунд
-        return 30
-    
-    def _generate_image_prompt(self, post_text: str) -> str:
-        """Генерирует промпт для изображения на основе текста поста"""
-        if not self.gemini_api_key:
-            raise Exception("Gemini API не настроен")
+    def _generate_image_prompt(self, post_text: str, theme: str, keywords: List[str] = None,
+                               use_ai: bool = USE_AI_IMAGE_PROMPT) -> str:
+        """Генерирует промпт для изображения: по шаблону из темы или запросом к Gemini по тексту поста"""
+        if not use_ai or not self.gemini_api_key:
+            return image_prompt_from_template(theme, keywords or [])
         
-        prompt = f"""На основе этого Instagram поста создай короткий промпт для генерации изображения:
-
-Пост: {post_text}
-
-Промпт должен быть:
-- На английском языке
-- Описательным и визуальным
-- Без текста/слов на изображении (no text overlay, no words)
-- 15-30 слов
-- Фокус на визуальных элементах, которые отражают тему поста
-- Профессиональный стиль фотографии
-
-Верни только промпт, без объяснений."""
+        prompt = f"Пост: {post_text}"
         
         try:
-            return self._call_gemini_with_retry(prompt)
+            return self._call_gemini_with_retry(prompt, model=self.image_prompt_model)
         except Exception as e:
             log_error(f"Ошибка генерации промпта для изображения: {e}")
             # Возвращаем базовый промпт
@@ -341,34 +583,42 @@ class ContentGenerator:
                 'nologo': 'true'
             }
             
-            response = requests.get(url, params=params, timeout=60)
-            
-            if response.status_code == 200:
+            pollinations_rate_limiter.wait_if_needed()
+            # stream=True - изображение пишется на диск частями, а не держится целиком в памяти
+            with self.session.get(url, params=params, timeout=60, stream=True) as response:
+                if response.status_code != 200:
+                    raise Exception(f"Ошибка генерации изображения: {response.status_code}")
+                
                 # Сохраняем изображение
                 timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
                 filename = f"{timestamp}.jpg"
                 filepath = PHOTOS_DIR / filename
                 
-                with open(filepath, 'wb') as f:
-                    f.write(response.content)
-                
-                # Сохраняем метаданные
-                import json
-                metadata = {
-                    'prompt': prompt,
-                    'width': width,
-                    'height': height,
-                    'model': model,
-                    'timestamp': timestamp
-                }
-                
-                metadata_file = PHOTOS_DIR / f"{timestamp}.json"
-                with open(metadata_file, 'w', encoding='utf-8') as f:
-                    json.dump(metadata, f, ensure_ascii=False, indent=2)
-                
-                return filename
-            else:
-                raise Exception(f"Ошибка генерации изображения: {response.status_code}")
+                try:
+                    with open(filepath, 'wb') as f:
+                        for chunk in response.iter_content(chunk_size=65536):
+                            f.write(chunk)
+                except Exception:
+                    # Не оставляем недокачанный файл
+                    filepath.unlink(missing_ok=True)
+                    raise
+            media_index.add(filepath)
+            
+            # Сохраняем метаданные
+            metadata = {
+                'prompt': prompt,
+                'width': width,
+                'height': height,
+                'model': model,
+                'timestamp': timestamp
+            }
+            
+            metadata_file = PHOTOS_DIR / f"{timestamp}.json"
+            tmp_file = metadata_file.with_suffix('.tmp')
+            tmp_file.write_bytes(orjson.dumps(metadata, option=orjson.OPT_INDENT_2))
+            os.replace(tmp_file, metadata_file)
+            
+            return filename
                 
         except Exception as e:
             log_error(f"Ошибка генерации изображения: {e}")
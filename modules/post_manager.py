@@ -1,23 +1,555 @@
 """
 Менеджер постов
 """
-import json
+import heapq
+import mmap
+import os
+import sqlite3
+import threading
+import time
 import uuid
-from datetime import datetime
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 from config import (
     DRAFTS_DIR, SCHEDULED_DIR, PUBLISHED_DIR,
-    POST_STATUS, PHOTOS_DIR, VIDEOS_DIR
+    POST_STATUS, PHOTOS_DIR, VIDEOS_DIR, POSTS_DB_FILE, POSTS_STORE_FILE
 )
 from utils.logger import log_info, log_success, log_error
+from utils.datetime_helper import parse_iso_datetime_cached
+
+try:
+    import fcntl
+except ImportError:  # Windows - межпроцессной блокировки журнала нет, работает один процесс
+    fcntl = None
+
+# Сколько секунд держать кэш запланированных постов (на случай записи другими процессами)
+SCHEDULED_CACHE_TTL = 2.0
+# Директория (группа) каждого статуса - прочие статусы (например, error) относятся к черновикам
+STATUS_DIRS = {
+    POST_STATUS["DRAFT"]: DRAFTS_DIR,
+    POST_STATUS["SCHEDULED"]: SCHEDULED_DIR,
+    POST_STATUS["PUBLISHING"]: SCHEDULED_DIR,
+    POST_STATUS["PUBLISHED"]: PUBLISHED_DIR,
+}
+
+# Файл блокировки журнала: дозапись - под разделяемой блокировкой, сжатие и загрузка - под исключительной
+POSTS_STORE_LOCK_FILE = POSTS_STORE_FILE.with_name(f"{POSTS_STORE_FILE.name}.lock")
+# Сколько секунд пост может быть захвачен для публикации (статус publishing): захват старше считается
+# брошенным (воркер убит или перезапущен во время загрузки)
+PUBLISH_CLAIM_LEASE = 30 * 60
+# Ошибка поста с брошенным захватом: загрузка могла и пройти, поэтому сами не повторяем
+CLAIM_EXPIRED_ERROR = "Публикация прервана (процесс остановлен во время загрузки) - проверьте Instagram перед повтором"
+# Сколько устаревших записей журнала постов допускается, прежде чем он будет сжат при запуске
+STORE_COMPACT_MIN_GARBAGE = 1000
+# Буфер дозаписи журнала (запись все равно сбрасывается на диск после каждой операции)
+STORE_WRITE_BUFFER = 1 << 20
+# Сколько файлов постов старого формата читается параллельно при переносе в журнал
+LEGACY_READ_MAX_WORKERS = min(32, (os.cpu_count() or 1) * 4)
 
 class PostManager:
     """Управление постами"""
     
     def __init__(self):
-        pass
+        # Счетчик изменений постов - инвалидирует кэш при любой записи
+        self.version = 0
+        self._scheduled_cache = None  # (version, monotonic time, posts)
+        # Подписчики на появление/изменение запланированных постов
+        self.schedule_listeners = []
+        
+        # Источник истины - журнал постов. SQLite хранит только статусы постов (общие для процессов):
+        # по PRAGMA data_version процесс узнает, что другой процесс дописал журнал
+        self.db_lock = threading.Lock()
+        self.db = sqlite3.connect(str(POSTS_DB_FILE), check_same_thread=False)
+        # Посты в памяти (под db_lock): post_id -> post, account_id -> {post_id}
+        self._posts = {}
+        self._by_account = {}
+        self._created_ts = {}  # post_id -> время создания (epoch) - ключ сортировки выборок
+        self._data_version = None  # PRAGMA data_version - меняется при записи другим процессом
+        
+        # Журнал постов (JSONL): каждая строка - новая версия поста или отметка удаления {"id", "deleted"}
+        self.store_lock = threading.Lock()
+        self.store = None
+        self._lock_fd = os.open(POSTS_STORE_LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644) if fcntl else None
+        # До какого места и какой файл журнала (inode - меняется при сжатии) применены к памяти (под db_lock)
+        self._store_offset = 0
+        self._store_ino = None
+        # Записи журнала, накопленные внутри batched() текущего потока
+        self._batch = threading.local()
+        self._load_store()
+        
+        # Запланированные посты в памяти: куча по времени публикации + словарь постов
+        self.schedule_lock = threading.Lock()
+        self._sched_heap = []  # (scheduled_time, post_id)
+        self._sched_index = {}  # post_id -> post
+        self.reload_schedule_index()
+        
+        # Счетчики публикаций за сегодня по аккаунтам: account_id -> {day, count, last}
+        self.publish_stats_lock = threading.Lock()
+        self._publish_stats = {}
+        self.reload_publish_stats()
+    
+    def _build_index(self):
+        """Сверяет таблицу статусов постов с журналом (вызывается под db_lock и блокировкой журнала)"""
+        with self.db:
+            # Прежняя таблица с полной копией постов и индексами выборок больше не нужна - выборки идут из памяти
+            self.db.execute("DROP TABLE IF EXISTS posts")
+            self.db.execute("CREATE TABLE IF NOT EXISTS post_status (id TEXT PRIMARY KEY, status TEXT)")
+            
+            # Пишем только расхождения: если SQLite уже актуален, другие процессы не перечитывают журнал зря
+            indexed = dict(self.db.execute("SELECT id, status FROM post_status"))
+            self.db.executemany(
+                "DELETE FROM post_status WHERE id = ?",
+                [(post_id,) for post_id in indexed.keys() - self._posts.keys()]
+            )
+            self.db.executemany(
+                "INSERT OR REPLACE INTO post_status VALUES (?, ?)",
+                [(post_id, post['status']) for post_id, post in self._posts.items()
+                 if indexed.get(post_id) != post['status']]
+            )
+        
+        self._data_version = self._read_data_version()
+    
+    @contextmanager
+    def _store_locked(self, exclusive: bool = False):
+        """Блокирует журнал постов для потоков процесса (store_lock) и для других процессов (flock)"""
+        with self.store_lock:
+            if self._lock_fd is None:
+                yield
+                return
+            
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+    
+    def _load_store(self):
+        """Загружает посты из журнала (последняя запись поста побеждает), открывает журнал на дозапись
+        и сверяет с ним статусы в SQLite"""
+        # Под исключительной блокировкой другие процессы не дописывают и не сжимают журнал
+        with self.db_lock, self._store_locked(exclusive=True):
+            records_count, torn_tail = self._replay_store()
+            legacy_files = self._migrate_legacy_files()
+            
+            # Недописанная последняя строка склеилась бы со следующей записью - переписываем журнал
+            garbage = records_count - len(self._posts)
+            if legacy_files or torn_tail or garbage > max(STORE_COMPACT_MIN_GARBAGE, len(self._posts)):
+                self._compact_locked()
+            else:
+                self._open_store()
+            
+            self._build_index()
+            self._expire_claims_locked()
+        
+        # Старые файлы удаляются только после того, как их посты записаны в журнал
+        for post_file in legacy_files:
+            post_file.unlink(missing_ok=True)
+        if legacy_files:
+            log_info(f"Перенесено постов из файлов в журнал: {len(legacy_files)}")
+    
+    def _replay_store(self, offset: int = 0) -> Tuple[int, bool]:
+        """
+        Применяет записи журнала, начиная с offset, к постам в памяти
+        
+        Returns:
+            Количество записей и признак недописанной последней строки
+        
+        Журнал отображается в память (mmap): строки разбираются прямо из страниц кэша ОС без копирования.
+        Разбираются только целые строки - хвост без перевода строки может еще дописываться другим процессом
+        """
+        try:
+            f = open(POSTS_STORE_FILE, 'rb')
+        except FileNotFoundError:
+            self._store_offset, self._store_ino = 0, None
+            return 0, False
+        
+        records_count = 0
+        with f:
+            stat = os.fstat(f.fileno())
+            self._store_ino = stat.st_ino
+            if stat.st_size <= offset:
+                self._store_offset = offset
+                return 0, False
+            
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as store_map:
+                # Журнал читается один раз от начала до конца - просим ОС читать наперед
+                if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                    store_map.madvise(mmap.MADV_SEQUENTIAL)
+                
+                size = len(store_map)
+                limit = store_map.rfind(b'\n', offset) + 1 or offset
+                torn_tail = limit < size
+                
+                with memoryview(store_map) as view:
+                    start = offset
+                    while start < limit:
+                        end = store_map.find(b'\n', start, limit)
+                        line_start, start = start, end + 1
+                        if end == line_start:
+                            continue
+                        
+                        records_count += 1
+                        try:
+                            with view[line_start:end] as line:
+                                record = orjson.loads(line)
+                        except ValueError as e:
+                            # Недописанная строка (сбой во время записи) - пропускаем
+                            log_error(f"Ошибка чтения записи {records_count} журнала постов: {e}")
+                            continue
+                        
+                        self._apply_record(record)
+                
+                self._store_offset = limit
+        
+        return records_count, torn_tail
+    
+    def _apply_record(self, record: Dict):
+        """Применяет запись журнала к постам в памяти (вызывается под db_lock)"""
+        if record.get('deleted'):
+            self._forget_post(record['id'])
+        else:
+            self._remember_post(record)
+    
+    def _catch_up_store(self):
+        """Применяет к памяти записи, дописанные в журнал другими процессами (вызывается под db_lock)"""
+        try:
+            replaced = os.stat(POSTS_STORE_FILE).st_ino != self._store_ino
+        except FileNotFoundError:
+            replaced = True
+        
+        if replaced:
+            # Журнал сжат другим процессом - перечитываем его целиком
+            self._posts = {}
+            self._by_account = {}
+            self._created_ts = {}
+            self._replay_store()
+        else:
+            self._replay_store(self._store_offset)
+    
+    def _migrate_legacy_files(self) -> List[Path]:
+        """Загружает посты старого формата (файл на пост в папке статуса), которых нет в журнале"""
+        post_files = [post_file
+                      for status_dir in [DRAFTS_DIR, SCHEDULED_DIR, PUBLISHED_DIR]
+                      for post_file in status_dir.glob('*.json')]
+        if not post_files:
+            return []
+        
+        legacy_files = []
+        # Мелкие файлы читаются параллельно (GIL отпускается на время чтения), разбираются по порядку
+        with ThreadPoolExecutor(max_workers=min(LEGACY_READ_MAX_WORKERS, len(post_files))) as executor:
+            for post_file, post in zip(post_files, executor.map(self._read_legacy_file, post_files)):
+                if post is None:
+                    continue
+                # Версия из журнала новее (перенос уже был, но файл не успели удалить)
+                if post['id'] not in self._posts:
+                    self._remember_post(post)
+                legacy_files.append(post_file)
+        return legacy_files
+    
+    def _read_legacy_file(self, post_file: Path) -> Optional[Dict]:
+        """Читает пост старого формата (файл целиком одним чтением, разбор из bytes)"""
+        try:
+            with open(post_file, 'rb', buffering=1 << 16) as f:
+                return orjson.loads(f.read())
+        except Exception as e:
+            log_error(f"Ошибка чтения поста {post_file.name}: {e}")
+            return None
+    
+    def _open_store(self):
+        """Открывает журнал постов на дозапись"""
+        if self.store:
+            self.store.close()
+        self.store = open(POSTS_STORE_FILE, 'ab', buffering=STORE_WRITE_BUFFER)
+    
+    @contextmanager
+    def batched(self):
+        """Накапливает записи журнала текущего потока и дописывает их одной записью при выходе из блока"""
+        if getattr(self._batch, 'records', None) is not None:
+            # Вложенный batched() - записи уйдут при выходе из внешнего
+            yield
+            return
+        
+        self._batch.records = []
+        try:
+            yield
+        finally:
+            records, self._batch.records = self._batch.records, None
+            if records:
+                self._append_to_store(records)
+                # Пока записи копились, память могла быть перечитана из журнала без них - применяем снова
+                with self.db_lock:
+                    for record in records:
+                        self._apply_record(dict(record))
+    
+    def _append_to_store(self, records: List[Dict]):
+        """Дописывает записи в журнал постов (одна запись на диск на вызов)"""
+        batch_records = getattr(self._batch, 'records', None)
+        if batch_records is not None:
+            batch_records.extend(records)
+            return
+        
+        with self._store_locked():
+            self._write_store(records)
+        
+        # Статусы в SQLite меняются только после записи в журнал: другой процесс, заметив изменение
+        # data_version, уже найдет эти записи в журнале
+        with self.db_lock:
+            self._write_statuses(records)
+    
+    def _write_store(self, records: List[Dict]):
+        """Дописывает записи в файл журнала (вызывается под блокировкой журнала)"""
+        data = b''.join(orjson.dumps(record) + b'\n' for record in records)
+        
+        # Журнал мог быть сжат другим процессом (os.replace) - тогда пишем в новый файл
+        try:
+            replaced = os.stat(POSTS_STORE_FILE).st_ino != os.fstat(self.store.fileno()).st_ino
+        except FileNotFoundError:
+            replaced = True
+        if replaced:
+            self._open_store()
+        
+        self.store.write(data)
+        self.store.flush()
+    
+    def _write_statuses(self, records: List[Dict]):
+        """Переносит статусы записей журнала в SQLite (вызывается под db_lock)"""
+        with self.db:
+            self.db.executemany(
+                "DELETE FROM post_status WHERE id = ?",
+                [(record['id'],) for record in records if record.get('deleted')]
+            )
+            self.db.executemany(
+                "INSERT OR REPLACE INTO post_status VALUES (?, ?)",
+                [(record['id'], record['status']) for record in records if not record.get('deleted')]
+            )
+    
+    def compact(self):
+        """Переписывает журнал постов: только актуальные версии, без удаленных постов"""
+        with self.db_lock, self._store_locked(exclusive=True):
+            # Записи, дописанные другими процессами до блокировки, иначе пропали бы при сжатии
+            self._catch_up_store()
+            self._compact_locked()
+    
+    def _compact_locked(self):
+        """Сжимает журнал по постам в памяти (вызывается под db_lock и исключительной блокировкой журнала)"""
+        posts = list(self._posts.values())
+        
+        tmp_file = POSTS_STORE_FILE.with_name(f"{POSTS_STORE_FILE.name}.{os.getpid()}.tmp")
+        with open(tmp_file, 'wb') as f:
+            for post in posts:
+                f.write(orjson.dumps(post) + b'\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, POSTS_STORE_FILE)
+        self._open_store()
+        
+        # Новый журнал совпадает с памятью целиком
+        self._store_offset = self.store.tell()
+        self._store_ino = os.fstat(self.store.fileno()).st_ino
+        
+        log_info(f"Журнал постов сжат: {len(posts)} постов")
+    
+    def _read_data_version(self) -> int:
+        """Версия базы: меняется, только если ее изменило другое соединение (вызывается под db_lock)"""
+        return self.db.execute("PRAGMA data_version").fetchone()[0]
+    
+    def _sync_posts(self):
+        """Дочитывает журнал в память, если его изменил другой процесс (вызывается под db_lock)"""
+        data_version = self._read_data_version()
+        if data_version == self._data_version:
+            return
+        
+        self._catch_up_store()
+        self._data_version = data_version
+        self.version += 1
+    
+    def _remember_post(self, post: Dict):
+        """Добавляет/обновляет пост в памяти (вызывается под db_lock)"""
+        self._posts[post['id']] = post
+        self._by_account.setdefault(post.get('account_id'), set()).add(post['id'])
+        if post['id'] not in self._created_ts:
+            self._created_ts[post['id']] = self._created_timestamp(post)
+    
+    def _created_timestamp(self, post: Dict) -> float:
+        """Время создания поста в секундах epoch (0 - если не указано или некорректно)"""
+        try:
+            return datetime.fromisoformat(post['created_at']).timestamp()
+        except (KeyError, TypeError, ValueError):
+            return 0.0
+    
+    def _forget_post(self, post_id: str):
+        """Убирает пост из памяти (вызывается под db_lock)"""
+        post = self._posts.pop(post_id, None)
+        self._created_ts.pop(post_id, None)
+        if post is not None:
+            account_posts = self._by_account.get(post.get('account_id'))
+            if account_posts:
+                account_posts.discard(post_id)
+    
+    def reload_schedule_index(self):
+        """Перестраивает кучу запланированных постов из постов в памяти"""
+        self.expire_claims()
+        
+        # Публикуемые посты в той же группе, что и запланированные, но в расписание не попадают
+        posts = [post for post in self._query_posts(status=POST_STATUS["SCHEDULED"])
+                 if post['status'] == POST_STATUS["SCHEDULED"]]
+        
+        with self.schedule_lock:
+            self._sched_index = {}
+            self._sched_heap = []
+            for post in posts:
+                self._index_scheduled(post)
+            heapq.heapify(self._sched_heap)
+    
+    def _index_scheduled(self, post: Dict):
+        """Добавляет запланированный пост в кучу (вызывается под schedule_lock)"""
+        self._sched_index[post['id']] = post
+        scheduled_time = self._parse_scheduled_time(post)
+        if scheduled_time:
+            heapq.heappush(self._sched_heap, (scheduled_time, post['id']))
+    
+    def _parse_scheduled_time(self, post: Dict) -> Optional[datetime]:
+        """Время публикации поста или None"""
+        if not post.get('scheduled_time'):
+            return None
+        try:
+            return parse_iso_datetime_cached(post['scheduled_time'])
+        except ValueError:
+            return None
+    
+    def get_due_posts(self, horizon_seconds: int = 120) -> List[Dict]:
+        """
+        Возвращает запланированные посты, время которых наступило
+        
+        Args:
+            horizon_seconds: Насколько раньше запланированного времени пост считается готовым
+        """
+        limit = datetime.now() + timedelta(seconds=horizon_seconds)
+        due_posts = []
+        keep = []
+        seen = set()
+        
+        with self.schedule_lock:
+            while self._sched_heap and self._sched_heap[0][0] <= limit:
+                scheduled_time, post_id = heapq.heappop(self._sched_heap)
+                post = self._sched_index.get(post_id)
+                
+                # Пропускаем устаревшие записи (пост опубликован, удален или перенесен)
+                if post is None or post_id in seen or self._parse_scheduled_time(post) != scheduled_time:
+                    continue
+                
+                seen.add(post_id)
+                due_posts.append(post)
+                keep.append((scheduled_time, post_id))
+            
+            # Посты остаются запланированными, пока не будут опубликованы
+            for entry in keep:
+                heapq.heappush(self._sched_heap, entry)
+        
+        return due_posts
+    
+    def get_next_scheduled_time(self) -> Optional[datetime]:
+        """Время ближайшего запланированного поста"""
+        with self.schedule_lock:
+            while self._sched_heap:
+                scheduled_time, post_id = self._sched_heap[0]
+                post = self._sched_index.get(post_id)
+                if post is not None and self._parse_scheduled_time(post) == scheduled_time:
+                    return scheduled_time
+                heapq.heappop(self._sched_heap)
+        return None
+    
+    def reload_publish_stats(self):
+        """Пересчитывает счетчики публикаций (за сегодня и время последней) по опубликованным постам"""
+        stats = {}
+        today = datetime.now().date()
+        today_start_ts = datetime.combine(today, datetime.min.time()).timestamp()
+        last_ts = {}  # account_id -> время последней публикации (epoch)
+        
+        for post in self._query_posts(status=POST_STATUS["PUBLISHED"]):
+            published_ts = self._published_timestamp(post)
+            if published_ts is None:
+                continue
+            
+            account_id = post['account_id']
+            account_stats = stats.setdefault(account_id, {'day': today, 'count': 0, 'last': None})
+            if published_ts >= today_start_ts:
+                account_stats['count'] += 1
+            if published_ts > last_ts.get(account_id, 0.0):
+                last_ts[account_id] = published_ts
+        
+        for account_id, published_ts in last_ts.items():
+            stats[account_id]['last'] = datetime.fromtimestamp(published_ts)
+        
+        with self.publish_stats_lock:
+            self._publish_stats = stats
+    
+    def _published_timestamp(self, post: Dict) -> Optional[float]:
+        """Время публикации поста в секундах epoch (старые посты - по ISO-строке)"""
+        published_ts = post.get('published_at_ts')
+        if published_ts is not None:
+            return published_ts
+        
+        if not post.get('published_at'):
+            return None
+        try:
+            return datetime.fromisoformat(post['published_at']).timestamp()
+        except ValueError:
+            return None
+    
+    def _record_publish(self, account_id: str, published_at: datetime):
+        """Учитывает публикацию в счетчиках аккаунта"""
+        with self.publish_stats_lock:
+            account_stats = self._publish_stats.get(account_id)
+            if not account_stats:
+                account_stats = {'day': published_at.date(), 'count': 0, 'last': None}
+                self._publish_stats[account_id] = account_stats
+            elif account_stats['day'] != published_at.date():
+                account_stats['day'] = published_at.date()
+                account_stats['count'] = 0
+            
+            account_stats['count'] += 1
+            account_stats['last'] = published_at
+    
+    def get_publish_stats(self, account_id: str) -> Tuple[int, Optional[datetime]]:
+        """Возвращает количество публикаций аккаунта за сегодня и время последней публикации"""
+        with self.publish_stats_lock:
+            account_stats = self._publish_stats.get(account_id)
+            if not account_stats:
+                return 0, None
+            # Счетчик дня сбрасывается в полночь, а время последней публикации - нет
+            if account_stats['day'] != datetime.now().date():
+                return 0, account_stats['last']
+            return account_stats['count'], account_stats['last']
+    
+    def add_schedule_listener(self, callback):
+        """Подписывает callback на сохранение запланированных постов"""
+        if callback not in self.schedule_listeners:
+            self.schedule_listeners.append(callback)
+    
+    def _query_posts(self, status: Optional[str] = None, account_id: Optional[str] = None) -> List[Dict]:
+        """
+        Выборка постов из памяти, отсортированная по дате создания (новые первыми)
+        
+        Возвращаются общие объекты постов - изменять их можно только через методы менеджера
+        """
+        # Фильтр по директории статуса (как и при сканировании файлов)
+        status_dir = self._get_status_dir(status) if status else None
+        
+        with self.db_lock:
+            self._sync_posts()
+            post_ids = list(self._by_account.get(account_id, ())) if account_id else list(self._posts)
+            if status_dir:
+                post_ids = [post_id for post_id in post_ids
+                            if self._get_status_dir(self._posts[post_id]['status']) == status_dir]
+            # Сравнение чисел вместо ISO-строк, ключ - метод словаря без lambda
+            post_ids.sort(key=self._created_ts.__getitem__, reverse=True)
+            return [self._posts[post_id] for post_id in post_ids]
     
     def create_post(self, account_id: str, text: str, media: List[str],
                    post_format: str = "photo", status: str = POST_STATUS["DRAFT"]) -> Dict:
@@ -48,14 +580,11 @@ class PostManager:
         if not post:
             return None
         
-        old_status = post['status']
-        post.update(updates)
-        new_status = post['status']
-        
-        # Если статус изменился - удаляем старый файл
-        if old_status != new_status:
-            self._delete_post_file(post_id, old_status)
+        # Ничего не изменилось (форма отправила те же значения) - новую версию не пишем
+        if all(key in post and post[key] == value for key, value in updates.items()):
+            return post
         
+        post.update(updates)
         self._save_post(post)
         
         return post
@@ -66,10 +595,6 @@ class PostManager:
         if not post:
             return None
         
-        # Перемещаем из drafts в scheduled
-        if post['status'] == POST_STATUS["DRAFT"]:
-            self._delete_post_file(post_id, POST_STATUS["DRAFT"])
-        
         post['status'] = POST_STATUS["SCHEDULED"]
         post['scheduled_time'] = scheduled_time
         
@@ -84,18 +609,99 @@ class PostManager:
         if not post:
             return None
         
-        # Перемещаем из scheduled в published
-        if post['status'] == POST_STATUS["SCHEDULED"]:
-            self._delete_post_file(post_id, POST_STATUS["SCHEDULED"])
-        
+        published_at = datetime.now()
         post['status'] = POST_STATUS["PUBLISHED"]
-        post['published_at'] = datetime.now().isoformat()
+        post['published_at'] = published_at.isoformat()
+        post['published_at_ts'] = published_at.timestamp()
         
         self._save_post(post)
+        self._record_publish(post['account_id'], published_at)
         log_success(f"Пост {post_id} опубликован")
         
         return post
     
+    def claim_post(self, post_id: str) -> Optional[str]:
+        """
+        Захватывает пост для публикации (атомарно для всех процессов и потоков)
+        
+        Returns:
+            Прежний статус поста или None, если пост удален, опубликован или уже публикуется
+            (брошенный захват с истекшим сроком перехватывается)
+        """
+        with self.db_lock, self._store_locked(exclusive=True):
+            # Под исключительной блокировкой видны все записи других процессов, и новых не появится
+            self._catch_up_store()
+            post = self._posts.get(post_id)
+            if not post or post['status'] == POST_STATUS["PUBLISHED"]:
+                return None
+            
+            if post['status'] == POST_STATUS["PUBLISHING"]:
+                if not self._claim_expired(post, time.time()):
+                    return None
+                previous_status = post.get('claimed_from', POST_STATUS["SCHEDULED"])
+            else:
+                previous_status = post['status']
+            
+            post = dict(post, status=POST_STATUS["PUBLISHING"], claimed_at=time.time(), claimed_from=previous_status)
+            self._write_store([post])
+            self._write_statuses([post])
+            self._remember_post(post)
+        
+        self.version += 1
+        
+        with self.schedule_lock:
+            self._sched_index.pop(post_id, None)
+        
+        return previous_status
+    
+    def expire_claims(self):
+        """Переводит в ошибку посты, захваченные для публикации и брошенные (срок захвата истек)"""
+        with self.db_lock:
+            self._sync_posts()
+            now = time.time()
+            if not any(post['status'] == POST_STATUS["PUBLISHING"] and self._claim_expired(post, now)
+                       for post in self._posts.values()):
+                return
+        
+        with self.db_lock, self._store_locked(exclusive=True):
+            self._catch_up_store()
+            expired = self._expire_claims_locked()
+        
+        if expired:
+            self.version += 1
+    
+    def _expire_claims_locked(self) -> List[Dict]:
+        """Переводит в ошибку брошенные захваты (вызывается под db_lock и исключительной блокировкой журнала)"""
+        now = time.time()
+        expired = [dict(post, status=POST_STATUS["ERROR"], error=CLAIM_EXPIRED_ERROR)
+                   for post in self._posts.values()
+                   if post['status'] == POST_STATUS["PUBLISHING"] and self._claim_expired(post, now)]
+        if not expired:
+            return expired
+        
+        self._write_store(expired)
+        self._write_statuses(expired)
+        for post in expired:
+            self._remember_post(post)
+            log_error(f"Ошибка поста {post['id']}: {CLAIM_EXPIRED_ERROR}")
+        return expired
+    
+    def _claim_expired(self, post: Dict, now: float) -> bool:
+        """Истек ли срок захвата поста для публикации"""
+        return now - post.get('claimed_at', 0) > PUBLISH_CLAIM_LEASE
+    
+    def release_post(self, post_id: str, status: str) -> Optional[Dict]:
+        """Возвращает захваченному посту прежний статус (публикация отложена)"""
+        post = self.get_post(post_id)
+        if not post or post['status'] != POST_STATUS["PUBLISHING"]:
+            return None
+        
+        post = dict(post, status=status)
+        # Без оповещения публикатора: отложенный пост повторится на следующей плановой проверке
+        self._save_post(post, notify=False)
+        
+        return post
+    
     def mark_post_error(self, post_id: str, error: str) -> Optional[Dict]:
         """Отмечает ошибку публикации"""
         post = self.get_post(post_id)
@@ -116,107 +722,110 @@ class PostManager:
         if not post:
             return
         
-        self._delete_post_file(post_id, post['status'])
+        self._delete_post_record(post_id)
         log_info(f"Удален пост {post_id}")
     
     def get_post(self, post_id: str) -> Optional[Dict]:
-        """Получает пост по ID"""
-        # Ищем во всех директориях
-        for status_dir in [DRAFTS_DIR, SCHEDULED_DIR, PUBLISHED_DIR]:
-            post_file = status_dir / f"{post_id}.json"
-            if post_file.exists():
-                try:
-                    with open(post_file, 'r', encoding='utf-8') as f:
-                        return json.load(f)
-                except Exception as e:
-                    log_error(f"Ошибка чтения поста {post_id}: {e}")
-        
-        return None
+        """Получает пост по ID (копию - ее можно менять до сохранения)"""
+        with self.db_lock:
+            self._sync_posts()
+            post = self._posts.get(post_id)
+        return dict(post) if post is not None else None
     
     def get_posts_by_account(self, account_id: str, status: Optional[str] = None) -> List[Dict]:
         """Получает все посты аккаунта"""
-        posts = []
-        
-        if status:
-            # Поиск только в определенной директории
-            status_dir = self._get_status_dir(status)
-            for post_file in status_dir.glob('*.json'):
-                try:
-                    with open(post_file, 'r', encoding='utf-8') as f:
-                        post = json.load(f)
-                        if post['account_id'] == account_id:
-                            posts.append(post)
-                except Exception:
-                    pass
-        else:
-            # Поиск во всех директориях
-            for status_dir in [DRAFTS_DIR, SCHEDULED_DIR, PUBLISHED_DIR]:
-                for post_file in status_dir.glob('*.json'):
-                    try:
-                        with open(post_file, 'r', encoding='utf-8') as f:
-                            post = json.load(f)
-                            if post['account_id'] == account_id:
-                                posts.append(post)
-                    except Exception:
-                        pass
-        
-        # Сортируем по дате создания
-        posts.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-        return posts
+        return self._query_posts(status=status, account_id=account_id)
     
     def get_all_posts(self, status: Optional[str] = None) -> List[Dict]:
         """Получает все посты"""
-        posts = []
-        
-        if status:
-            status_dir = self._get_status_dir(status)
-            dirs_to_search = [status_dir]
-        else:
-            dirs_to_search = [DRAFTS_DIR, SCHEDULED_DIR, PUBLISHED_DIR]
-        
-        for status_dir in dirs_to_search:
-            for post_file in status_dir.glob('*.json'):
-                try:
-                    with open(post_file, 'r', encoding='utf-8') as f:
-                        posts.append(json.load(f))
-                except Exception:
-                    pass
-        
-        # Сортируем по дате создания
-        posts.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-        return posts
+        return self._query_posts(status=status)
     
     def get_scheduled_posts(self) -> List[Dict]:
-        """Получает все запланированные посты"""
-        return self.get_all_posts(POST_STATUS["SCHEDULED"])
+        """Получает все запланированные посты (кэшируется до следующего изменения)"""
+        now = time.monotonic()
+        cached = self._scheduled_cache
+        if cached and cached[0] == self.version and now - cached[1] < SCHEDULED_CACHE_TTL:
+            return list(cached[2])
+        
+        version = self.version
+        posts = self.get_all_posts(POST_STATUS["SCHEDULED"])
+        self._scheduled_cache = (version, now, posts)
+        return list(posts)
     
-    def _save_post(self, post: Dict):
-        """Сохраняет пост в соответствующую директорию"""
+    def _save_post(self, post: Dict, notify: bool = True):
+        """Сохраняет новую версию поста (смена статуса - тоже одна запись в журнал)"""
         status = post['status']
-        status_dir = self._get_status_dir(status)
         
-        post_file = status_dir / f"{post['id']}.json"
-        with open(post_file, 'w', encoding='utf-8') as f:
-            json.dump(post, f, ensure_ascii=False, indent=2)
+        self._append_to_store([post])
+        
+        with self.db_lock:
+            # Копия - вызывающий код может продолжать менять свой объект
+            self._remember_post(dict(post))
+        
+        self.version += 1
+        
+        with self.schedule_lock:
+            if status == POST_STATUS["SCHEDULED"]:
+                self._index_scheduled(post)
+            else:
+                self._sched_index.pop(post['id'], None)
+        
+        if notify and status == POST_STATUS["SCHEDULED"]:
+            for callback in self.schedule_listeners:
+                callback()
     
-    def _delete_post_file(self, post_id: str, status: str):
-        """Удаляет файл поста"""
-        status_dir = self._get_status_dir(status)
-        post_file = status_dir / f"{post_id}.json"
+    def _delete_post_record(self, post_id: str):
+        """Удаляет пост: отметка удаления в журнале, удаление из памяти и расписания"""
+        self._append_to_store([{'id': post_id, 'deleted': True}])
+        
+        with self.db_lock:
+            self._forget_post(post_id)
+        
+        self.version += 1
         
-        if post_file.exists():
-            post_file.unlink()
+        with self.schedule_lock:
+            self._sched_index.pop(post_id, None)
     
     def _get_status_dir(self, status: str) -> Path:
-        """Получает директорию для статуса"""
-        if status == POST_STATUS["DRAFT"]:
-            return DRAFTS_DIR
-        elif status == POST_STATUS["SCHEDULED"]:
-            return SCHEDULED_DIR
-        elif status == POST_STATUS["PUBLISHED"]:
-            return PUBLISHED_DIR
-        else:
-            return DRAFTS_DIR
+        """Получает директорию (группу) статуса - по ней фильтруются выборки"""
+        return STATUS_DIRS.get(status, DRAFTS_DIR)
+    
+    def _before_fork(self):
+        """Закрывает соединение SQLite перед fork - его нельзя использовать в двух процессах"""
+        self.db_lock.acquire()
+        self.store_lock.acquire()
+        self.db.close()
+    
+    def _after_fork_in_parent(self):
+        """Открывает соединение SQLite заново в родительском процессе после fork"""
+        self.db = sqlite3.connect(str(POSTS_DB_FILE), check_same_thread=False)
+        self.store_lock.release()
+        self.db_lock.release()
+    
+    def _after_fork_in_child(self):
+        """Открывает в дочернем процессе (воркер Celery) свои соединение SQLite, журнал и файл блокировки"""
+        # Блокировки могли быть захвачены потоками родителя, которых в дочернем процессе нет
+        self.db_lock = threading.Lock()
+        self.store_lock = threading.Lock()
+        self.schedule_lock = threading.Lock()
+        self.publish_stats_lock = threading.Lock()
+        
+        self.db = sqlite3.connect(str(POSTS_DB_FILE), check_same_thread=False)
+        # data_version у нового соединения свой - при следующей выборке дочитываем журнал
+        self._data_version = None
+        self._open_store()
+        
+        # flock общий у унаследованного дескриптора: без своего файла блокировки процессы не исключают друг друга
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = os.open(POSTS_STORE_LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
 
 # Глобальный экземпляр менеджера
 post_manager = PostManager()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(
+        before=post_manager._before_fork,
+        after_in_parent=post_manager._after_fork_in_parent,
+        after_in_child=post_manager._after_fork_in_child
+    )
@@ -1,11 +1,14 @@
 """
 Планировщик времени публикаций
 """
-import json
+import os
+import threading
+import orjson
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from typing import List, Dict
 
-from config import SCHEDULER_FILE, POSTING_START_HOUR, POSTING_END_HOUR, DEFAULT_SETTINGS
+from config import SCHEDULER_FILE, POSTING_START_HOUR, POSTING_END_HOUR, MIN_POST_INTERVAL
 from utils.logger import log_info, log_success
 from modules.post_manager import post_manager
 
@@ -14,21 +17,52 @@ class PostScheduler:
     
     def __init__(self):
         self.schedule = self._load_schedule()
+        # Обратный индекс post_id -> account_id, чтобы не обходить расписания всех аккаунтов
+        self._post_accounts = {
+            item['post_id']: account_id
+            for account_id, items in self.schedule.items()
+            for item in items
+        }
+        # Расписание может изменяться из нескольких потоков одновременно
+        self.lock = threading.RLock()
+        # Пока открыт хотя бы один batched() - файл расписания не переписывается
+        self._batch_depth = 0
+        self._dirty = False
     
     def _load_schedule(self) -> Dict:
         """Загружает расписание из файла"""
         if SCHEDULER_FILE.exists():
             try:
-                with open(SCHEDULER_FILE, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                with open(SCHEDULER_FILE, 'rb') as f:
+                    return orjson.loads(f.read())
             except Exception:
                 pass
         return {}
     
+    @contextmanager
+    def batched(self):
+        """Откладывает сохранение расписания до выхода из блока (одна запись файла на пачку изменений)"""
+        with self.lock:
+            self._batch_depth += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self._batch_depth -= 1
+                if self._batch_depth == 0 and self._dirty:
+                    self._save_schedule()
+    
     def _save_schedule(self):
         """Сохраняет расписание в файл"""
-        with open(SCHEDULER_FILE, 'w', encoding='utf-8') as f:
-            json.dump(self.schedule, f, ensure_ascii=False, indent=2)
+        with self.lock:
+            if self._batch_depth:
+                self._dirty = True
+                return
+            self._dirty = False
+            # Через временный файл и os.replace - при сбое на диске остается прежнее расписание
+            tmp_file = SCHEDULER_FILE.with_suffix('.tmp')
+            tmp_file.write_bytes(orjson.dumps(self.schedule, option=orjson.OPT_INDENT_2))
+            os.replace(tmp_file, SCHEDULER_FILE)
     
     def schedule_posts_for_account(self, account_id: str, post_ids: List[str], 
                                    posts_per_day: int, start_date: datetime = None) -> List[Dict]:
@@ -65,7 +99,7 @@ class PostScheduler:
             start_time = start_time.replace(hour=POSTING_START_HOUR, minute=0)
         else:
             # В рабочее время - добавляем минимальный интервал к текущему времени
-            start_time = start_time + timedelta(minutes=DEFAULT_SETTINGS['min_post_interval'])
+            start_time = start_time + timedelta(minutes=MIN_POST_INTERVAL)
         
         scheduled_posts = []
         
@@ -76,46 +110,51 @@ class PostScheduler:
         current_day = 0
         post_index = 0
         
-        while post_index < total_posts:
-            # Количество постов на этот день
-            posts_today = min(posts_per_day, total_posts - post_index)
-            
-            # Равномерно распределяем по времени
-            scheduled_times = self._distribute_posts_in_day(
-                start_time + timedelta(days=current_day),
-                posts_today
-            )
-            
-            for scheduled_time in scheduled_times:
-                if post_index >= total_posts:
-                    break
-                
-                post_id = post_ids[post_index]
+        # Все посты аккаунта - одна запись расписания и одна запись журнала постов
+        with self.batched(), post_manager.batched():
+            while post_index < total_posts:
+                # Количество постов на этот день
+                posts_today = min(posts_per_day, total_posts - post_index)
                 
-                # Планируем пост
-                post = post_manager.schedule_post(
-                    post_id,
-                    scheduled_time.isoformat()
+                # Равномерно распределяем по времени
+                scheduled_times = self._distribute_posts_in_day(
+                    start_time + timedelta(days=current_day),
+                    posts_today
                 )
                 
-                if post:
-                    scheduled_posts.append(post)
+                for scheduled_time in scheduled_times:
+                    if post_index >= total_posts:
+                        break
                     
-                    # Добавляем в расписание
-                    if account_id not in self.schedule:
-                        self.schedule[account_id] = []
+                    post_id = post_ids[post_index]
                     
-                    self.schedule[account_id].append({
-                        'post_id': post_id,
-                        'scheduled_time': scheduled_time.isoformat(),
-                        'status': 'scheduled'
-                    })
+                    # Планируем пост
+                    post = post_manager.schedule_post(
+                        post_id,
+                        scheduled_time.isoformat()
+                    )
+                    
+                    if post:
+                        scheduled_posts.append(post)
+                        
+                        # Добавляем в расписание
+                        with self.lock:
+                            if account_id not in self.schedule:
+                                self.schedule[account_id] = []
+                            
+                            self.schedule[account_id].append({
+                                'post_id': post_id,
+                                'scheduled_time': scheduled_time.isoformat(),
+                                'status': 'scheduled'
+                            })
+                            self._post_accounts[post_id] = account_id
+                    
+                    post_index += 1
                 
-                post_index += 1
+                current_day += 1
             
-            current_day += 1
+            self._save_schedule()
         
-        self._save_schedule()
         log_success(f"Запланировано {len(scheduled_posts)} постов для аккаунта {account_id}")
         
         return scheduled_posts
@@ -130,7 +169,7 @@ class PostScheduler:
         
         # ВАЖНО: Если планируем на сегодня и start_time в прошлом, начинаем с текущего времени
         if start_time.date() == now.date() and start_time < now:
-            start_time = now + timedelta(minutes=DEFAULT_SETTINGS['min_post_interval'])
+            start_time = now + timedelta(minutes=MIN_POST_INTERVAL)
             # Округляем до ближайших 5 минут для красоты
             start_time = start_time.replace(second=0, microsecond=0)
             minute = (start_time.minute // 5) * 5
@@ -140,7 +179,7 @@ class PostScheduler:
         total_minutes = (end_time - start_time).total_seconds() / 60
         
         # Если времени недостаточно, переносим на следующий день
-        min_interval = DEFAULT_SETTINGS['min_post_interval']
+        min_interval = MIN_POST_INTERVAL
         required_minutes = posts_count * min_interval
         
         if total_minutes < required_minutes:
@@ -155,21 +194,16 @@ class PostScheduler:
         if interval < min_interval:
             interval = min_interval
         
-        scheduled_times = []
-        for i in range(posts_count):
-            scheduled_time = start_time + timedelta(minutes=interval * i)
-            
-            # Проверяем, что не выходим за пределы рабочего времени
-            if scheduled_time.hour >= POSTING_END_HOUR:
-                break
-            
-            # Дополнительная проверка: пост не в прошлом
-            if scheduled_time <= now:
-                continue
-            
-            scheduled_times.append(scheduled_time)
+        # Слоты идут по возрастанию - границы считаем сразу, а не проверяем каждый слот
+        step = timedelta(minutes=interval)
+        day_end = start_time.replace(hour=POSTING_END_HOUR, minute=0, second=0, microsecond=0)
+        
+        # Не выходим за пределы рабочего времени: слоты строго до day_end
+        last = min(posts_count, -((start_time - day_end) // step)) if day_end > start_time else 0
+        # Пропускаем слоты в прошлом (не позже now)
+        first = (now - start_time) // step + 1 if now >= start_time else 0
         
-        return scheduled_times
+        return [start_time + step * i for i in range(first, last)]
     
     def get_scheduled_posts_for_account(self, account_id: str) -> List[Dict]:
         """Получает все запланированные посты для аккаунта"""
@@ -177,22 +211,30 @@ class PostScheduler:
     
     def remove_from_schedule(self, post_id: str):
         """Удаляет пост из расписания"""
-        for account_id in self.schedule:
+        with self.lock:
+            account_id = self._post_accounts.pop(post_id, None)
+            if account_id is None:
+                return
+            
             self.schedule[account_id] = [
                 item for item in self.schedule[account_id]
                 if item['post_id'] != post_id
             ]
-        
-        self._save_schedule()
+            
+            self._save_schedule()
     
     def mark_as_published(self, post_id: str):
         """Отмечает пост как опубликованный в расписании"""
-        for account_id in self.schedule:
+        with self.lock:
+            account_id = self._post_accounts.get(post_id)
+            if account_id is None:
+                return
+            
             for item in self.schedule[account_id]:
                 if item['post_id'] == post_id:
                     item['status'] = 'published'
-        
-        self._save_schedule()
+            
+            self._save_schedule()
 
 # Глобальный экземпляр
 post_scheduler = PostScheduler()
@@ -1,22 +1,107 @@
 """
 Генератор видео через Kling AI (Segmind API)
 """
+import base64
+import os
 import requests
 import json
+import orjson
 from datetime import datetime
 from pathlib import Path
 
 from config import VIDEOS_DIR
+from utils.http_client import http_session
+from utils.media_index import media_index
 from utils.logger import log_info, log_error, log_success
 
+# Размер части при скачивании видео и буфер записи на диск
+VIDEO_CHUNK_SIZE = 1 << 16
+VIDEO_WRITE_BUFFER = 1 << 20
+# Минимальный размер видео (меньше - это не видео, а ошибка в теле ответа)
+MIN_VIDEO_SIZE = 1000
+# Часть изображения для base64 (кратна 3 - части кодируются без промежуточного "=")
+IMAGE_B64_CHUNK = 3 * (1 << 14)
+
+class ImagePayload:
+    """
+    JSON-тело запроса image-to-video, которое отдается частями: изображение кодируется
+    в base64 по ходу отправки, а не собирается целиком в памяти
+    """
+    
+    def __init__(self, fields: dict, image_path: str):
+        self.image_path = image_path
+        # base64 и закрывающие символы не требуют экранирования в JSON - дописываем их как есть
+        self.prefix = orjson.dumps(fields)[:-1] + b',"start_image":"data:image/jpeg;base64,'
+        self.suffix = b'"}'
+        image_size = os.path.getsize(image_path)
+        self.length = len(self.prefix) + 4 * ((image_size + 2) // 3) + len(self.suffix)
+    
+    def __len__(self):
+        # requests выставляет Content-Length по длине - без chunked-передачи
+        return self.length
+    
+    def __iter__(self):
+        yield self.prefix
+        with open(self.image_path, 'rb') as f:
+            while chunk := f.read(IMAGE_B64_CHUNK):
+                yield base64.b64encode(chunk)
+        yield self.suffix
+
 class VideoGenerator:
     """Генератор видео через Kling AI"""
     
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, session: requests.Session = None):
         self.api_key = api_key
+        # Общий пул соединений - без TLS-рукопожатия на каждый запрос
+        self.session = session or http_session
         # Используем новый Kling 2.0 endpoint
         self.api_url = "https://api.segmind.com/v1/kling-2"
     
+    def _save_video(self, response: requests.Response, filepath: Path) -> int:
+        """
+        Сохраняет видео из ответа Kling: бинарное тело или JSON со ссылкой (скачивается потоком)
+        
+        Returns:
+            Размер файла в байтах
+        """
+        content_type = response.headers.get('Content-Type', '')
+        
+        try:
+            # Если вернули JSON с URL
+            if 'application/json' in content_type:
+                try:
+                    result_json = response.json()
+                except json.JSONDecodeError:
+                    raise Exception(f"Не удалось распарсить JSON ответ: {response.text[:200]}")
+                log_info(f"📋 Получен JSON ответ: {result_json}")
+                
+                video_url = result_json.get('video_url') or result_json.get('url')
+                if not video_url:
+                    raise Exception(f"В ответе нет URL видео. Ответ: {result_json}")
+                log_info(f"🔗 Скачивание видео с URL: {video_url}")
+                
+                # stream=True - видео пишется на диск частями, а не держится целиком в памяти
+                with self.session.get(video_url, timeout=60, stream=True) as video_response:
+                    if video_response.status_code != 200:
+                        raise Exception(f"Не удалось скачать видео: HTTP {video_response.status_code}")
+                    with open(filepath, 'wb', buffering=VIDEO_WRITE_BUFFER) as f:
+                        for chunk in video_response.iter_content(chunk_size=VIDEO_CHUNK_SIZE):
+                            f.write(chunk)
+            else:
+                # Прямой бинарный контент видео
+                filepath.write_bytes(response.content)
+            
+            # Проверяем что получили видео
+            file_size = filepath.stat().st_size
+            if file_size < MIN_VIDEO_SIZE:
+                raise Exception(f"Полученный файл слишком мал ({file_size} байт). Возможно, это не видео.")
+        except Exception:
+            # Не оставляем недокачанный или неверный файл
+            filepath.unlink(missing_ok=True)
+            raise
+        
+        return file_size
+    
     def generate_video(self, prompt: str, duration: int = 5, 
                       aspect_ratio: str = "16:9", mode: str = "std") -> dict:
         """
@@ -62,7 +147,7 @@ class VideoGenerator:
             log_info(f"📤 Отправка запроса на {self.api_url}...")
             
             # Отправляем запрос
-            response = requests.post(
+            response = self.session.post(
                 self.api_url,
                 json=payload,
                 headers=headers,
@@ -72,44 +157,13 @@ class VideoGenerator:
             log_info(f"📥 Получен ответ: статус {response.status_code}")
             
             if response.status_code == 200:
-                # Проверяем тип контента
-                content_type = response.headers.get('Content-Type', '')
-                
-                # Если вернули JSON с URL
-                if 'application/json' in content_type:
-                    try:
-                        result_json = response.json()
-                        log_info(f"📋 Получен JSON ответ: {result_json}")
-                        
-                        # Если есть URL видео, скачиваем его
-                        if 'video_url' in result_json or 'url' in result_json:
-                            video_url = result_json.get('video_url') or result_json.get('url')
-                            log_info(f"🔗 Скачивание видео с URL: {video_url}")
-                            
-                            video_response = requests.get(video_url, timeout=60)
-                            if video_response.status_code != 200:
-                                raise Exception(f"Не удалось скачать видео: HTTP {video_response.status_code}")
-                            
-                            video_content = video_response.content
-                        else:
-                            raise Exception(f"В ответе нет URL видео. Ответ: {result_json}")
-                    except json.JSONDecodeError:
-                        raise Exception(f"Не удалось распарсить JSON ответ: {response.text[:200]}")
-                else:
-                    # Прямой бинарный контент видео
-                    video_content = response.content
-                
-                # Проверяем что получили видео
-                if len(video_content) < 1000:  # Минимальный размер видео
-                    raise Exception(f"Полученный файл слишком мал ({len(video_content)} байт). Возможно, это не видео.")
-                
                 # Сохраняем видео
                 timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
                 filename = f"{timestamp}.mp4"
                 filepath = VIDEOS_DIR / filename
                 
-                with open(filepath, 'wb') as f:
-                    f.write(video_content)
+                file_size = self._save_video(response, filepath)
+                media_index.add(filepath)
                 
                 # Сохраняем метаданные
                 metadata = {
@@ -119,14 +173,15 @@ class VideoGenerator:
                     'mode': mode,
                     'timestamp': timestamp,
                     'model': 'kling-ai',
-                    'file_size': len(video_content)
+                    'file_size': file_size
                 }
                 
                 metadata_file = VIDEOS_DIR / f"{timestamp}.json"
-                with open(metadata_file, 'w', encoding='utf-8') as f:
-                    json.dump(metadata, f, ensure_ascii=False, indent=2)
+                tmp_file = metadata_file.with_suffix('.tmp')
+                tmp_file.write_bytes(orjson.dumps(metadata, option=orjson.OPT_INDENT_2))
+                os.replace(tmp_file, metadata_file)
                 
-                log_success(f"✅ Видео сгенерировано: {filename} ({len(video_content) / 1024:.1f} KB)")
+                log_success(f"✅ Видео сгенерировано: {filename} ({file_size / 1024:.1f} KB)")
                 
                 return {
                     'success': True,
@@ -173,20 +228,13 @@ class VideoGenerator:
             log_info(f"🎬 Генерация видео из изображения через Kling 2.0: '{prompt[:50]}...'")
             log_info(f"🖼️ Исходное изображение: {image_path}")
             
-            # Читаем изображение и конвертируем в base64
-            import base64
-            with open(image_path, 'rb') as f:
-                image_data = f.read()
-                image_base64 = base64.b64encode(image_data).decode('utf-8')
-            
-            # Формируем payload для Kling 2.0 (с изображением)
+            # Формируем payload для Kling 2.0 (изображение кодируется в base64 при отправке)
             duration = duration if duration in [5, 10] else 5
             
-            payload = {
+            payload = ImagePayload({
                 "prompt": prompt,
-                "duration": duration,
-                "start_image": f"data:image/jpeg;base64,{image_base64}"
-            }
+                "duration": duration
+            }, image_path)
             
             headers = {
                 'x-api-key': self.api_key,
@@ -196,9 +244,9 @@ class VideoGenerator:
             log_info(f"📤 Отправка запроса image-to-video на {self.api_url}...")
             
             # Используем тот же endpoint Kling 2.0
-            response = requests.post(
+            response = self.session.post(
                 self.api_url,
-                json=payload,
+                data=payload,
                 headers=headers,
                 timeout=180
             )
@@ -206,44 +254,13 @@ class VideoGenerator:
             log_info(f"📥 Получен ответ: статус {response.status_code}")
             
             if response.status_code == 200:
-                # Проверяем тип контента
-                content_type = response.headers.get('Content-Type', '')
-                
-                # Если вернули JSON с URL
-                if 'application/json' in content_type:
-                    try:
-                        result_json = response.json()
-                        log_info(f"📋 Получен JSON ответ: {result_json}")
-                        
-                        # Если есть URL видео, скачиваем его
-                        if 'video_url' in result_json or 'url' in result_json:
-                            video_url = result_json.get('video_url') or result_json.get('url')
-                            log_info(f"🔗 Скачивание видео с URL: {video_url}")
-                            
-                            video_response = requests.get(video_url, timeout=60)
-                            if video_response.status_code != 200:
-                                raise Exception(f"Не удалось скачать видео: HTTP {video_response.status_code}")
-                            
-                            video_content = video_response.content
-                        else:
-                            raise Exception(f"В ответе нет URL видео. Ответ: {result_json}")
-                    except json.JSONDecodeError:
-                        raise Exception(f"Не удалось распарсить JSON ответ: {response.text[:200]}")
-                else:
-                    # Прямой бинарный контент видео
-                    video_content = response.content
-                
-                # Проверяем что получили видео
-                if len(video_content) < 1000:
-                    raise Exception(f"Полученный файл слишком мал ({len(video_content)} байт)")
-                
                 # Сохраняем видео
                 timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
                 filename = f"{timestamp}.mp4"
                 filepath = VIDEOS_DIR / filename
                 
-                with open(filepath, 'wb') as f:
-                    f.write(video_content)
+                file_size = self._save_video(response, filepath)
+                media_index.add(filepath)
                 
                 # Сохраняем метаданные
                 metadata = {
@@ -253,14 +270,15 @@ class VideoGenerator:
                     'mode': mode,
                     'timestamp': timestamp,
                     'model': 'kling-ai-image-to-video',
-                    'file_size': len(video_content)
+                    'file_size': file_size
                 }
                 
                 metadata_file = VIDEOS_DIR / f"{timestamp}.json"
-                with open(metadata_file, 'w', encoding='utf-8') as f:
-                    json.dump(metadata, f, ensure_ascii=False, indent=2)
+                tmp_file = metadata_file.with_suffix('.tmp')
+                tmp_file.write_bytes(orjson.dumps(metadata, option=orjson.OPT_INDENT_2))
+                os.replace(tmp_file, metadata_file)
                 
-                log_success(f"✅ Видео из изображения сгенерировано: {filename} ({len(video_content) / 1024:.1f} KB)")
+                log_success(f"✅ Видео из изображения сгенерировано: {filename} ({file_size / 1024:.1f} KB)")
                 
                 return {
                     'success': True,
@@ -0,0 +1,86 @@
+"""
+Celery задачи - публикация постов в отдельных процессах-воркерах
+
+Запуск:
+    celery -A tasks worker --concurrency=8
+    celery -A tasks beat
+"""
+import os
+from collections import defaultdict
+from celery import Celery
+from celery.signals import beat_init, worker_init
+from dotenv import load_dotenv
+
+# Загружаем переменные окружения
+load_dotenv()
+
+from modules.post_manager import post_manager
+from modules.scheduler import post_scheduler
+from modules.content_generator import ContentGenerator
+from modules.video_generator import VideoGenerator
+from background_publisher import background_publisher
+from utils.logger import log_error, log_success, use_watched_log_file
+
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+
+celery = Celery('instagram_auto_post', broker=CELERY_BROKER_URL, backend=CELERY_BROKER_URL)
+
+# Проверка запланированных постов (замена циклу фонового публикатора)
+celery.conf.beat_schedule = {
+    'check-scheduled-posts': {
+        'task': 'tasks.check_scheduled_posts_task',
+        'schedule': 30.0,
+    }
+}
+
+# Лог ротирует веб-процесс: при ротации в каждом воркере prefork процессы переименовывали бы файл друг у друга
+@worker_init.connect
+@beat_init.connect
+def _disable_log_rotation(**kwargs):
+    use_watched_log_file()
+
+@celery.task
+def publish_post_task(post_id: str):
+    """Публикует пост по ID"""
+    post = post_manager.get_post(post_id)
+    if not post:
+        log_error(f"❌ Пост {post_id} не найден для публикации")
+        return
+
+    # Публикации могли пройти в других воркерах - обновляем счетчики лимитов
+    post_manager.reload_publish_stats()
+    background_publisher._publish_post(post)
+
+@celery.task
+def check_scheduled_posts_task():
+    """Проверяет и публикует посты, время которых пришло"""
+    # Посты планируются в процессе веб-приложения - подхватываем изменения из журнала постов
+    post_manager.reload_schedule_index()
+    post_manager.reload_publish_stats()
+    background_publisher._check_and_publish()
+
+@celery.task
+def generate_posts_batch_task(plan: dict) -> int:
+    """Генерирует посты по плану через Batch API и планирует их (ответ Batch API - до 24 часов)"""
+    gemini_api_key = os.getenv('GEMINI_API_KEY')
+    if not gemini_api_key:
+        raise Exception("Gemini API не настроен")
+    
+    kling_api_key = os.getenv('KLING_API_KEY')
+    video_generator = VideoGenerator(kling_api_key) if kling_api_key else None
+    content_generator = ContentGenerator(gemini_api_key, video_generator=video_generator)
+    posts = content_generator.generate_posts_from_plan(plan, use_batch_api=True)
+    
+    posts_by_account = defaultdict(list)
+    for post in posts:
+        posts_by_account[post['account_id']].append(post['id'])
+    
+    for account_plan in plan['accounts']:
+        post_scheduler.schedule_posts_for_account(
+            account_plan['account_id'],
+            posts_by_account.get(account_plan['account_id'], []),
+            account_plan['posts_per_day']
+        )
+    
+    log_success(f"Пакетная генерация завершена: создано и запланировано {len(posts)} постов")
+    return len(posts)
@@ -2,8 +2,18 @@
 Утилиты для работы с датой и временем
 """
 from datetime import datetime
+from functools import lru_cache
 import re
 
+# Миллисекунды JavaScript (.000) в конце строки
+MILLISECONDS_RE = re.compile(r'\.\d{3}$')
+# Запасные форматы strptime (если не справился fromisoformat) - выбираются по длине строки
+FORMATS_BY_LENGTH = {
+    16: '%Y-%m-%dT%H:%M',  # Формат из datetime-local input (БЕЗ секунд!)
+    19: '%Y-%m-%dT%H:%M:%S',  # С секундами
+}
+FRACTION_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'  # С микросекундами
+
 def parse_iso_datetime(iso_string: str) -> datetime:
     """
     Парсит ISO datetime строку, включая формат JavaScript с .000Z
@@ -23,24 +33,30 @@ def parse_iso_datetime(iso_string: str) -> datetime:
         iso_string = iso_string[:-1]
     
     # Убираем миллисекунды если формат .000
-    iso_string = re.sub(r'\.\d{3}$', '', iso_string)
-    
-    # Пробуем разные форматы
-    formats_to_try = [
-        None,  # Пробуем fromisoformat
-        '%Y-%m-%dT%H:%M',  # Формат из datetime-local input (БЕЗ секунд!)
-        '%Y-%m-%dT%H:%M:%S',  # С секундами
-        '%Y-%m-%dT%H:%M:%S.%f'  # С микросекундами
-    ]
+    iso_string = MILLISECONDS_RE.sub('', iso_string)
     
-    for fmt in formats_to_try:
-        try:
-            if fmt is None:
-                return datetime.fromisoformat(iso_string)
-            else:
-                return datetime.strptime(iso_string, fmt)
-        except ValueError:
-            continue
+    # fromisoformat (C) разбирает все обычные варианты
+    try:
+        parsed = datetime.fromisoformat(iso_string)
+    except ValueError:
+        pass
+    else:
+        # Время со смещением (+05:00) переводим в локальное без tzinfo - его сравнивают с datetime.now()
+        return parsed.astimezone().replace(tzinfo=None) if parsed.tzinfo else parsed
     
-    raise ValueError(f"Не удалось распарсить время: {iso_string}")
+    # Один подходящий по длине формат вместо перебора всех
+    try:
+        return datetime.strptime(iso_string, FORMATS_BY_LENGTH.get(len(iso_string), FRACTION_FORMAT))
+    except ValueError:
+        raise ValueError(f"Не удалось распарсить время: {iso_string}") from None
+
 
+@lru_cache(maxsize=4096)
+def parse_iso_datetime_cached(iso_string: str) -> datetime:
+    """
+    parse_iso_datetime с мемоизацией по исходной строке
+    
+    Для горячих путей, где одно и то же время парсится многократно
+    (время публикации запланированных постов на каждом цикле публикатора)
+    """
+    return parse_iso_datetime(iso_string)
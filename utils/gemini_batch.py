@@ -0,0 +1,65 @@
+"""
+Пакетные запросы к Gemini через Batch API (без лимита запросов в минуту, дешевле, ответ - до 24 часов)
+"""
+import time
+from typing import Dict, List, Optional
+
+from utils.logger import log_info, log_error, log_success
+
+# Модель для пакетных запросов (экспериментальные модели Batch API не поддерживает)
+GEMINI_BATCH_MODEL = 'gemini-2.0-flash'
+# Интервал опроса статуса пакета (секунды)
+BATCH_POLL_INTERVAL = 30
+# Максимальное ожидание пакета - SLA Batch API
+BATCH_MAX_WAIT = 24 * 3600
+
+BATCH_DONE_STATES = {'JOB_STATE_SUCCEEDED', 'JOB_STATE_FAILED', 'JOB_STATE_CANCELLED', 'JOB_STATE_EXPIRED'}
+
+def run_batch(api_key: str, instruction: str, prompts: List[str],
+              generation_config: Optional[Dict] = None, display_name: str = 'instagram-posts') -> List[Optional[str]]:
+    """
+    Отправляет промпты одним пакетом и ждет результат
+
+    Args:
+        api_key: Gemini API ключ
+        instruction: Общие инструкции (system_instruction) для всех промптов
+        prompts: Промпты запросов
+        generation_config: Параметры генерации (например, ответ в JSON)
+        display_name: Название пакета
+
+    Returns:
+        Тексты ответов в порядке промптов (None - запрос пакета не выполнен)
+    """
+    # Batch API есть только в новом SDK - импортируем при использовании
+    from google import genai as genai_sdk
+
+    client = genai_sdk.Client(api_key=api_key)
+    config = dict(generation_config or {}, system_instruction=instruction)
+    requests = [
+        {'contents': [{'role': 'user', 'parts': [{'text': prompt}]}], 'config': config}
+        for prompt in prompts
+    ]
+
+    job = client.batches.create(model=GEMINI_BATCH_MODEL, src=requests, config={'display_name': display_name})
+    log_info(f"📦 Пакет Gemini отправлен: {job.name} ({len(prompts)} запросов)")
+
+    started = time.time()
+    while job.state.name not in BATCH_DONE_STATES:
+        if time.time() - started > BATCH_MAX_WAIT:
+            raise Exception(f"Пакет Gemini {job.name} не выполнен за {BATCH_MAX_WAIT // 3600} ч")
+        time.sleep(BATCH_POLL_INTERVAL)
+        job = client.batches.get(name=job.name)
+
+    if job.state.name != 'JOB_STATE_SUCCEEDED':
+        raise Exception(f"Пакет Gemini {job.name} завершился со статусом {job.state.name}")
+
+    results = []
+    for response in job.dest.inlined_responses:
+        if response.response:
+            results.append(response.response.text.strip())
+        else:
+            log_error(f"Ошибка запроса в пакете Gemini: {response.error}")
+            results.append(None)
+
+    log_success(f"✅ Пакет Gemini выполнен: {sum(1 for text in results if text)}/{len(prompts)} ответов")
+    return results
@@ -0,0 +1,88 @@
+"""
+Разбор ошибок квоты Gemini API
+"""
+import random
+import re
+from typing import Optional
+
+# Потолок ожидания, когда сервер не указал время повтора (секунды)
+MAX_BACKOFF_WAIT = 120
+# Сколько раз повторять запрос при ошибке квоты
+MAX_RATE_LIMIT_RETRIES = 8
+# Сколько раз повторять запрос при временной ошибке сервера/сети
+MAX_TRANSIENT_RETRIES = 3
+# Если сервер просит ждать дольше (секунды) - это не минутный лимит, а исчерпанная квота
+DAILY_QUOTA_MIN_WAIT = 600
+
+# Поле RetryInfo из тела ответа 429: JSON ("retryDelay": "40s") или protobuf-текст (retry_delay { seconds: 40 })
+RETRY_DELAY_FIELD_RE = re.compile(r'"?retry_?delay"?\s*(?::\s*"(\d+(?:\.\d+)?)s"|\{\s*seconds:\s*(\d+))', re.IGNORECASE)
+# "Your quota will reset after 12h34m16s"
+RESET_AFTER_RE = re.compile(r'reset after (?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s)?', re.IGNORECASE)
+# "Please retry in 39.5s"
+RETRY_IN_RE = re.compile(r'retry in (\d+(?:\.\d+)?)', re.IGNORECASE)
+# Временные ошибки сервера и сети - стоит быстро повторить
+TRANSIENT_ERROR_RE = re.compile(r'\b50[0234]\b|deadline[ _]exceeded|unavailable|internal error|timed? ?out|connection', re.IGNORECASE)
+# Признаки исчерпанного дневного лимита - ждать бессмысленно
+QUOTA_EXHAUSTED_RE = re.compile(r'daily limit|exhausted your capacity|per ?day|reset after \d+h', re.IGNORECASE)
+
+class QuotaExhaustedError(Exception):
+    """Дневной лимит Gemini исчерпан - повтор до сброса квоты не поможет"""
+
+    def __init__(self, message: str, wait_seconds: Optional[int] = None):
+        super().__init__(message)
+        self.wait_seconds = wait_seconds  # Время до сброса квоты, если сервер его указал
+
+def is_rate_limit_error(error_message: str) -> bool:
+    """Является ли ошибка ошибкой квоты/лимита запросов (429)"""
+    lower = error_message.lower()
+    return ("429" in error_message or "resource_exhausted" in lower or "resource has been exhausted" in lower
+            or "quota" in lower or "rate limit" in lower)
+
+def is_transient_error(error_message: str) -> bool:
+    """Является ли ошибка временной (5xx, таймаут, обрыв соединения)"""
+    return bool(TRANSIENT_ERROR_RE.search(error_message))
+
+def is_quota_exhausted(error_message: str) -> bool:
+    """Исчерпан ли дневной лимит (а не минутный)"""
+    if QUOTA_EXHAUSTED_RE.search(error_message):
+        return True
+    retry_seconds = parse_retry_delay(error_message)
+    return retry_seconds is not None and retry_seconds > DAILY_QUOTA_MIN_WAIT
+
+def parse_retry_delay(error_message: str) -> Optional[int]:
+    """
+    Извлекает время ожидания (секунды) из ошибки квоты
+
+    Returns:
+        Секунды ожидания или None, если сервер его не указал
+    """
+    match = RETRY_DELAY_FIELD_RE.search(error_message)
+    if match:
+        return int(float(match.group(1) or match.group(2))) + 1  # Округляем вверх
+
+    match = RESET_AFTER_RE.search(error_message)
+    if match and any(match.groups()):
+        hours, minutes, seconds = (int(group or 0) for group in match.groups())
+        return hours * 3600 + minutes * 60 + seconds + 1
+
+    match = RETRY_IN_RE.search(error_message)
+    if match:
+        return int(float(match.group(1))) + 1
+
+    return None
+
+def retry_wait_time(error_message: str, attempt: int) -> float:
+    """
+    Время ожидания перед повтором после ошибки квоты
+
+    Время из ответа сервера используется как есть (плюс небольшой разброс),
+    экспоненциальная задержка - только если сервер его не указал
+    """
+    retry_seconds = parse_retry_delay(error_message)
+    if retry_seconds is not None:
+        return retry_seconds + random.uniform(0, 2)
+    return min(2 ** attempt + random.uniform(0, 2), MAX_BACKOFF_WAIT)
+
+def transient_wait_time(attempt: int) -> float:
+    """Короткая задержка перед повтором после временной ошибки"""
+    return min(2 ** attempt, 8) + random.uniform(0, 1)
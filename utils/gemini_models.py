@@ -0,0 +1,72 @@
+"""
+Модели Gemini со статическими инструкциями в кэше контекста
+"""
+import os
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Dict, Optional
+
+import google.generativeai as genai
+from google.generativeai import caching
+
+from utils.logger import log_info
+
+# Кэш контекста можно отключить (например, если тариф его не поддерживает)
+GEMINI_PROMPT_CACHE_ENABLED = os.getenv('GEMINI_PROMPT_CACHE_ENABLED', '1') == '1'
+GEMINI_PROMPT_CACHE_TTL = timedelta(hours=1)
+
+class InstructionModel:
+    """Модель, у которой статическая часть промпта загружается в Gemini один раз"""
+
+    def __init__(self, model_name: str, instruction: str, name: str,
+                 ttl: timedelta = GEMINI_PROMPT_CACHE_TTL, generation_config: Optional[Dict] = None):
+        """
+        Args:
+            model_name: Имя модели Gemini
+            instruction: Статические инструкции (system_instruction)
+            name: Название для логов
+            ttl: Время жизни кэша контекста
+            generation_config: Параметры генерации (например, ответ в JSON)
+        """
+        self.model_name = model_name
+        self.instruction = instruction
+        self.name = name
+        self.ttl = ttl
+        self.generation_config = generation_config
+        self.lock = Lock()
+        self.model = None
+        self.expires = None  # None - модель без кэша контекста, не пересоздается
+
+    def get(self) -> genai.GenerativeModel:
+        """Возвращает модель, пересоздавая кэш контекста перед истечением TTL"""
+        with self.lock:
+            now = datetime.now()
+            if self.model and (self.expires is None or now < self.expires):
+                return self.model
+
+            if GEMINI_PROMPT_CACHE_ENABLED:
+                try:
+                    cached_content = caching.CachedContent.create(
+                        model=f'models/{self.model_name}',
+                        system_instruction=self.instruction,
+                        ttl=self.ttl
+                    )
+                    self.model = genai.GenerativeModel.from_cached_content(
+                        cached_content=cached_content,
+                        generation_config=self.generation_config
+                    )
+                    # Обновляем кэш чуть раньше истечения TTL
+                    self.expires = now + self.ttl - timedelta(seconds=60)
+                    log_info(f"💾 Инструкции ({self.name}) помещены в кэш контекста Gemini")
+                    return self.model
+                except Exception as e:
+                    # Модель не поддерживает кэш или инструкции меньше минимального размера
+                    log_info(f"Кэш контекста Gemini недоступен ({self.name}), используем system_instruction: {e}")
+
+            self.model = genai.GenerativeModel(
+                self.model_name,
+                system_instruction=self.instruction,
+                generation_config=self.generation_config
+            )
+            self.expires = None
+            return self.model
@@ -0,0 +1,24 @@
+"""
+Общий пул HTTP-соединений для внешних API (Kling, Pollinations)
+"""
+import atexit
+import requests
+from requests.adapters import HTTPAdapter
+
+def create_http_session(pool_connections: int = 10, pool_maxsize: int = 100) -> requests.Session:
+    """
+    Создает сессию с keep-alive пулом соединений
+
+    Args:
+        pool_connections: Количество хостов, для которых держим пулы
+        pool_maxsize: Максимум соединений в пуле одного хоста
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+# Глобальная сессия - TCP/TLS соединения переиспользуются между запросами
+http_session = create_http_session()
+atexit.register(http_session.close)
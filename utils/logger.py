@@ -1,27 +1,202 @@
 """
 Система логирования
 """
+import atexit
 import logging
+import os
+import queue
+import threading
+import time
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
 from config import APP_LOG_FILE
 
+# Формат строки лога
+LOG_FORMAT = '[%(asctime)s] %(levelname)s: %(message)s'
+LOG_DATEFMT = '%Y-%m-%d %H:%M:%S'
+# Буфер файла лога (байты)
+LOG_FILE_BUFFER = 1 << 16
+# Ротация лога: размер файла и количество архивных копий
+LOG_MAX_BYTES = 16 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+# Размер файла (и не ротирован ли он другим процессом) проверяется раз в столько записей, а не на каждой
+LOG_ROTATE_CHECK_EVERY = 256
+# Уровень логирования (WARNING и выше - информационные сообщения не формируются вовсе)
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# Окно чтения хвоста лога: примерная длина строки и минимальный размер (байты)
+LOG_TAIL_LINE_ESTIMATE = 256
+LOG_TAIL_MIN_CHUNK = 8192
+
+class BufferedFileHandler(RotatingFileHandler):
+    """Файловый обработчик с буфером и ротацией: записи копятся в памяти и пишутся на диск пачкой"""
+    
+    def __init__(self, filename, encoding=None):
+        super().__init__(filename, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT,
+                         encoding=encoding, delay=True)
+        self._records_since_check = 0
+        # Ротирует только веб-процесс; воркеры Celery лишь переоткрывают файл после его ротации
+        self.rotation_enabled = True
+    
+    def _open(self):
+        return open(self.baseFilename, self.mode, buffering=LOG_FILE_BUFFER, encoding=self.encoding)
+    
+    def emit(self, record):
+        # В отличие от FileHandler не сбрасываем буфер после каждой записи,
+        # а в отличие от RotatingFileHandler не проверяем размер файла на каждой
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+            # Ошибки пишем на диск сразу
+            if record.levelno >= logging.ERROR:
+                self.stream.flush()
+            
+            self._records_since_check += 1
+            if self._records_since_check >= LOG_ROTATE_CHECK_EVERY:
+                self._records_since_check = 0
+                self._check_file()
+        except Exception:
+            self.handleError(record)
+    
+    def _check_file(self):
+        """Переоткрывает файл, если его ротировал другой процесс, иначе при превышении размера ротирует сам"""
+        try:
+            replaced = os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino
+        except FileNotFoundError:
+            replaced = True
+        
+        if replaced:
+            # Буфер дописывается в старый (уже архивный) файл, новые записи - в новый
+            self.stream.close()
+            self.stream = self._open()
+        elif self.rotation_enabled and self.stream.tell() >= self.maxBytes:
+            self.doRollover()
+
+class CachedTimeFormatter(logging.Formatter):
+    """Форматтер, который пересчитывает время (strftime) не чаще раза в секунду - точность формата и так секунда"""
+    
+    def __init__(self, fmt=None, datefmt=None):
+        super().__init__(fmt, datefmt=datefmt)
+        # (секунда, строка) одним кортежем - замена атомарна, форматтер общий для нескольких потоков
+        self._cached_time = (None, None)
+    
+    def formatTime(self, record, datefmt=None):
+        if datefmt is None:
+            return super().formatTime(record)
+        second = int(record.created)
+        cached_second, cached_text = self._cached_time
+        if second == cached_second:
+            return cached_text
+        text = time.strftime(datefmt, self.converter(second))
+        self._cached_time = (second, text)
+        return text
+
+class FlushingQueueListener(QueueListener):
+    """Поток записи лога: сбрасывает файл, когда очередь опустела (пачка записей - одна запись на диск)"""
+    
+    def handle(self, record):
+        super().handle(record)
+        if self.queue.empty():
+            _file_handler.flush()
+
+_file_handler = BufferedFileHandler(APP_LOG_FILE, encoding='utf-8')
+_console_handler = logging.StreamHandler()
+_line_formatter = CachedTimeFormatter(LOG_FORMAT, datefmt=LOG_DATEFMT)
+for _handler in (_file_handler, _console_handler):
+    _handler.setFormatter(_line_formatter)
+
+# Потоки только кладут запись в очередь, в файл и консоль пишет один поток
+_queue_handler = QueueHandler(queue.SimpleQueue())
+# Сообщение форматируется при постановке в очередь, строка лога целиком - в потоке записи
+_queue_handler.setFormatter(logging.Formatter('%(message)s'))
+_listener = None
+
+def _start_log_listener():
+    global _listener
+    _listener = FlushingQueueListener(_queue_handler.queue, _file_handler, _console_handler,
+                                      respect_handler_level=True)
+    _listener.start()
+
+def _restart_log_listener_in_child():
+    """После fork (воркеры Celery) потока записи в дочернем процессе нет - запускаем заново с пустой очередью"""
+    _queue_handler.queue = queue.SimpleQueue()
+    _start_log_listener()
+
+def use_watched_log_file():
+    """Отключает ротацию лога в процессе (воркеры и beat Celery) - файл только переоткрывается после ротации"""
+    _file_handler.rotation_enabled = False
+
+_start_log_listener()
+# Буфер файла сбрасываем до fork, иначе дочерний процесс унаследует и допишет его второй раз (на Windows fork нет)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=_file_handler.flush, after_in_child=_restart_log_listener_in_child)
+# Дописываем очередь до logging.shutdown (atexit вызывает обработчики в обратном порядке)
+atexit.register(lambda: _listener.stop())
+
 # Настройка логгера
-logging.basicConfig(
-    level=logging.INFO,
-    format='[%(asctime)s] %(levelname)s: %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    handlers=[
-        logging.FileHandler(APP_LOG_FILE, encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+logging.basicConfig(level=LOG_LEVEL, handlers=[_queue_handler])
+
+# Формат использует только asctime/levelname/message - не собираем для записи файл/функцию/строку
+# (обход стека), поток и процесс. %(funcName)s и подобные в формате теперь будут пустыми
+logging._srcfile = None
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
+logging.logAsyncioTasks = False
 
 logger = logging.getLogger('instagram_auto_post')
+_INFO = logging.INFO
+
+# Префикс успешных операций - шаблон собирается один раз, а не конкатенацией на каждый вызов
+SUCCESS_PREFIX = "✅ "
+_SUCCESS_FORMAT = SUCCESS_PREFIX + "%s"
+# Шаблоны событий входа и публикации (аргументы подставляет logging, только если запись пишется)
+_ACCOUNT_LOGIN_OK = SUCCESS_PREFIX + "Аккаунт %s успешно залогинен"
+_ACCOUNT_LOGIN_ERROR = "Аккаунт %s не удалось залогинить: %s"
+_POST_PUBLISHED = SUCCESS_PREFIX + "Пост %s опубликован на %s"
+_POST_ERROR = "Ошибка публикации поста %s: %s"
+
+# Подписчики на новые записи лога (SSE-клиенты страницы логов)
+_subscribers = set()
+_subscribers_lock = threading.Lock()
+
+class BroadcastHandler(logging.Handler):
+    """Рассылает каждую новую запись лога всем подписчикам"""
+    
+    def emit(self, record):
+        if not _subscribers:
+            return
+        
+        line = self.format(record) + '\n'
+        with _subscribers_lock:
+            for subscriber in _subscribers:
+                try:
+                    subscriber.put_nowait(line)
+                except queue.Full:
+                    pass  # Медленный клиент - пропускаем запись
+
+_broadcast_handler = BroadcastHandler()
+_broadcast_handler.setFormatter(_line_formatter)
+logger.addHandler(_broadcast_handler)
+
+def subscribe_logs(maxsize: int = 1000) -> queue.Queue:
+    """Подписывается на новые записи лога"""
+    subscriber = queue.Queue(maxsize=maxsize)
+    with _subscribers_lock:
+        _subscribers.add(subscriber)
+    return subscriber
+
+def unsubscribe_logs(subscriber: queue.Queue):
+    """Отписывается от новых записей лога"""
+    with _subscribers_lock:
+        _subscribers.discard(subscriber)
 
 def log_info(message: str):
     """Логирует информационное сообщение"""
-    logger.info(message)
+    # isEnabledFor кэшируется в logging - отфильтрованный вызов стоит одной проверки
+    if logger.isEnabledFor(_INFO):
+        logger.info(message)
 
 def log_warning(message: str):
     """Логирует предупреждение"""
@@ -33,28 +208,39 @@ def log_error(message: str):
 
 def log_success(message: str):
     """Логирует успешную операцию"""
-    logger.info(f"✅ {message}")
+    if logger.isEnabledFor(_INFO):
+        logger.info(_SUCCESS_FORMAT, message)
 
 def log_account_login(username: str, success: bool, error: str = None):
     """Логирует попытку входа в аккаунт"""
     if success:
-        log_success(f"Аккаунт {username} успешно залогинен")
+        if logger.isEnabledFor(_INFO):
+            logger.info(_ACCOUNT_LOGIN_OK, username)
     else:
-        log_error(f"Аккаунт {username} не удалось залогинить: {error}")
+        logger.error(_ACCOUNT_LOGIN_ERROR, username, error)
 
 def log_post_published(post_id: str, account_username: str):
     """Логирует публикацию поста"""
-    log_success(f"Пост {post_id} опубликован на {account_username}")
+    if logger.isEnabledFor(_INFO):
+        logger.info(_POST_PUBLISHED, post_id, account_username)
 
 def log_post_error(post_id: str, error: str):
     """Логирует ошибку публикации поста"""
-    log_error(f"Ошибка публикации поста {post_id}: {error}")
+    logger.error(_POST_ERROR, post_id, error)
 
 def get_logs(limit: int = 100) -> list:
-    """Получает последние логи"""
+    """Получает последние логи (читает только хвост файла, как tail -n)"""
     try:
-        with open(APP_LOG_FILE, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-            return lines[-limit:]
+        with open(APP_LOG_FILE, 'rb') as f:
+            size = f.seek(0, os.SEEK_END)
+            chunk = min(size, max(limit * LOG_TAIL_LINE_ESTIMATE, LOG_TAIL_MIN_CHUNK))
+            while True:
+                f.seek(size - chunk)
+                lines = f.read(chunk).splitlines()
+                # Первая строка окна может быть обрезана - берем ее, только если дошли до начала файла
+                if len(lines) > limit or chunk == size:
+                    break
+                chunk = min(size, chunk * 2)
+        return [line.decode('utf-8', 'replace') + '\n' for line in lines[-limit:]] if limit > 0 else []
     except Exception:
         return []
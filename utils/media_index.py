@@ -0,0 +1,54 @@
+"""
+Индекс медиафайлов: имя файла -> полный путь
+"""
+import os
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Optional
+
+from config import PHOTOS_DIR, VIDEOS_DIR
+
+class MediaIndex:
+    """Индекс медиафайлов вместо проверки существования файла в каждой папке"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.files = None  # filename -> путь строкой (строится при первом обращении)
+
+    def get(self, filename: str) -> Optional[str]:
+        """Возвращает путь к медиафайлу или None"""
+        with self.lock:
+            if self.files is None:
+                self.files = self._scan()
+            path = self.files.get(filename)
+
+            # Файл мог появиться в обход индекса (другой процесс) или быть удален - пересканируем один раз
+            if path is None or not os.path.exists(path):
+                self.files = self._scan()
+                path = self.files.get(filename)
+
+        return path
+
+    def add(self, path: Path):
+        """Добавляет новый медиафайл в индекс"""
+        with self.lock:
+            if self.files is None:
+                return
+            # Тот же приоритет, что и при сканировании: фото не заменяется видео с тем же именем
+            existing = self.files.get(path.name)
+            if existing is None or path.parent == PHOTOS_DIR or Path(existing).parent != PHOTOS_DIR:
+                self.files[path.name] = str(path)
+
+    def _scan(self) -> Dict[str, str]:
+        """Сканирует папки медиа (фото имеют приоритет над видео)"""
+        files = {}
+        for directory in (VIDEOS_DIR, PHOTOS_DIR):
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        # entry.path уже готовый путь - без построения Path на каждый файл
+                        files[entry.name] = entry.path
+        return files
+
+# Глобальный экземпляр индекса
+media_index = MediaIndex()
@@ -0,0 +1,73 @@
+"""
+Шаблонные промпты для медиа - без запроса к Gemini
+"""
+import random
+import re
+from typing import List
+
+# Слова темы/ключевых слов
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+CYRILLIC_RE = re.compile(r'[а-яё]', re.IGNORECASE)
+
+# Служебные слова, которые в промпте не нужны
+RU_STOP_WORDS = {'и', 'в', 'во', 'на', 'для', 'с', 'со', 'о', 'об', 'по', 'из', 'к', 'от', 'до', 'за', 'а', 'или', 'как', 'про'}
+
+# Частые слова тем на русском -> английский (неизвестные слова передаются как есть - Pollinations их понимает)
+RU_EN_WORDS = {
+    'фитнес': 'fitness', 'спорт': 'sport', 'тренировка': 'workout', 'тренировки': 'workouts', 'йога': 'yoga',
+    'бег': 'running', 'здоровье': 'health', 'здоровый': 'healthy', 'здоровое': 'healthy', 'здоровая': 'healthy',
+    'питание': 'nutrition', 'еда': 'food', 'рецепт': 'recipe', 'рецепты': 'recipes', 'кухня': 'cuisine',
+    'кофе': 'coffee', 'чай': 'tea', 'завтрак': 'breakfast', 'десерт': 'dessert', 'выпечка': 'pastry',
+    'ресторан': 'restaurant', 'кафе': 'cafe', 'вино': 'wine', 'веган': 'vegan', 'диета': 'diet',
+    'путешествия': 'travel', 'путешествие': 'travel', 'туризм': 'tourism', 'отдых': 'vacation', 'море': 'sea',
+    'пляж': 'beach', 'горы': 'mountains', 'природа': 'nature', 'лес': 'forest', 'город': 'city',
+    'архитектура': 'architecture', 'закат': 'sunset', 'рассвет': 'sunrise', 'небо': 'sky',
+    'мода': 'fashion', 'стиль': 'style', 'одежда': 'clothing', 'красота': 'beauty', 'косметика': 'cosmetics',
+    'макияж': 'makeup', 'уход': 'care', 'кожа': 'skin', 'волосы': 'hair', 'маникюр': 'manicure',
+    'бизнес': 'business', 'маркетинг': 'marketing', 'финансы': 'finance', 'деньги': 'money', 'инвестиции': 'investing',
+    'карьера': 'career', 'успех': 'success', 'мотивация': 'motivation', 'саморазвитие': 'self-development',
+    'продуктивность': 'productivity', 'стартап': 'startup', 'офис': 'office', 'работа': 'work',
+    'технологии': 'technology', 'технология': 'technology', 'программирование': 'programming', 'код': 'code',
+    'искусственный': 'artificial', 'интеллект': 'intelligence', 'гаджеты': 'gadgets', 'смартфон': 'smartphone',
+    'компьютер': 'computer', 'игры': 'games', 'наука': 'science', 'космос': 'space',
+    'образование': 'education', 'обучение': 'learning', 'книги': 'books', 'книга': 'book', 'чтение': 'reading',
+    'язык': 'language', 'языки': 'languages', 'школа': 'school', 'университет': 'university',
+    'искусство': 'art', 'живопись': 'painting', 'фотография': 'photography', 'музыка': 'music', 'кино': 'cinema',
+    'дизайн': 'design', 'интерьер': 'interior', 'дом': 'home', 'ремонт': 'renovation', 'сад': 'garden',
+    'цветы': 'flowers', 'растения': 'plants', 'животные': 'animals', 'собаки': 'dogs', 'собака': 'dog',
+    'кошки': 'cats', 'кошка': 'cat', 'питомцы': 'pets', 'семья': 'family', 'дети': 'children',
+    'материнство': 'motherhood', 'свадьба': 'wedding', 'любовь': 'love', 'отношения': 'relationships',
+    'психология': 'psychology', 'медитация': 'meditation', 'осознанность': 'mindfulness', 'сон': 'sleep',
+    'автомобили': 'cars', 'автомобиль': 'car', 'недвижимость': 'real estate', 'экология': 'ecology',
+    'зима': 'winter', 'весна': 'spring', 'лето': 'summer', 'осень': 'autumn', 'праздник': 'holiday',
+    'новый': 'new', 'год': 'year', 'утро': 'morning', 'вечер': 'evening', 'лайфстайл': 'lifestyle',
+}
+
+# Сколько ключевых слов попадает в промпт
+TEMPLATE_MAX_KEYWORDS = 3
+
+# Варианты движения камеры и освещения для видео-промпта
+CAMERA_MOVES = ['slow dolly in', 'smooth pan right', 'crane up', 'orbit around subject', 'slow tracking shot']
+LIGHTING_STYLES = ['golden hour', 'soft natural lighting', 'neon accents', 'dramatic backlight']
+
+def to_english(phrase: str) -> str:
+    """Переводит тему/ключевое слово по словарю (неизвестные слова остаются без изменений)"""
+    if not CYRILLIC_RE.search(phrase):
+        return phrase.strip()
+    words = (word.lower() for word in WORD_RE.findall(phrase))
+    return ' '.join(RU_EN_WORDS.get(word, word) for word in words if word not in RU_STOP_WORDS)
+
+def image_prompt_from_template(theme: str, keywords: List[str]) -> str:
+    """Промпт изображения по теме и ключевым словам"""
+    prompt = f"Professional photography of {to_english(theme)}"
+    if keywords:
+        prompt += f", featuring {', '.join(to_english(keyword) for keyword in keywords[:TEMPLATE_MAX_KEYWORDS])}"
+    return prompt + ", high quality, vibrant colors, cinematic lighting, no text, no words"
+
+def video_prompt_from_template(theme: str, keywords: List[str]) -> str:
+    """Промпт видео по теме и ключевым словам (движение камеры и свет выбираются случайно)"""
+    subject = to_english(theme)
+    if keywords:
+        subject += f" with {', '.join(to_english(keyword) for keyword in keywords[:TEMPLATE_MAX_KEYWORDS])}"
+    return (f"Cinematic 5-second video of {subject}, {random.choice(CAMERA_MOVES)}, "
+            f"{random.choice(LIGHTING_STYLES)}, dynamic action, no text overlay, no words")
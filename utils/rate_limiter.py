@@ -1,54 +1,98 @@
 """
-Rate limiter для Gemini API
+Rate limiter для Gemini API и Pollinations
 """
+import itertools
+import logging
+import os
+import random
 import time
 from datetime import datetime, timedelta
 from threading import Lock
 
-class GeminiRateLimiter:
-    """Глобальный rate limiter для Gemini API"""
-    
-    def __init__(self, min_interval: float = 2.0):
+from utils.logger import logger
+
+# Лимит Gemini free tier - 15 запросов в минуту, оставляем запас в один запрос
+GEMINI_RPM = int(os.getenv('GEMINI_RPM', 14))
+# Pollinations без токена ограничивает частоту запросов с одного IP
+POLLINATIONS_RPM = int(os.getenv('POLLINATIONS_RPM', 12))
+# Случайная добавка к ожиданию, чтобы ждущие потоки не просыпались одновременно
+MAX_JITTER = 0.3
+# Ожидания дольше (секунды) видны в логе INFO, короткие - только на уровне DEBUG
+WAIT_LOG_MIN_SECONDS = 1.0
+# Окно счетчика запросов для статистики (секунды)
+STATS_WINDOW = 60.0
+
+class RateLimiter:
+    """
+    Глобальный rate limiter (token bucket в форме GCRA): запросы идут без пауз, пока есть запас,
+    а все состояние лимита - одно целое число (время следующего запроса в наносекундах)
+    """
+
+    def __init__(self, name: str, requests_per_minute: float, burst: int):
         """
         Args:
-            min_interval: Минимальный интервал между запросами в секундах
+            name: Название сервиса для логов
+            requests_per_minute: Средняя допустимая частота запросов
+            burst: Сколько запросов можно сделать подряд без ожидания
         """
-        self.min_interval = min_interval
-        self.last_request_time = None
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.burst = burst
+        # Интервал между запросами и допустимое опережение (запас burst) в наносекундах
+        self.interval_ns = int(60_000_000_000 / requests_per_minute)
+        self.burst_ns = (burst - 1) * self.interval_ns
+        # Теоретическое время следующего запроса по time.monotonic_ns (0 - запас полный)
+        self.next_ns = 0
         self.lock = Lock()
-        self.request_count = 0
-        self.reset_time = datetime.now() + timedelta(minutes=1)
-    
+        # Статистика ведется вне блокировки: next() у itertools.count атомарен под GIL,
+        # а гонка при сбросе окна допустима - это только отображение
+        self._request_numbers = itertools.count()
+        self._last_request_number = -1
+        self._window_start = 0  # Номер первого запроса текущего окна
+        # Время по монотонным часам (секунды); время по часам - только в get_stats()
+        self.last_request_time = None
+        self.reset_time = time.monotonic() + STATS_WINDOW
+
     def wait_if_needed(self):
-        """Ждет если необходимо соблюсти rate limit"""
+        """Резервирует место для запроса, ожидая, если запас исчерпан"""
+        # Под блокировкой только резервируем слот - ждут потоки уже без нее, каждый своего слота
         with self.lock:
-            now = datetime.now()
-            
-            # Сброс счетчика каждую минуту
-            if now >= self.reset_time:
-                self.request_count = 0
-                self.reset_time = now + timedelta(minutes=1)
-            
-            # Проверяем последний запрос
-            if self.last_request_time:
-                elapsed = (now - self.last_request_time).total_seconds()
-                
-                if elapsed < self.min_interval:
-                    wait_time = self.min_interval - elapsed
-                    print(f"⏳ Rate limiter: ожидание {wait_time:.1f}s перед следующим запросом к Gemini...")
-                    time.sleep(wait_time)
-            
-            self.last_request_time = datetime.now()
-            self.request_count += 1
-    
+            now_ns = time.monotonic_ns()
+            next_ns = max(self.next_ns, now_ns)
+            self.next_ns = next_ns + self.interval_ns
+        wait_ns = next_ns - self.burst_ns - now_ns
+
+        if wait_ns > 0:
+            wait_time = wait_ns / 1e9 + random.uniform(0, MAX_JITTER)
+            if wait_time > WAIT_LOG_MIN_SECONDS:
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info("⏳ Rate limiter: ожидание %.1fs перед следующим запросом к %s...", wait_time, self.name)
+            elif logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Rate limiter %s: ожидание %.1fs", self.name, wait_time)
+            time.sleep(wait_time)
+
+        number = next(self._request_numbers)
+        now = time.monotonic()
+        # Сброс счетчика каждую минуту
+        if now >= self.reset_time:
+            self._window_start = number
+            self.reset_time = now + STATS_WINDOW
+
+        self.last_request_time = now
+        self._last_request_number = number
+
     def get_stats(self):
         """Возвращает статистику запросов"""
+        # Переводим монотонное время в время по часам только для отображения
+        now = time.monotonic()
+        wall_now = datetime.now()
+        last_request = self.last_request_time
         return {
-            'request_count': self.request_count,
-            'last_request': self.last_request_time.isoformat() if self.last_request_time else None,
-            'reset_time': self.reset_time.isoformat()
+            'request_count': max(0, self._last_request_number + 1 - self._window_start),
+            'last_request': (wall_now - timedelta(seconds=now - last_request)).isoformat() if last_request is not None else None,
+            'reset_time': (wall_now + timedelta(seconds=self.reset_time - now)).isoformat()
         }
 
-# Глобальный экземпляр rate limiter
-gemini_rate_limiter = GeminiRateLimiter(min_interval=2.5)  # 2.5 секунды между запросами
-
+# Глобальные экземпляры rate limiter
+gemini_rate_limiter = RateLimiter('Gemini', requests_per_minute=GEMINI_RPM, burst=GEMINI_RPM)
+pollinations_rate_limiter = RateLimiter('Pollinations', requests_per_minute=POLLINATIONS_RPM, burst=3)
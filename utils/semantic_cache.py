@@ -0,0 +1,192 @@
+"""
+Семантический кэш ответов Gemini
+"""
+import hashlib
+import math
+import os
+import orjson
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from typing import Callable, List, Optional, Tuple
+
+from utils.logger import log_info, log_error
+
+# Сколько записей хранит кэш (давно не использованные вытесняются, файл периодически сжимается)
+SEMANTIC_CACHE_MAX_ENTRIES = 1000
+# Сколько эмбеддингов промахов get() ждут put() того же запроса
+PENDING_VECTORS_MAX = 64
+
+# Разные написания языка в плане -> одно название
+LANGUAGE_ALIASES = {
+    'ru': 'русский', 'rus': 'русский', 'russian': 'русский',
+    'en': 'английский', 'eng': 'английский', 'english': 'английский',
+    'kk': 'казахский', 'kz': 'казахский', 'kazakh': 'казахский', 'қазақ': 'казахский', 'қазақша': 'казахский',
+}
+
+def prompt_key(theme: str, language: str, keywords: List[str]) -> str:
+    """
+    Ключ запроса текста поста: одинаковый для запросов, отличающихся только
+    регистром, пробелами, порядком ключевых слов и написанием языка
+    """
+    language = ' '.join(language.lower().split())
+    language = LANGUAGE_ALIASES.get(language, language)
+    normalized = '|'.join((
+        ' '.join(theme.lower().split()),
+        language,
+        ','.join(sorted(' '.join(keyword.lower().split()) for keyword in keywords)),
+    ))
+    return hashlib.blake2b(normalized.encode(), digest_size=16).hexdigest()
+
+class SemanticCache:
+    """Кэш ответов по смысловой близости запроса (косинусное сходство эмбеддингов)"""
+
+    def __init__(self, cache_file: Path, embed_func: Callable[[str], List[float]],
+                 threshold: float = 0.92, max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES):
+        """
+        Args:
+            cache_file: JSONL файл для хранения записей кэша
+            embed_func: Функция получения эмбеддинга для текста
+            threshold: Минимальное косинусное сходство для попадания в кэш
+            max_entries: Сколько записей хранить (давно не использованные вытесняются)
+        """
+        self.cache_file = cache_file
+        self.embed_func = embed_func
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.lock = Lock()
+        # (namespace, нормализованный key) -> (нормированный вектор или None, value); порядок - LRU
+        self.entries: OrderedDict = OrderedDict()
+        # Эмбеддинги промахов get() - put() того же запроса не запрашивает их повторно
+        self.pending_vectors: OrderedDict = OrderedDict()
+        self.file_records = 0  # Сколько строк в файле кэша (с устаревшими)
+        self._load()
+
+    def get(self, text: str, namespace: str = '') -> Optional[str]:
+        """
+        Возвращает сохраненный ответ для похожего запроса или None
+
+        Args:
+            text: Текст запроса
+            namespace: Сравниваются только записи с тем же namespace
+        """
+        key = self._normalize(text)
+
+        # Точное совпадение - без запроса эмбеддинга
+        with self.lock:
+            entry = self.entries.get((namespace, key))
+            if entry:
+                self.entries.move_to_end((namespace, key))
+                return entry[1]
+            if not any(entry_namespace == namespace and vector
+                       for (entry_namespace, _), (vector, _) in self.entries.items()):
+                return None
+
+        try:
+            vector = self._unit(self.embed_func(text))
+        except Exception as e:
+            log_error(f"Ошибка получения эмбеддинга для кэша: {e}")
+            return None
+
+        best_score, best_entry = 0.0, None
+        with self.lock:
+            for entry_key, (entry_vector, _) in self.entries.items():
+                if entry_key[0] != namespace or not entry_vector:
+                    continue
+                score = sum(a * b for a, b in zip(vector, entry_vector))
+                if score > best_score:
+                    best_score, best_entry = score, entry_key
+
+            if best_entry and best_score >= self.threshold:
+                self.entries.move_to_end(best_entry)
+                log_info(f"💾 Семантический кэш: попадание (сходство {best_score:.3f})")
+                return self.entries[best_entry][1]
+
+            # Промах - за ним обычно следует put() того же запроса
+            self.pending_vectors[(namespace, key)] = vector
+            while len(self.pending_vectors) > PENDING_VECTORS_MAX:
+                self.pending_vectors.popitem(last=False)
+        return None
+
+    def put(self, text: str, value: str, namespace: str = ''):
+        """Сохраняет ответ в кэш и дописывает запись на диск"""
+        key = self._normalize(text)
+
+        with self.lock:
+            vector = self.pending_vectors.pop((namespace, key), None)
+
+        if vector is None:
+            try:
+                vector = self._unit(self.embed_func(text))
+            except Exception as e:
+                log_error(f"Ошибка получения эмбеддинга для кэша: {e}")
+
+        with self.lock:
+            self._remember((namespace, key), vector or None, value)
+
+            # Файл копит перезаписанные и вытесненные записи - переписываем его, когда их больше актуальных
+            if self.file_records >= 2 * self.max_entries:
+                self._compact()
+                return
+
+            try:
+                self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.cache_file, 'ab') as f:
+                    record = {'namespace': namespace, 'key': key, 'vector': vector or None, 'value': value}
+                    f.write(orjson.dumps(record) + b'\n')
+                self.file_records += 1
+            except Exception as e:
+                log_error(f"Ошибка записи семантического кэша: {e}")
+
+    def _remember(self, entry_key: Tuple[str, str], vector: Optional[List[float]], value: str):
+        """Добавляет запись в память, вытесняя давно не использованные (вызывается под lock)"""
+        self.entries[entry_key] = (vector, value)
+        self.entries.move_to_end(entry_key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _load(self):
+        """Загружает записи кэша с диска"""
+        if not self.cache_file.exists():
+            return
+
+        try:
+            with open(self.cache_file, 'rb') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = orjson.loads(line)
+                    self.file_records += 1
+                    self._remember((record.get('namespace', ''), record['key']), record.get('vector'), record['value'])
+        except Exception as e:
+            log_error(f"Ошибка загрузки семантического кэша: {e}")
+
+        if self.file_records > len(self.entries):
+            self._compact()
+
+    def _compact(self):
+        """Переписывает файл кэша: только записи из памяти, в порядке использования"""
+        tmp_file = self.cache_file.with_name(f"{self.cache_file.name}.tmp")
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_file, 'wb') as f:
+                for (namespace, key), (vector, value) in self.entries.items():
+                    record = {'namespace': namespace, 'key': key, 'vector': vector, 'value': value}
+                    f.write(orjson.dumps(record) + b'\n')
+            os.replace(tmp_file, self.cache_file)
+            self.file_records = len(self.entries)
+        except Exception as e:
+            log_error(f"Ошибка сжатия семантического кэша: {e}")
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        """Нормализует текст запроса для точного сравнения"""
+        return ' '.join(text.lower().split())
+
+    @staticmethod
+    def _unit(vector: List[float]) -> List[float]:
+        """Нормирует вектор (скалярное произведение = косинусное сходство)"""
+        norm = math.sqrt(sum(x * x for x in vector))
+        if not norm:
+            return []
+        return [x / norm for x in vector]